@@ -14,6 +14,35 @@ ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
 # Rate update interval (seconds)
 UPDATE_INTERVAL = int(os.getenv("UPDATE_INTERVAL", 60))
 
+# How update_all_rates persists rates:
+# "diff" = upsert only rows that changed since the last refresh
+# "full" = upsert every row on every refresh
+RATE_WRITE_MODE = os.getenv("RATE_WRITE_MODE", "diff")
+
+# Notification delivery (Telegram allows ~30 msg/s per bot, ~1 msg/s per chat)
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", 8))
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", 28))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", 1.0))
+
+# Rate history retention per tier (days): raw samples, hourly and daily OHLC
+HISTORY_RAW_DAYS = int(os.getenv("HISTORY_RAW_DAYS", 7))
+HISTORY_HOURLY_DAYS = int(os.getenv("HISTORY_HOURLY_DAYS", 180))
+HISTORY_DAILY_DAYS = int(os.getenv("HISTORY_DAILY_DAYS", 1825))
+
+# Chart rendering: worker processes, max queued charts, seconds per chart
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", 2))
+CHART_QUEUE_LIMIT = int(os.getenv("CHART_QUEUE_LIMIT", 16))
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", 20))
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", 32 * 1024 * 1024))
+CHART_PRERENDER_TOP = int(os.getenv("CHART_PRERENDER_TOP", 6))
+
+# User profile cache (language, settings, favorites)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 50000))
+
+# Queries one update may run before it is logged as over budget
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 10))
+
 # Logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
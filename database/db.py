@@ -1,14 +1,22 @@
 """
 Database Connection - Uses config.DATABASE_URL
-With automatic migration for new columns
+Schema changes are applied by database.migrations on startup
+
+Inside request_scope() (one Telegram update) every get_session() of the
+handling task shares one session, so a handler uses a single connection
+and its queries can be counted. Tasks started from a handler and all
+background jobs get their own sessions as before.
 """
+import asyncio
 import os
 import logging
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import text
 
-from database.models import Base
+from database.migrations import migrate
 from config import DATABASE_URL
 
 logger = logging.getLogger(__name__)
@@ -32,9 +40,63 @@ else:
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+class RequestScope:
+    """Session shared by one update's handler, with a query counter"""
+    
+    def __init__(self):
+        self.task = asyncio.current_task()
+        self.queries = 0
+        self._session: Optional[AsyncSession] = None
+    
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = async_session()
+            event.listen(self._session.sync_session, "after_begin", self._watch)
+        return self._session
+    
+    def _watch(self, session, transaction, connection) -> None:
+        # Counted at the cursor, so ORM flushes and Core statements are included
+        event.listen(connection, "before_cursor_execute", self._count)
+    
+    def _count(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.queries += 1
+    
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_request_scope: ContextVar[Optional[RequestScope]] = ContextVar("request_scope", default=None)
+
+
+@asynccontextmanager
+async def request_scope():
+    """Share one session between all get_session() calls of the current task"""
+    scope = RequestScope()
+    token = _request_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _request_scope.reset(token)
+        await scope.close()
+
+
 @asynccontextmanager
 async def get_session():
-    """Get database session"""
+    """Get database session (the request's shared one inside request_scope)"""
+    scope = _request_scope.get()
+    # Tasks spawned from a handler inherit the scope but must not share its session
+    if scope is not None and scope.task is asyncio.current_task():
+        session = scope.session
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        return
+    
     session = async_session()
     try:
         yield session
@@ -45,55 +107,45 @@ async def get_session():
         await session.close()
 
 
-async def init_db():
-    """Initialize database tables and run migrations"""
-    async with engine.begin() as conn:
-        # Create tables
-        await conn.run_sync(Base.metadata.create_all)
+def insert_for_dialect(model):
+    """INSERT construct that supports ON CONFLICT for the configured database"""
+    if "postgresql" in DATABASE_URL:
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+async def bulk_upsert(session, model, rows: list[dict], index_elements: list[str],
+                      update_columns: list[str] = None) -> int:
+    """
+    Insert rows in one statement, updating on conflict with index_elements
     
-    # Run migrations for existing tables
-    await run_migrations()
+    If update_columns is empty, conflicting rows are left untouched
+    (INSERT ... ON CONFLICT DO NOTHING).
+    """
+    if not rows:
+        return 0
     
-    db_type = "PostgreSQL" if "postgresql" in DATABASE_URL else "SQLite"
-    logger.info(f"Database initialized: {db_type}")
+    stmt = insert_for_dialect(model)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={col: stmt.excluded[col] for col in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    
+    await session.execute(stmt, rows)
+    return len(rows)
 
 
-async def run_migrations():
-    """Add missing columns to existing tables"""
-    migrations = [
-        # Alert table - is_paused column
-        ("alerts", "is_paused", "BOOLEAN DEFAULT FALSE"),
-        # SmartExchange table - snooze_until column
-        ("smart_exchanges", "snooze_until", "TIMESTAMP"),
-    ]
+async def init_db():
+    """Create or migrate the schema (a single version check when current)"""
+    await migrate(engine)
     
-    async with engine.begin() as conn:
-        for table, column, col_type in migrations:
-            try:
-                # Check if column exists
-                if "postgresql" in DATABASE_URL:
-                    check_sql = text(f"""
-                        SELECT column_name FROM information_schema.columns 
-                        WHERE table_name = '{table}' AND column_name = '{column}'
-                    """)
-                    result = await conn.execute(check_sql)
-                    exists = result.fetchone() is not None
-                    
-                    if not exists:
-                        # Add column
-                        add_sql = text(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
-                        await conn.execute(add_sql)
-                        logger.info(f"Migration: added {table}.{column}")
-                else:
-                    # SQLite - try to add, ignore if exists
-                    try:
-                        add_sql = text(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
-                        await conn.execute(add_sql)
-                        logger.info(f"Migration: added {table}.{column}")
-                    except Exception:
-                        pass  # Column already exists
-            except Exception as e:
-                logger.debug(f"Migration skip {table}.{column}: {e}")
+    db_type = "PostgreSQL" if "postgresql" in DATABASE_URL else "SQLite"
+    logger.info(f"Database initialized: {db_type}")
 
 
 async def close_db():
@@ -0,0 +1,267 @@
+"""
+Schema Migrations - Versioned, each applied exactly once
+
+Applied versions are recorded in the schema_version table. On startup a
+single SELECT MAX(version) decides whether anything needs to run; a fresh
+database gets the full schema from the models and is stamped as current.
+
+Each migration runs in its own transaction together with its version
+row. Migrations marked online run on an autocommit connection instead, so
+PostgreSQL can build indexes with CREATE INDEX CONCURRENTLY and backfills
+commit batch by batch without locking whole tables. Online steps must be
+idempotent (IF NOT EXISTS, WHERE ... IS NULL), since a crash can interrupt
+them before the version is recorded.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime,
+    select, insert, func, inspect, text
+)
+from sqlalchemy.schema import CreateIndex
+
+from database.models import Base
+
+logger = logging.getLogger(__name__)
+
+# Rows per batch in backfills (one transaction each in online migrations)
+BACKFILL_BATCH_SIZE = 5000
+
+# pg_advisory_lock key so only one process migrates at a time
+MIGRATION_LOCK_ID = 7_201_905
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """One schema change"""
+    version: int
+    name: str
+    upgrade: Callable[..., Awaitable[None]]  # async upgrade(conn)
+    online: bool = False  # Run on an autocommit connection
+
+
+def is_postgres(conn) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def is_autocommit(conn) -> bool:
+    return conn.sync_connection.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+
+
+async def add_column(conn, table: str, column: str, ddl: str) -> None:
+    """ALTER TABLE ... ADD COLUMN unless the column exists"""
+    columns = await conn.run_sync(lambda c: [col["name"] for col in inspect(c).get_columns(table)])
+    if column in columns:
+        return
+    await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    logger.info(f"Migration: added {table}.{column}")
+
+
+async def create_table(conn, table: str) -> None:
+    """Create a model table (and its indexes) if missing"""
+    await conn.run_sync(Base.metadata.tables[table].create, checkfirst=True)
+
+
+def find_index(table: str, name: str):
+    """Index declared on a model table"""
+    for index in Base.metadata.tables[table].indexes:
+        if index.name == name:
+            return index
+    raise KeyError(f"Index {name} is not declared on {table}")
+
+
+async def create_index(conn, table: str, name: str) -> None:
+    """
+    Create a model index if missing
+
+    On PostgreSQL (online migrations) the index is built CONCURRENTLY, so
+    writes to the table continue meanwhile. An invalid leftover from an
+    interrupted concurrent build is dropped first.
+    """
+    index = find_index(table, name)
+    sql = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+
+    if is_postgres(conn) and is_autocommit(conn):
+        invalid = await conn.execute(
+            text(
+                "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ),
+            {"name": name}
+        )
+        if invalid.first():
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        sql = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", sql)
+
+    await conn.execute(text(sql))
+    logger.info(f"Migration: index {name} on {table}")
+
+
+async def backfill(conn, table: str, assignments: str, condition: str,
+                   batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    UPDATE table SET assignments WHERE condition, batch_size rows at a time
+
+    On an autocommit connection every batch is its own transaction.
+    The condition must stop matching updated rows.
+    """
+    total = 0
+    while True:
+        result = await conn.execute(text(
+            f"UPDATE {table} SET {assignments} WHERE id IN "
+            f"(SELECT id FROM {table} WHERE {condition} LIMIT {batch_size})"
+        ))
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            break
+    if total:
+        logger.info(f"Migration: backfilled {total} rows in {table}")
+    return total
+
+
+# ============ Migrations ============
+
+async def alerts_is_paused(conn) -> None:
+    await add_column(conn, "alerts", "is_paused", "BOOLEAN DEFAULT FALSE")
+
+
+async def smart_exchanges_snooze_until(conn) -> None:
+    await add_column(conn, "smart_exchanges", "snooze_until", "TIMESTAMP")
+
+
+async def rates_unique_bank_currency(conn) -> None:
+    # One row per (bank, currency), backs the diff upsert
+    await conn.execute(text(
+        "DELETE FROM rates WHERE id NOT IN "
+        "(SELECT MIN(id) FROM rates GROUP BY bank_code, currency_code)"
+    ))
+    await create_index(conn, "rates", "uq_rates_bank_currency")
+
+
+async def hot_path_indexes(conn) -> None:
+    for table, name in (
+        ("users", "ix_users_daily_notify_time"),
+        ("alerts", "ix_alerts_user_id"),
+        ("alerts", "ix_alerts_active_triggered"),
+        ("rate_history", "ix_rate_history_currency_bank_time"),
+        ("rate_history", "ix_rate_history_recorded_at"),
+        ("portfolio", "ix_portfolio_user_id"),
+        ("favorite_banks", "ix_favorite_banks_user_bank"),
+        ("smart_exchanges", "ix_smart_exchanges_open"),
+    ):
+        await create_index(conn, table, name)
+
+
+async def users_default_notify_time(conn) -> None:
+    # The daily digest matches on the time, so users with NULL never got it
+    await backfill(conn, "users", "daily_notify_time = '09:00'", "daily_notify_time IS NULL")
+
+
+async def rate_history_agg_table(conn) -> None:
+    await create_table(conn, "rate_history_agg")
+
+
+async def indicator_state_table(conn) -> None:
+    await create_table(conn, "indicator_state")
+
+
+MIGRATIONS = [
+    Migration(1, "alerts.is_paused", alerts_is_paused),
+    Migration(2, "smart_exchanges.snooze_until", smart_exchanges_snooze_until),
+    Migration(3, "rates unique (bank_code, currency_code)", rates_unique_bank_currency, online=True),
+    Migration(4, "hot path indexes", hot_path_indexes, online=True),
+    Migration(5, "users.daily_notify_time default", users_default_notify_time, online=True),
+    Migration(6, "rate_history_agg table", rate_history_agg_table),
+    Migration(7, "indicator_state table", indicator_state_table),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(engine) -> Optional[int]:
+    """Highest applied version, None if the database was never versioned"""
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(select(func.max(schema_version.c.version)))
+            return result.scalar() or 0
+    except Exception:
+        return None
+
+
+async def record_version(conn, migration: Migration) -> None:
+    await conn.execute(insert(schema_version).values(
+        version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+    ))
+
+
+async def migrate(engine) -> int:
+    """
+    Bring the schema up to date
+
+    Returns:
+        Number of migrations applied
+    """
+    version = await current_version(engine)
+    if version == LATEST_VERSION:
+        return 0
+
+    async with engine.connect() as lock_conn:
+        # Autocommit: an idle open transaction would stall concurrent index builds
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        if lock_conn.dialect.name == "postgresql":
+            await lock_conn.execute(text(f"SELECT pg_advisory_lock({MIGRATION_LOCK_ID})"))
+        try:
+            return await _apply_pending(engine)
+        finally:
+            if lock_conn.dialect.name == "postgresql":
+                await lock_conn.execute(text(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_ID})"))
+
+
+async def _apply_pending(engine) -> int:
+    # Another process may have migrated while we waited for the lock
+    version = await current_version(engine)
+    if version == LATEST_VERSION:
+        return 0
+
+    async with engine.begin() as conn:
+        fresh = not await conn.run_sync(lambda c: inspect(c).has_table("users"))
+        # New tables (and their indexes) come straight from the models
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(schema_version.create, checkfirst=True)
+
+        if fresh:
+            # Built from the current models: nothing to migrate
+            for migration in MIGRATIONS:
+                await record_version(conn, migration)
+            logger.info(f"Schema created at version {LATEST_VERSION}")
+            return 0
+
+    applied = 0
+    for migration in MIGRATIONS:
+        if migration.version <= (version or 0):
+            continue
+
+        logger.info(f"Applying migration {migration.version}: {migration.name}")
+        if migration.online:
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await migration.upgrade(conn)
+                await record_version(conn, migration)
+        else:
+            async with engine.begin() as conn:
+                await migration.upgrade(conn)
+                await record_version(conn, migration)
+        applied += 1
+
+    logger.info(f"Schema migrated to version {LATEST_VERSION} ({applied} applied)")
+    return applied
@@ -3,7 +3,7 @@ Database Models for Currency Alert Bot - Extended
 """
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import String, Integer, BigInteger, Float, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import String, Integer, BigInteger, Float, Boolean, DateTime, ForeignKey, Text, Index, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -15,6 +15,10 @@ class Base(DeclarativeBase):
 class User(Base):
     """User model"""
     __tablename__ = "users"
+    __table_args__ = (
+        # Per-minute daily digest lookup
+        Index("ix_users_daily_notify_time", "daily_notify", "daily_notify_time"),
+    )
     
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     username: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
@@ -41,6 +45,13 @@ class User(Base):
 class Alert(Base):
     """Alert model"""
     __tablename__ = "alerts"
+    __table_args__ = (
+        # User's alert list
+        Index("ix_alerts_user_id", "user_id"),
+        # Armed alerts (alert index load); Postgres keeps only armed rows
+        Index("ix_alerts_active_triggered", "is_active", "is_triggered",
+              postgresql_where=text("is_active AND NOT is_triggered")),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False)
@@ -60,8 +71,11 @@ class Alert(Base):
 
 
 class Rate(Base):
-    """Current rates"""
+    """Current rates - one row per (bank, currency)"""
     __tablename__ = "rates"
+    __table_args__ = (
+        Index("uq_rates_bank_currency", "bank_code", "currency_code", unique=True),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     bank_code: Mapped[str] = mapped_column(String(50), nullable=False)
@@ -78,6 +92,12 @@ class Rate(Base):
 class RateHistory(Base):
     """Rate history for charts"""
     __tablename__ = "rate_history"
+    __table_args__ = (
+        # Chart/analysis range reads
+        Index("ix_rate_history_currency_bank_time", "currency_code", "bank_code", "recorded_at"),
+        # Retention cleanup
+        Index("ix_rate_history_recorded_at", "recorded_at"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     bank_code: Mapped[str] = mapped_column(String(50), nullable=False)
@@ -88,9 +108,36 @@ class RateHistory(Base):
     recorded_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+class RateHistoryAggregate(Base):
+    """OHLC rollup of rate history per hour / day"""
+    __tablename__ = "rate_history_agg"
+    __table_args__ = (
+        Index("uq_rate_history_agg_bucket", "currency_code", "bank_code", "resolution", "bucket_start", unique=True),
+        Index("ix_rate_history_agg_resolution_bucket", "resolution", "bucket_start"),
+    )
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    bank_code: Mapped[str] = mapped_column(String(50), nullable=False)
+    currency_code: Mapped[str] = mapped_column(String(10), nullable=False)
+    resolution: Mapped[str] = mapped_column(String(5), nullable=False)  # 1h, 1d
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    open: Mapped[float] = mapped_column(Float, nullable=False)
+    high: Mapped[float] = mapped_column(Float, nullable=False)
+    low: Mapped[float] = mapped_column(Float, nullable=False)
+    close: Mapped[float] = mapped_column(Float, nullable=False)
+    # Last values in the bucket
+    buy_rate: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    sell_rate: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    official_rate: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    samples: Mapped[int] = mapped_column(Integer, default=1)
+
+
 class Portfolio(Base):
     """User's currency portfolio"""
     __tablename__ = "portfolio"
+    __table_args__ = (
+        Index("ix_portfolio_user_id", "user_id"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False)
@@ -105,6 +152,9 @@ class Portfolio(Base):
 class FavoriteBank(Base):
     """User's favorite banks"""
     __tablename__ = "favorite_banks"
+    __table_args__ = (
+        Index("ix_favorite_banks_user_bank", "user_id", "bank_code"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False)
@@ -117,6 +167,11 @@ class FavoriteBank(Base):
 class SmartExchange(Base):
     """Smart exchange tracker - notifies when best rate increases"""
     __tablename__ = "smart_exchanges"
+    __table_args__ = (
+        # Open smart exchanges (5-minute check); Postgres keeps only open rows
+        Index("ix_smart_exchanges_open", "is_active", "is_accepted",
+              postgresql_where=text("is_active AND NOT is_accepted")),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False)
@@ -130,3 +185,55 @@ class SmartExchange(Base):
     snooze_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # 30min snooze
     last_notified_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class NotificationOutbox(Base):
+    """Durable notification queue - survives restarts, one row per (job, period, user)"""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_outbox_status_available", "status", "available_at"),
+    )
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    idempotency_key: Mapped[str] = mapped_column(String(200), unique=True, nullable=False)  # job:period:user
+    job: Mapped[str] = mapped_column(String(50), nullable=False)  # weekly_report, broadcast...
+    period: Mapped[str] = mapped_column(String(50), nullable=False)  # 2026-W42, broadcast id...
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    parse_mode: Mapped[Optional[str]] = mapped_column(String(20), nullable=True, default="Markdown")
+    status: Mapped[str] = mapped_column(String(10), default="pending")  # pending/sending/sent/failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    available_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)  # Retry backoff
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class IndicatorState(Base):
+    """Streaming indicator state per (bank, currency), advanced per hourly bucket"""
+    __tablename__ = "indicator_state"
+    __table_args__ = (
+        Index("uq_indicator_state_bank_currency", "bank_code", "currency_code", unique=True),
+    )
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    bank_code: Mapped[str] = mapped_column(String(50), nullable=False)
+    currency_code: Mapped[str] = mapped_column(String(10), nullable=False)
+    samples: Mapped[int] = mapped_column(Integer, default=0)
+    last_price: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    prev_price: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ema_12: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    ema_26: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    macd_signal: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    prev_macd: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # For crossovers
+    prev_signal: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    avg_gain: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # Wilder RSI
+    avg_loss: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    avg_tr: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # ATR
+    window: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Last prices for SMA/Bollinger, JSON
+    bucket_start: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # Open hourly bucket
+    bucket_high: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    bucket_low: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    bucket_close: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
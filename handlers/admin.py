@@ -1,7 +1,9 @@
 """
 Admin Handler - Complete with broadcast
 """
+import asyncio
 import logging
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes, CommandHandler, CallbackQueryHandler,
@@ -11,13 +13,27 @@ from sqlalchemy import select, func
 
 from database.db import get_session
 from database.models import User, Alert, Rate
-from config import ADMIN_IDS
+from services.outbox import enqueue_outbox, outbox_progress, CLAIM_LEASE, MAX_CLAIMS
+from services.history_backfill import backfill_years
+from config import ADMIN_IDS, HISTORY_DAILY_DAYS
 
 logger = logging.getLogger(__name__)
 
 # Conversation states
 BROADCAST_MESSAGE = 0
 
+# One archive backfill at a time
+backfill_running = False
+
+# Broadcast status refresh interval (seconds)
+WATCH_INTERVAL = 5
+
+# Failed progress reads in a row before the status watch gives up
+WATCH_MAX_ERRORS = 12
+
+# The watch stops when nothing was delivered for this long (every claim's lease ran out)
+WATCH_STALL_SECONDS = CLAIM_LEASE.total_seconds() * (MAX_CLAIMS + 1)
+
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
@@ -227,7 +243,7 @@ async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Send broadcast message to all users"""
+    """Queue broadcast message for all users (delivered through the outbox)"""
     if not is_admin(update.effective_user.id):
         return ConversationHandler.END
     
@@ -236,48 +252,25 @@ async def broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Get all active users
     async with get_session() as session:
         result = await session.execute(
-            select(User).where(User.is_active == True)
+            select(User.id).where(User.is_active == True)
         )
-        users = result.scalars().all()
-    
-    success = 0
-    failed = 0
+        user_ids = result.scalars().all()
     
     status_msg = await update.message.reply_text(
-        f"📡 Yuborilmoqda... 0/{len(users)}"
+        f"📡 Yuborilmoqda... 0/{len(user_ids)}"
     )
     
-    for i, user in enumerate(users):
-        try:
-            await context.bot.send_message(
-                chat_id=user.id,
-                text=message_text,
-                parse_mode="Markdown"
-            )
-            success += 1
-        except Exception as e:
-            logger.warning(f"Broadcast failed for {user.id}: {e}")
-            failed += 1
-        
-        # Update status every 10 users
-        if (i + 1) % 10 == 0:
-            try:
-                await status_msg.edit_text(
-                    f"📡 Yuborilmoqda... {i+1}/{len(users)}"
-                )
-            except:
-                pass
+    # The admin's message identifies this broadcast: a restart resumes it
+    # instead of sending it twice
+    period = f"{update.message.chat_id}:{update.message.message_id}"
+    await enqueue_outbox("broadcast", period, user_ids, message_text)
     
-    from handlers.start import get_main_menu_keyboard
-    
-    await status_msg.edit_text(
-        f"✅ **Broadcast tugadi!**\n\n"
-        f"📤 Yuborildi: {success}\n"
-        f"❌ Xato: {failed}\n"
-        f"👥 Jami: {len(users)}",
-        parse_mode="Markdown"
+    context.application.create_task(
+        watch_broadcast(status_msg, period, len(user_ids))
     )
     
+    from handlers.start import get_main_menu_keyboard
+    
     await update.message.reply_text(
         "🏠 Asosiy menyu",
         reply_markup=get_main_menu_keyboard()
@@ -286,6 +279,60 @@ async def broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return ConversationHandler.END
 
 
+async def watch_broadcast(status_msg, period: str, total: int) -> None:
+    """Keep the broadcast status message up to date until delivery finishes or stalls"""
+    success = failed = 0
+    errors = 0
+    finished = False
+    last_change = time.monotonic()
+    
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        try:
+            progress = await outbox_progress("broadcast", period)
+        except Exception as e:
+            errors += 1
+            logger.warning(f"Broadcast progress error ({errors}/{WATCH_MAX_ERRORS}): {e}")
+            if errors >= WATCH_MAX_ERRORS:
+                break
+            continue
+        errors = 0
+        
+        if progress.get("sent", 0) + progress.get("failed", 0) != success + failed:
+            last_change = time.monotonic()
+        success = progress.get("sent", 0)
+        failed = progress.get("failed", 0)
+        if progress.get("pending", 0) + progress.get("sending", 0) == 0:
+            finished = True
+            break
+        if time.monotonic() - last_change > WATCH_STALL_SECONDS:
+            logger.warning(f"Broadcast {period} made no progress for {WATCH_STALL_SECONDS:.0f}s, stopped watching")
+            break
+        
+        try:
+            await status_msg.edit_text(
+                f"📡 Yuborilmoqda... {success + failed}/{total}"
+            )
+        except:
+            pass
+    
+    if finished:
+        title = "✅ **Broadcast tugadi!**"
+    else:
+        title = "⚠️ **Broadcast holati noma'lum** (oxirgi ma'lumot)"
+    
+    try:
+        await status_msg.edit_text(
+            f"{title}\n\n"
+            f"📤 Yuborildi: {success}\n"
+            f"❌ Xato: {failed}\n"
+            f"👥 Jami: {total}",
+            parse_mode="Markdown"
+        )
+    except:
+        pass
+
+
 async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel broadcast"""
     query = update.callback_query
@@ -295,6 +342,60 @@ async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return ConversationHandler.END
 
 
+async def backfill_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Fill CBU rate history from the archive: /backfill [years]"""
+    global backfill_running
+    
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Sizda admin huquqi yo'q.")
+        return
+    
+    max_years = HISTORY_DAILY_DAYS // 365
+    try:
+        years = int(context.args[0]) if context.args else 1
+    except ValueError:
+        years = 0
+    if not 1 <= years <= max_years:
+        await update.message.reply_text(f"❌ Foydalanish: /backfill [1-{max_years}] (yil)")
+        return
+    
+    if backfill_running:
+        await update.message.reply_text("⏳ Backfill allaqachon ishlamoqda.")
+        return
+    
+    backfill_running = True
+    status_msg = await update.message.reply_text(f"📥 CBU arxivi yuklanmoqda ({years} yil)...")
+    context.application.create_task(run_backfill(status_msg, years))
+
+
+async def run_backfill(status_msg, years: int) -> None:
+    """Run the archive backfill, reporting progress in the status message"""
+    global backfill_running
+    
+    async def progress(done: int, total: int) -> None:
+        try:
+            await status_msg.edit_text(f"📥 CBU arxivi yuklanmoqda... {done}/{total} kun")
+        except:
+            pass
+    
+    try:
+        stored = await backfill_years(years, progress=progress)
+        await status_msg.edit_text(
+            f"✅ **Backfill tugadi!**\n\n"
+            f"📅 Davr: {years} yil\n"
+            f"💾 Saqlandi: {stored} ta kurs",
+            parse_mode="Markdown"
+        )
+    except Exception as e:
+        logger.error(f"Backfill error: {e}")
+        try:
+            await status_msg.edit_text(f"❌ Backfill xatosi: {e}")
+        except:
+            pass
+    finally:
+        backfill_running = False
+
+
 def get_broadcast_conversation_handler() -> ConversationHandler:
     """Broadcast conversation handler"""
     return ConversationHandler(
@@ -319,6 +420,7 @@ def get_admin_handlers() -> list:
     """Admin handlers"""
     return [
         CommandHandler("admin", admin_command),
+        CommandHandler("backfill", backfill_command),
         CallbackQueryHandler(admin_callback, pattern=r"^admin$"),
         CallbackQueryHandler(admin_stats, pattern=r"^admin_stats$"),
         CallbackQueryHandler(admin_users, pattern=r"^admin_users$"),
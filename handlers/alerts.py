@@ -17,6 +17,7 @@ from locales.helpers import t
 from database.db import get_session
 from database.models import Alert
 from services.rate_manager import get_rate
+from services.alert_engine import alert_index
 from config import BANKS, POPULAR_CURRENCIES
 
 # States: Valyuta → Bank → Xabar turi → Narx → Takroriy
@@ -274,6 +275,7 @@ async def step_repeat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         session.add(alert)
         await session.commit()
+    alert_index.add(alert)
     
     rate_text = "📥 Sotib olish" if rate_type == "buy" else "📤 Sotish"
     dir_text = "oshganda" if direction == "above" else "tushganda"
@@ -392,8 +394,10 @@ async def delete_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     lang = await get_user_language(user_id)
     
     async with get_session() as session:
-        await session.execute(delete(Alert).where(Alert.id == alert_id, Alert.user_id == user_id))
+        result = await session.execute(delete(Alert).where(Alert.id == alert_id, Alert.user_id == user_id))
         await session.commit()
+    if result.rowcount:
+        alert_index.remove(alert_id)
     
     message, keyboard = await build_alerts_list(user_id, lang)
     message = "✅ O'chirildi!\n\n" + message
@@ -417,6 +421,7 @@ async def pause_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         if alert:
             alert.is_paused = True
             await session.commit()
+            alert_index.remove(alert.id)
     
     message, keyboard = await build_alerts_list(user_id, lang)
     await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
@@ -439,6 +444,7 @@ async def resume_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         if alert:
             alert.is_paused = False
             await session.commit()
+            alert_index.add(alert)
     
     message, keyboard = await build_alerts_list(user_id, lang)
     await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
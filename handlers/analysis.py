@@ -2,10 +2,12 @@
 Analysis Handler - Technical Analysis and AI Forecast Display
 """
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 
 from handlers.common import get_user_language
-from services.analysis_service import get_technical_analysis
+from services.analysis_service import get_technical_analysis, get_technical_analysis_many
+from services.single_flight import single_flight
 from config import POPULAR_CURRENCIES
 
 
@@ -21,6 +23,7 @@ async def analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if row:
         keyboard.append(row)
     
+    keyboard.append([InlineKeyboardButton("🌐 Bozor sharhi", callback_data="analysis_overview")])
     keyboard.append([InlineKeyboardButton("⬅️ Orqaga", callback_data="main_menu")])
     
     await update.message.reply_text(
@@ -50,6 +53,7 @@ async def analysis_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if row:
         keyboard.append(row)
     
+    keyboard.append([InlineKeyboardButton("🌐 Bozor sharhi", callback_data="analysis_overview")])
     keyboard.append([InlineKeyboardButton("⬅️ Orqaga", callback_data="main_menu")])
     
     await query.edit_message_text(
@@ -71,8 +75,8 @@ async def show_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     
     currency = query.data.replace("analyze_", "")
     
-    # Get analysis
-    analysis = await get_technical_analysis(currency)
+    # Get analysis (shared with concurrent requests for the same currency)
+    analysis = await single_flight.do(("analysis", currency), get_technical_analysis, currency)
     
     if "error" in analysis:
         await query.edit_message_text(f"❌ Xatolik: {analysis['error']}")
@@ -126,6 +130,17 @@ async def show_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         message += f"SMA 30: {analysis['sma_30']:,}\n"
     message += "\n"
     
+    # Bollinger bands and volatility
+    bollinger = analysis.get("bollinger")
+    if bollinger:
+        message += "━━━ **Bollinger (20)** ━━━\n"
+        message += f"Yuqori: {bollinger['upper']:,}\n"
+        message += f"O'rta: {bollinger['middle']:,}\n"
+        message += f"Quyi: {bollinger['lower']:,}\n"
+        if analysis.get("atr") is not None:
+            message += f"ATR (o'zgaruvchanlik): {analysis['atr']:,.2f}\n"
+        message += "\n"
+    
     # AI Prediction
     message += "━━━ **🤖 AI Prognoz** ━━━\n"
     message += f"{pred['message']}\n"
@@ -148,10 +163,64 @@ async def show_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
 
 
+async def show_market_overview(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Barcha mashhur valyutalar tahlili bitta ekranda"""
+    query = update.callback_query
+    await query.answer("Tahlil qilinmoqda...")
+    
+    # One batch call for every currency, shared by users opening it at once
+    analyses = await single_flight.do(
+        "analysis_overview", get_technical_analysis_many, POPULAR_CURRENCIES
+    )
+    
+    message = "🌐 **Bozor sharhi**\n\n"
+    for currency in POPULAR_CURRENCIES:
+        analysis = analyses.get(currency)
+        if not analysis or not analysis.get("has_data"):
+            message += f"💱 **{currency}**: ma'lumot yetarli emas\n\n"
+            continue
+        
+        change_emoji = "📈" if analysis["change"] > 0 else "📉" if analysis["change"] < 0 else "➖"
+        pred = analysis["prediction"]
+        pred_emoji = {"bullish": "📈", "bearish": "📉"}.get(pred["prediction"], "➖")
+        
+        message += f"💱 **{currency}**: {analysis['current_price']:,.0f} "
+        message += f"{change_emoji} {analysis['change_pct']:+.2f}%\n"
+        line = f"RSI: {analysis['rsi']}" if analysis["rsi"] else "RSI: —"
+        macd = analysis.get("macd")
+        if macd:
+            line += f" | MACD: {macd['trend']}"
+        message += f"{line} | Prognoz: {pred_emoji} {pred['confidence']}%\n\n"
+    
+    keyboard = []
+    row = []
+    for cur in POPULAR_CURRENCIES[:6]:
+        row.append(InlineKeyboardButton(f"📊 {cur}", callback_data=f"analyze_{cur}"))
+        if len(row) == 3:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    
+    keyboard.append([InlineKeyboardButton("🔄 Yangilash", callback_data="analysis_overview")])
+    keyboard.append([InlineKeyboardButton("⬅️ Orqaga", callback_data="analysis")])
+    
+    try:
+        await query.edit_message_text(
+            message,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="Markdown"
+        )
+    except BadRequest:
+        # Refresh without changes: "message is not modified"
+        pass
+
+
 def get_analysis_handlers() -> list:
     """Analysis handlers"""
     return [
         CommandHandler("analysis", analysis_command),
         CallbackQueryHandler(analysis_callback, pattern=r"^analysis$"),
         CallbackQueryHandler(show_analysis, pattern=r"^analyze_[A-Z]+$"),
+        CallbackQueryHandler(show_market_overview, pattern=r"^analysis_overview$"),
     ]
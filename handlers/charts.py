@@ -2,10 +2,15 @@
 Chart Handler - Show rate history charts and trend analysis
 """
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 
 from handlers.common import get_user_language
-from services.chart_service import generate_rate_chart, generate_trend_analysis
+from services.chart_service import (
+    get_chart, chart_cache, record_chart_request, generate_trend_analysis
+)
+from services.chart_renderer import ChartBusy
+from services.single_flight import single_flight
 from config import POPULAR_CURRENCIES
 
 
@@ -92,6 +97,7 @@ async def generate_and_send_chart(update: Update, context: ContextTypes.DEFAULT_
     parts = query.data.replace("period_", "").split("_")
     currency = parts[0]
     days = int(parts[1])
+    record_chart_request(currency, "cbu", days)
     
     # Send typing action
     await context.bot.send_chat_action(
@@ -99,17 +105,42 @@ async def generate_and_send_chart(update: Update, context: ContextTypes.DEFAULT_
         action="upload_photo"
     )
     
-    # Generate chart
-    chart_bytes = await generate_rate_chart(currency, "cbu", days)
-    
-    if chart_bytes:
-        # First send photo without buttons
-        await context.bot.send_photo(
+    # Generate chart (or reuse a cached one)
+    try:
+        # Identical requests in flight share one render
+        chart = await single_flight.do(("chart", currency, "cbu", days), get_chart, currency, "cbu", days)
+    except ChartBusy:
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            photo=chart_bytes,
-            caption=f"📈 **{currency}** - {days} kunlik kurs tarixi",
-            parse_mode="Markdown"
+            text="⏳ Hozir grafiklar ko'p so'ralmoqda. Birozdan keyin qayta urinib ko'ring."
         )
+        return
+    
+    if chart:
+        # First send photo without buttons
+        caption = f"📈 **{currency}** - {days} kunlik kurs tarixi"
+        sent = None
+        if chart.file_id:
+            # Already uploaded: resend by file_id
+            try:
+                sent = await context.bot.send_photo(
+                    chat_id=update.effective_chat.id,
+                    photo=chart.file_id,
+                    caption=caption,
+                    parse_mode="Markdown"
+                )
+            except BadRequest:
+                chart.file_id = None
+        
+        if sent is None:
+            sent = await context.bot.send_photo(
+                chat_id=update.effective_chat.id,
+                photo=chart.png,
+                caption=caption,
+                parse_mode="Markdown"
+            )
+            if sent.photo:
+                chart_cache.set_file_id(chart.key, sent.photo[-1].file_id)
         
         # Then send message with buttons
         keyboard = [
@@ -1,65 +1,73 @@
 """
 Common utilities for handlers - NO duplicate menu keyboard
 """
-from sqlalchemy import select
+from sqlalchemy import select, update
 
 from database.db import get_session
 from database.models import User
+from services.user_profile import UserProfile, get_profile, load_profile, invalidate_profile
+
+
+def _profile_changes(profile: UserProfile, username: str, first_name: str, last_name: str) -> dict:
+    """Name fields Telegram reports differently from the stored ones"""
+    changes = {}
+    if username and profile.username != username:
+        changes["username"] = username
+    if first_name and profile.first_name != first_name:
+        changes["first_name"] = first_name
+    if last_name and profile.last_name != last_name:
+        changes["last_name"] = last_name
+    return changes
 
 
 async def get_or_create_user(user_id: int, username: str = None, 
-                              first_name: str = None, last_name: str = None) -> User:
-    """Get existing user or create new one"""
+                              first_name: str = None, last_name: str = None) -> UserProfile:
+    """Get existing user or create new one (no write when nothing changed)"""
+    profile = await get_profile(user_id)
+    if profile is not None and not _profile_changes(profile, username, first_name, last_name):
+        return profile
+    
     async with get_session() as session:
-        result = await session.execute(
-            select(User).where(User.id == user_id)
-        )
-        user = result.scalar_one_or_none()
-        
-        if user is None:
-            user = User(
-                id=user_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                language="uz",
-                daily_notify_time="09:00"
+        if profile is None:
+            result = await session.execute(
+                select(User.id).where(User.id == user_id)
             )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
-        else:
-            if username and user.username != username:
-                user.username = username
-            if first_name and user.first_name != first_name:
-                user.first_name = first_name
-            if last_name and user.last_name != last_name:
-                user.last_name = last_name
-            await session.commit()
+            if result.scalar_one_or_none() is None:
+                session.add(User(
+                    id=user_id,
+                    username=username,
+                    first_name=first_name,
+                    last_name=last_name,
+                    language="uz",
+                    daily_notify_time="09:00"
+                ))
+                await session.commit()
+                return await load_profile(session, user_id)
         
-        return user
+        # Existing user whose cached profile was missing or stale
+        profile = profile or await load_profile(session, user_id)
+        changes = _profile_changes(profile, username, first_name, last_name)
+        if not changes:
+            return profile
+        
+        await session.execute(update(User).where(User.id == user_id).values(**changes))
+        await session.commit()
+        return await load_profile(session, user_id)
 
 
 async def get_user_language(user_id: int) -> str:
     """Get user's language preference"""
-    async with get_session() as session:
-        result = await session.execute(
-            select(User.language).where(User.id == user_id)
-        )
-        lang = result.scalar_one_or_none()
-        return lang if lang else "uz"
+    profile = await get_profile(user_id)
+    return profile.language if profile else "uz"
 
 
 async def set_user_language(user_id: int, language: str) -> bool:
     """Set user's language preference"""
     async with get_session() as session:
         result = await session.execute(
-            select(User).where(User.id == user_id)
+            update(User).where(User.id == user_id).values(language=language)
         )
-        user = result.scalar_one_or_none()
-        
-        if user:
-            user.language = language
-            await session.commit()
-            return True
-        return False
+        await session.commit()
+    
+    invalidate_profile(user_id)
+    return result.rowcount > 0
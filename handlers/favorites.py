@@ -8,6 +8,7 @@ from sqlalchemy import select, delete
 from handlers.common import get_user_language
 from database.db import get_session
 from database.models import FavoriteBank
+from services.user_profile import get_profile, invalidate_profile
 from config import BANKS
 
 
@@ -40,11 +41,8 @@ async def favorites_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def build_favorites_view(user_id: int) -> tuple:
     """Sevimli banklar ro'yxati"""
-    async with get_session() as session:
-        result = await session.execute(
-            select(FavoriteBank).where(FavoriteBank.user_id == user_id)
-        )
-        favorites = result.scalars().all()
+    profile = await get_profile(user_id)
+    favorites = profile.favorites if profile else ()
     
     if not favorites:
         message = "⭐ **Sevimli Banklar**\n\n"
@@ -52,9 +50,9 @@ async def build_favorites_view(user_id: int) -> tuple:
         message += "➕ Bank qo'shish uchun tugmani bosing."
     else:
         message = "⭐ **Sevimli Banklar**\n\n"
-        for fav in favorites:
-            bank_info = BANKS.get(fav.bank_code, {})
-            bank_name = bank_info.get("name_uz", fav.bank_code)
+        for bank_code in favorites:
+            bank_info = BANKS.get(bank_code, {})
+            bank_name = bank_info.get("name_uz", bank_code)
             message += f"🏦 {bank_name}\n"
     
     keyboard = [
@@ -74,11 +72,8 @@ async def fav_add_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     user_id = update.effective_user.id
     
     # Get existing favorites
-    async with get_session() as session:
-        result = await session.execute(
-            select(FavoriteBank.bank_code).where(FavoriteBank.user_id == user_id)
-        )
-        existing = [r[0] for r in result.fetchall()]
+    profile = await get_profile(user_id)
+    existing = profile.favorites if profile else ()
     
     keyboard = []
     for code, info in BANKS.items():
@@ -112,6 +107,7 @@ async def fav_add_bank(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         fav = FavoriteBank(user_id=user_id, bank_code=bank_code)
         session.add(fav)
         await session.commit()
+    invalidate_profile(user_id)
     
     bank_name = BANKS.get(bank_code, {}).get("name_uz", bank_code)
     await query.answer(f"✅ {bank_name} qo'shildi!", show_alert=True)
@@ -171,6 +167,7 @@ async def fav_remove_bank(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             delete(FavoriteBank).where(FavoriteBank.id == fav_id, FavoriteBank.user_id == user_id)
         )
         await session.commit()
+    invalidate_profile(user_id)
     
     await query.answer("✅ O'chirildi!", show_alert=True)
     
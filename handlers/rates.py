@@ -3,14 +3,15 @@ Rates Handler - Display current exchange rates (All Banks)
 """
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from sqlalchemy import select
-
 from handlers.common import get_user_language
 from locales.helpers import t
-from services.rate_manager import get_rates_by_bank, get_rates_by_currency, get_last_update_time, update_all_rates
-from database.db import get_session
-from database.models import FavoriteBank
-from config import BANKS, POPULAR_CURRENCIES
+from services.rate_manager import get_rates_for_banks, get_last_update_time, request_refresh
+from handlers.screens import get_screen
+from services.user_profile import get_profile
+from config import BANKS
+
+# Currencies listed per bank on the favorites screen
+FAVORITE_CURRENCIES = ["USD", "EUR", "RUB"]
 
 
 async def rates_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -55,8 +56,8 @@ async def refresh_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     query = update.callback_query
     await query.answer("🔄 Kurslar yangilanmoqda...", show_alert=False)
     
-    # Update rates
-    await update_all_rates()
+    # Update rates (joins a refresh in flight, skipped if rates are fresh)
+    await request_refresh()
     
     # Refresh the view
     lang = await get_user_language(update.effective_user.id)
@@ -81,11 +82,8 @@ async def favorites_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     lang = await get_user_language(user_id)
     
     # Get user's favorite banks
-    async with get_session() as session:
-        result = await session.execute(
-            select(FavoriteBank.bank_code).where(FavoriteBank.user_id == user_id)
-        )
-        favorite_codes = [r[0] for r in result.fetchall()]
+    profile = await get_profile(user_id)
+    favorite_codes = profile.favorites if profile else ()
     
     if not favorite_codes:
         keyboard = [
@@ -103,28 +101,28 @@ async def favorites_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     message = "⭐ **Sevimli Banklar Kurslari**\n\n"
     
-    for bank_code in favorite_codes:
-        bank_info = BANKS.get(bank_code)
-        if not bank_info:
-            continue
-        
-        rates = await get_rates_by_bank(bank_code)
+    bank_codes = [code for code in favorite_codes if code in BANKS]
+    rates_by_bank = await get_rates_for_banks(bank_codes, FAVORITE_CURRENCIES)
+    
+    for bank_code in bank_codes:
+        bank_info = BANKS[bank_code]
+        rates = rates_by_bank[bank_code]
         
         emoji = "🏛️" if bank_info["type"] == "official" else "🏦"
         message += f"{emoji} **{bank_info['name_uz']}**\n"
         
         # Show USD, EUR, RUB
-        for currency in ["USD", "EUR", "RUB"]:
-            for rate in rates:
-                if rate["currency_code"] == currency:
-                    if bank_info["type"] == "official":
-                        official = rate.get("official_rate", 0)
-                        message += f"  {currency}: {official:,.0f}\n"
-                    else:
-                        buy = rate.get("buy_rate", 0)
-                        sell = rate.get("sell_rate", 0)
-                        message += f"  {currency}: 📥{buy:,.0f} 📤{sell:,.0f}\n"
-                    break
+        for currency in FAVORITE_CURRENCIES:
+            rate = rates.get(currency)
+            if rate is None:
+                continue
+            if bank_info["type"] == "official":
+                official = rate.get("official_rate", 0)
+                message += f"  {currency}: {official:,.0f}\n"
+            else:
+                buy = rate.get("buy_rate", 0)
+                sell = rate.get("sell_rate", 0)
+                message += f"  {currency}: 📥{buy:,.0f} 📤{sell:,.0f}\n"
         message += "\n"
     
     keyboard = [
@@ -147,11 +145,8 @@ async def build_bank_keyboard(lang: str, user_id: int = None) -> list:
     # Check if user has favorites
     has_favorites = False
     if user_id:
-        async with get_session() as session:
-            result = await session.execute(
-                select(FavoriteBank).where(FavoriteBank.user_id == user_id).limit(1)
-            )
-            has_favorites = result.scalar_one_or_none() is not None
+        profile = await get_profile(user_id)
+        has_favorites = bool(profile and profile.favorites)
     
     # Favorites button (if user has any)
     if has_favorites:
@@ -199,58 +194,15 @@ async def view_bank_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     bank_code = query.data.replace("bank_", "")
     lang = await get_user_language(update.effective_user.id)
     
-    bank_info = BANKS.get(bank_code)
-    if not bank_info:
+    if bank_code not in BANKS:
         await query.edit_message_text("❌ Bank topilmadi")
         return
     
-    rates = await get_rates_by_bank(bank_code)
-    
-    if not rates:
-        message = f"🏦 **{bank_info['name_uz']}**\n\n⏳ Kurslar yuklanmoqda..."
-    else:
-        emoji = "🏛️" if bank_info["type"] == "official" else "🏦"
-        message = f"{emoji} **{bank_info['name_uz']}**\n\n"
-        
-        # Show popular currencies
-        for currency in POPULAR_CURRENCIES:
-            for rate in rates:
-                if rate["currency_code"] == currency:
-                    nominal = rate.get("nominal", 1)
-                    
-                    if bank_info["type"] == "official":
-                        # CBU - show official rate
-                        official = rate.get("official_rate", 0)
-                        diff = rate.get("diff", 0)
-                        diff_emoji = "📈" if diff > 0 else "📉" if diff < 0 else "➖"
-                        if nominal == 1:
-                            message += f"💱 **{currency}**: {official:,.2f} {diff_emoji}\n"
-                        else:
-                            message += f"💱 **{nominal} {currency}**: {official:,.2f} {diff_emoji}\n"
-                    else:
-                        # Commercial - show buy/sell
-                        buy = rate.get("buy_rate", 0)
-                        sell = rate.get("sell_rate", 0)
-                        if nominal == 1:
-                            message += f"💱 **{currency}**: 📥{buy:,.0f} | 📤{sell:,.0f}\n"
-                        else:
-                            message += f"💱 **{nominal} {currency}**: 📥{buy:,.0f} | 📤{sell:,.0f}\n"
-                    break
-        
-        if bank_info["type"] == "commercial":
-            message += "\n📥 Sotib olish | 📤 Sotish"
-            message += "\n\n_⚠️ Taxminiy kurs (CBU asosida)_"
-    
-    keyboard = [
-        [InlineKeyboardButton("🌍 Barcha valyutalar", callback_data=f"allrates_{bank_code}")],
-        [InlineKeyboardButton("⬅️ Orqaga", callback_data="rates")],
-        [InlineKeyboardButton("🏠 Menyu", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    screen = await get_screen("bank", bank_code, lang)
     
     await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
+        screen.text,
+        reply_markup=screen.markup,
         parse_mode="Markdown"
     )
 
@@ -263,32 +215,15 @@ async def view_all_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     bank_code = query.data.replace("allrates_", "")
     lang = await get_user_language(update.effective_user.id)
     
-    bank_info = BANKS.get(bank_code)
-    rates = await get_rates_by_bank(bank_code)
-    
-    message = f"🌍 **{bank_info['name_uz']}** - Barcha\n\n"
-    
-    if rates:
-        for rate in rates[:25]:  # Limit for message length
-            currency = rate["currency_code"]
-            nominal = rate.get("nominal", 1)
-            
-            if bank_info["type"] == "official":
-                official = rate.get("official_rate", 0)
-                message += f"• {nominal} {currency}: {official:,.2f}\n"
-            else:
-                buy = rate.get("buy_rate", 0)
-                message += f"• {nominal} {currency}: {buy:,.0f}\n"
+    if bank_code not in BANKS:
+        await query.edit_message_text("❌ Bank topilmadi")
+        return
     
-    keyboard = [
-        [InlineKeyboardButton("⬅️ Orqaga", callback_data=f"bank_{bank_code}")],
-        [InlineKeyboardButton("🏠 Menyu", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    screen = await get_screen("all_rates", bank_code, lang)
     
     await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
+        screen.text,
+        reply_markup=screen.markup,
         parse_mode="Markdown"
     )
 
@@ -301,38 +236,11 @@ async def compare_rates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     currency = query.data.replace("compare_", "")
     lang = await get_user_language(update.effective_user.id)
     
-    rates = await get_rates_by_currency(currency)
-    
-    message = f"📈 **{currency} taqqoslash**\n\n"
-    
-    if rates:
-        # Sort by buy rate (highest first for selling USD)
-        sorted_rates = sorted(rates, key=lambda x: x.get("buy_rate") or x.get("official_rate") or 0, reverse=True)
-        
-        for rate in sorted_rates:
-            bank_code = rate["bank_code"]
-            bank_info = BANKS.get(bank_code, {})
-            bank_name = bank_info.get("name_uz", bank_code)
-            
-            if rate.get("official_rate"):
-                message += f"🏛️ **{bank_name}**: {rate['official_rate']:,.2f}\n"
-            else:
-                buy = rate.get("buy_rate", 0)
-                sell = rate.get("sell_rate", 0)
-                message += f"🏦 **{bank_name}**\n   📥 {buy:,.0f} | 📤 {sell:,.0f}\n"
-        
-        message += "\n_🏦 Tijorat bank kurslari taxminiy (CBU asosida)_"
-    
-    keyboard = [
-        [InlineKeyboardButton("🔄 Yangilash", callback_data=f"compare_{currency}")],
-        [InlineKeyboardButton("⬅️ Orqaga", callback_data="rates")],
-        [InlineKeyboardButton("🏠 Menyu", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    screen = await get_screen("compare", currency, lang)
     
     await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
+        screen.text,
+        reply_markup=screen.markup,
         parse_mode="Markdown"
     )
 
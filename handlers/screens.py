@@ -0,0 +1,182 @@
+"""
+Screen Cache - Pre-rendered text and keyboards of the rate screens
+
+Bank, all-currencies, comparison and today screens only depend on the
+rates and the user's language, so each (screen, key, lang) payload is
+rendered once per rate snapshot and then sent as is. A new snapshot
+(every rate refresh) drops all cached screens.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from locales.helpers import t
+from services.rate_snapshot import RateSnapshot, get_snapshot
+from config import BANKS, POPULAR_CURRENCIES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Screen:
+    """Message text and keyboard ready to send"""
+    text: str
+    markup: InlineKeyboardMarkup
+
+
+def bank_name(bank_code: str, lang: str) -> str:
+    info = BANKS.get(bank_code, {})
+    return info.get(f"name_{lang}") or info.get("name_uz", bank_code)
+
+
+def nav_buttons(lang: str, back: str) -> list:
+    return [
+        [InlineKeyboardButton(f"⬅️ {t('back', lang)}", callback_data=back)],
+        [InlineKeyboardButton(f"🏠 {t('menu', lang)}", callback_data="main_menu")],
+    ]
+
+
+def render_bank(snapshot: RateSnapshot, bank_code: str, lang: str) -> Screen:
+    """Popular currencies of one bank"""
+    bank_info = BANKS[bank_code]
+    name = bank_name(bank_code, lang)
+    official = bank_info["type"] == "official"
+    rates = [snapshot.by_key[(bank_code, c)] for c in POPULAR_CURRENCIES if (bank_code, c) in snapshot.by_key]
+
+    if not rates:
+        lines = [f"🏦 **{name}**\n\n⏳ {t('rates_loading', lang)}"]
+    else:
+        emoji = "🏛️" if official else "🏦"
+        lines = [f"{emoji} **{name}**\n\n"]
+        for rate in rates:
+            currency = rate["currency_code"]
+            nominal = rate.get("nominal", 1)
+            label = currency if nominal == 1 else f"{nominal} {currency}"
+
+            if official:
+                # CBU - show official rate
+                diff = rate.get("diff", 0)
+                diff_emoji = "📈" if diff > 0 else "📉" if diff < 0 else "➖"
+                lines.append(f"💱 **{label}**: {rate.get('official_rate', 0):,.2f} {diff_emoji}\n")
+            else:
+                # Commercial - show buy/sell
+                buy = rate.get("buy_rate", 0)
+                sell = rate.get("sell_rate", 0)
+                lines.append(f"💱 **{label}**: 📥{buy:,.0f} | 📤{sell:,.0f}\n")
+
+        if not official:
+            lines.append(f"\n{t('buy', lang)} | {t('sell', lang)}")
+            lines.append(f"\n\n_{t('rates_estimated', lang)}_")
+
+    keyboard = [
+        [InlineKeyboardButton(t("rates_all_currencies", lang), callback_data=f"allrates_{bank_code}")],
+        *nav_buttons(lang, "rates"),
+    ]
+    return Screen("".join(lines), InlineKeyboardMarkup(keyboard))
+
+
+def render_all_rates(snapshot: RateSnapshot, bank_code: str, lang: str) -> Screen:
+    """Every currency of one bank (first 25, for message length)"""
+    official = BANKS[bank_code]["type"] == "official"
+    lines = [t("rates_all_title", lang, bank=bank_name(bank_code, lang))]
+
+    for rate in snapshot.by_bank.get(bank_code, ())[:25]:
+        nominal = rate.get("nominal", 1)
+        if official:
+            lines.append(f"• {nominal} {rate['currency_code']}: {rate.get('official_rate', 0):,.2f}\n")
+        else:
+            lines.append(f"• {nominal} {rate['currency_code']}: {rate.get('buy_rate', 0):,.0f}\n")
+
+    return Screen("".join(lines), InlineKeyboardMarkup(nav_buttons(lang, f"bank_{bank_code}")))
+
+
+def render_compare(snapshot: RateSnapshot, currency: str, lang: str) -> Screen:
+    """One currency across all banks, highest buy rate first"""
+    lines = [t("compare_title", lang, currency=currency)]
+
+    ranking = snapshot.rankings.get(currency)
+    if ranking and ranking.by_buy:
+        for rate in ranking.by_buy:
+            name = bank_name(rate["bank_code"], lang)
+            if rate.get("official_rate"):
+                lines.append(f"🏛️ **{name}**: {rate['official_rate']:,.2f}\n")
+            else:
+                buy = rate.get("buy_rate", 0)
+                sell = rate.get("sell_rate", 0)
+                lines.append(f"🏦 **{name}**\n   📥 {buy:,.0f} | 📤 {sell:,.0f}\n")
+        lines.append(f"\n_{t('compare_estimated', lang)}_")
+
+    keyboard = [
+        [InlineKeyboardButton(f"🔄 {t('refresh', lang)}", callback_data=f"compare_{currency}")],
+        *nav_buttons(lang, "rates"),
+    ]
+    return Screen("".join(lines), InlineKeyboardMarkup(keyboard))
+
+
+def render_today(snapshot: RateSnapshot, key: str, lang: str) -> Screen:
+    """CBU rates of the top popular currencies"""
+    lines = [t("today_title", lang)]
+
+    for cur in POPULAR_CURRENCIES[:5]:
+        rate = snapshot.by_key.get(("cbu", cur))
+        if not rate:
+            continue
+        diff = rate.get("diff", 0)
+        if diff > 0:
+            change = f"📈+{diff:.0f}"
+        elif diff < 0:
+            change = f"📉{diff:.0f}"
+        else:
+            change = "➖"
+        lines.append(f"💱 **{cur}**: {rate.get('official_rate', 0):,.0f} {change}\n")
+
+    keyboard = [[InlineKeyboardButton(f"⬅️ {t('back', lang)}", callback_data="main_menu")]]
+    return Screen("".join(lines), InlineKeyboardMarkup(keyboard))
+
+
+SCREENS: dict[str, Callable[[RateSnapshot, str, str], Screen]] = {
+    "bank": render_bank,
+    "all_rates": render_all_rates,
+    "compare": render_compare,
+    "today": render_today,
+}
+
+
+class ScreenCache:
+    """Rendered screens of one snapshot version"""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self._screens: dict[tuple, Screen] = {}
+
+    def __len__(self) -> int:
+        return len(self._screens)
+
+    def get(self, snapshot: RateSnapshot, screen: str, key: str, lang: str) -> Screen:
+        if snapshot.version != self.version:
+            self._screens.clear()
+            self.version = snapshot.version
+
+        cache_key = (screen, key, lang)
+        cached = self._screens.get(cache_key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        rendered = SCREENS[screen](snapshot, key, lang)
+        self._screens[cache_key] = rendered
+        return rendered
+
+
+screen_cache = ScreenCache()
+
+
+async def get_screen(screen: str, key: str, lang: str) -> Screen:
+    """Cached payload of a rate screen for the current rates"""
+    snapshot = await get_snapshot()
+    return screen_cache.get(snapshot, screen, key, lang)
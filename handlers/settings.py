@@ -8,6 +8,7 @@ from sqlalchemy import select
 from handlers.common import get_user_language
 from database.db import get_session
 from database.models import User
+from services.user_profile import get_profile, invalidate_profile
 
 # States
 SET_TIME = 0
@@ -19,10 +20,7 @@ async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     user_id = update.effective_user.id
-    
-    async with get_session() as session:
-        result = await session.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
+    user = await get_profile(user_id)
     
     daily = "✅" if user and user.daily_notify else "❌"
     weekly = "✅" if user and user.weekly_report else "❌"
@@ -63,6 +61,7 @@ async def toggle_daily(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             user.daily_notify = not user.daily_notify
             status = "✅ Yoqildi" if user.daily_notify else "❌ O'chirildi"
             await session.commit()
+            invalidate_profile(user_id)
             await query.answer(f"🔔 Kunlik xabarnoma: {status}", show_alert=True)
     
     await settings_callback(update, context)
@@ -81,6 +80,7 @@ async def toggle_weekly(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             user.weekly_report = not user.weekly_report
             status = "✅ Yoqildi" if user.weekly_report else "❌ O'chirildi"
             await session.commit()
+            invalidate_profile(user_id)
             await query.answer(f"📊 Haftalik hisobot: {status}", show_alert=True)
     
     await settings_callback(update, context)
@@ -99,6 +99,7 @@ async def toggle_bigchange(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             user.big_change_notify = not user.big_change_notify
             status = "✅ Yoqildi" if user.big_change_notify else "❌ O'chirildi"
             await session.commit()
+            invalidate_profile(user_id)
             await query.answer(f"📈 Katta o'zgarish: {status}", show_alert=True)
     
     await settings_callback(update, context)
@@ -147,6 +148,7 @@ async def set_time_button(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             user.daily_notify_time = time_str
             user.daily_notify = True  # Auto-enable
             await session.commit()
+    invalidate_profile(user_id)
     
     await query.answer(f"✅ Vaqt o'rnatildi: {time_str}", show_alert=True)
     await settings_callback(update, context)
@@ -178,6 +180,7 @@ async def set_time_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             user.daily_notify_time = time_str
             user.daily_notify = True
             await session.commit()
+    invalidate_profile(user_id)
     
     from handlers.start import get_main_menu_keyboard
     lang = await get_user_language(user_id)
@@ -12,7 +12,7 @@ from sqlalchemy import select
 from handlers.common import get_user_language
 from database.db import get_session
 from database.models import SmartExchange
-from services.rate_manager import get_rates_by_currency
+from services.rate_manager import get_currency_ranking
 from config import BANKS
 
 logger = logging.getLogger(__name__)
@@ -58,15 +58,10 @@ async def step_currency(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     context.user_data["smart_currency"] = currency
     
     # Get current best rate for this currency
-    rates = await get_rates_by_currency(currency)
-    best_rate = 0
-    best_bank = ""
-    
-    for rate in rates:
-        buy = rate.get("buy_rate") or 0
-        if buy > best_rate:
-            best_rate = buy
-            best_bank = rate.get("bank_name", rate.get("bank_code", ""))
+    ranking = await get_currency_ranking(currency)
+    best = ranking.best_bank_buy if ranking else None
+    best_rate = best["buy_rate"] if best else 0
+    best_bank = best.get("bank_name", best["bank_code"]) if best else ""
     
     context.user_data["smart_best_rate"] = best_rate
     context.user_data["smart_best_bank"] = best_bank
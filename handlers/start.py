@@ -5,6 +5,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppI
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 
 from handlers.common import get_or_create_user, get_user_language, set_user_language
+from handlers.screens import get_screen
 from locales.helpers import t
 
 # WebApp URL (Live Vercel deployment)
@@ -128,33 +129,12 @@ async def today_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
     
-    from services.rate_manager import get_rate
-    from config import POPULAR_CURRENCIES
-    
     lang = await get_user_language(update.effective_user.id)
-    
-    message = "📅 **Bugungi kurslar**\n🏛️ Markaziy Bank\n\n"
-    
-    for cur in POPULAR_CURRENCIES[:5]:
-        rate = await get_rate("cbu", cur)
-        if rate:
-            official = rate.get("official_rate", 0)
-            diff = rate.get("diff", 0)
-            
-            if diff > 0:
-                change = f"📈+{diff:.0f}"
-            elif diff < 0:
-                change = f"📉{diff:.0f}"
-            else:
-                change = "➖"
-            
-            message += f"💱 **{cur}**: {official:,.0f} {change}\n"
-    
-    keyboard = [[InlineKeyboardButton("⬅️ Orqaga", callback_data="main_menu")]]
+    screen = await get_screen("today", "cbu", lang)
     
     await query.edit_message_text(
-        message,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        screen.text,
+        reply_markup=screen.markup,
         parse_mode="Markdown"
     )
 
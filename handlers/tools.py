@@ -1,6 +1,8 @@
 """
 Tools Handler - Calculator, Best Rate, Portfolio
 """
+from typing import Optional
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes, CommandHandler, CallbackQueryHandler,
@@ -12,7 +14,9 @@ from handlers.common import get_user_language
 from locales.helpers import t
 from database.db import get_session
 from database.models import Rate
-from services.rate_manager import get_rate, get_rates_by_currency
+from services.rate_manager import get_rate, get_currency_ranking
+from services.rate_snapshot import buy_price, sell_price
+from services.single_flight import single_flight
 from config import BANKS, POPULAR_CURRENCIES
 
 # Calculator states
@@ -197,44 +201,57 @@ async def best_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
 
 
-async def show_best_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Eng yaxshi kursni ko'rsatish"""
-    query = update.callback_query
-    await query.answer()
-    
-    currency = query.data.replace("best_", "")
-    lang = await get_user_language(update.effective_user.id)
-    
-    rates = await get_rates_by_currency(currency)
+async def render_best_rate(currency: str) -> Optional[str]:
+    """Best buy/sell rates text for a currency, None without rates"""
+    ranking = await get_currency_ranking(currency)
     
-    if not rates:
-        await query.edit_message_text(f"❌ {currency} kurslari topilmadi.")
-        return
+    if not ranking or not ranking.by_buy or not ranking.by_sell:
+        return None
     
     # Eng yuqori sotib olish va eng past sotish
-    buy_rates = [(r, r.get("buy_rate") or r.get("official_rate") or 0) for r in rates]
-    sell_rates = [(r, r.get("sell_rate") or r.get("official_rate") or 0) for r in rates]
+    best_buy = ranking.best_buy
+    best_sell = ranking.best_sell
     
-    best_buy = max(buy_rates, key=lambda x: x[1])
-    best_sell = min(sell_rates, key=lambda x: x[1])
-    
-    best_buy_bank = BANKS.get(best_buy[0]["bank_code"], {}).get("name_uz", "")
-    best_sell_bank = BANKS.get(best_sell[0]["bank_code"], {}).get("name_uz", "")
+    best_buy_bank = BANKS.get(best_buy["bank_code"], {}).get("name_uz", "")
+    best_sell_bank = BANKS.get(best_sell["bank_code"], {}).get("name_uz", "")
     
     message = f"🏆 **{currency} - Eng yaxshi kurslar**\n\n"
     message += f"📥 **Sotib olish (eng yuqori):**\n"
     message += f"   🏦 {best_buy_bank}\n"
-    message += f"   💰 **{best_buy[1]:,.0f}** so'm\n\n"
+    message += f"   💰 **{buy_price(best_buy):,.0f}** so'm\n\n"
     message += f"📤 **Sotish (eng past):**\n"
     message += f"   🏦 {best_sell_bank}\n"
-    message += f"   💰 **{best_sell[1]:,.0f}** so'm\n\n"
+    message += f"   💰 **{sell_price(best_sell):,.0f}** so'm\n\n"
+    
+    # Sotish va sotib olish farqi
+    if ranking.narrowest is not None:
+        narrowest_bank = BANKS.get(ranking.narrowest["bank_code"], {}).get("name_uz", "")
+        message += f"↔️ **Farq:** o'rtacha {ranking.spread_avg:,.0f} so'm\n"
+        message += f"   Eng kichik: {narrowest_bank} ({ranking.spread_min:,.0f} so'm)\n\n"
     
     # Boshqa banklar
     message += "📊 **Barcha banklar:**\n"
-    sorted_buy = sorted(buy_rates, key=lambda x: x[1], reverse=True)[:5]
-    for r, rate in sorted_buy:
+    for r in ranking.by_buy[:5]:
         bank = BANKS.get(r["bank_code"], {}).get("name_uz", "")[:12]
-        message += f"   {bank}: {rate:,.0f}\n"
+        message += f"   {bank}: {buy_price(r):,.0f}\n"
+    
+    return message
+
+
+async def show_best_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Eng yaxshi kursni ko'rsatish"""
+    query = update.callback_query
+    await query.answer()
+    
+    currency = query.data.replace("best_", "")
+    lang = await get_user_language(update.effective_user.id)
+    
+    # Concurrent requests for the same currency share one render
+    message = await single_flight.do(("best", currency), render_best_rate, currency)
+    
+    if not message:
+        await query.edit_message_text(f"❌ {currency} kurslari topilmadi.")
+        return
     
     keyboard = [
         [InlineKeyboardButton("⬅️ Orqaga", callback_data="best")],
@@ -44,6 +44,10 @@ RU = {
     "rates_compare": "📈 Сравнить",
     "rates_all_currencies": "🌍 Все валюты",
     "rates_estimated": "⚠️ Оценочный курс (на основе ЦБ)",
+    "rates_all_title": "🌍 **{bank}** - Все\n\n",
+    "compare_title": "📈 **Сравнение {currency}**\n\n",
+    "compare_estimated": "🏦 Курсы коммерческих банков оценочные (на основе ЦБ)",
+    "today_title": "📅 **Курсы на сегодня**\n🏛️ Центральный банк\n\n",
     "buy": "📥 Покупка",
     "sell": "📤 Продажа",
     
@@ -71,6 +75,7 @@ RU = {
     "notify_time": "🕐 Время уведомления",
     "on": "Включено ✅",
     "off": "Выключено ❌",
+    "daily_digest_title": "📅 **Курсы на сегодня** ({time})\n🏛️ Центральный банк\n\n",
     
     # Smart Exchange
     "smart_title": "💫 Умный обмен",
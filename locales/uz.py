@@ -44,6 +44,10 @@ UZ = {
     "rates_compare": "📈 Taqqoslash",
     "rates_all_currencies": "🌍 Barcha valyutalar",
     "rates_estimated": "⚠️ Taxminiy kurs (CBU asosida)",
+    "rates_all_title": "🌍 **{bank}** - Barcha\n\n",
+    "compare_title": "📈 **{currency} taqqoslash**\n\n",
+    "compare_estimated": "🏦 Tijorat bank kurslari taxminiy (CBU asosida)",
+    "today_title": "📅 **Bugungi kurslar**\n🏛️ Markaziy Bank\n\n",
     "buy": "📥 Sotib olish",
     "sell": "📤 Sotish",
     
@@ -71,6 +75,7 @@ UZ = {
     "notify_time": "🕐 Xabar vaqti",
     "on": "Yoqilgan ✅",
     "off": "O'chirilgan ❌",
+    "daily_digest_title": "📅 **Bugungi kurslar** ({time})\n🏛️ Markaziy Bank\n\n",
     
     # Smart Exchange
     "smart_title": "💫 Aqlli almashtirish",
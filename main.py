@@ -5,8 +5,8 @@ import logging
 from telegram import Update
 from telegram.ext import Application, ContextTypes
 
-from config import BOT_TOKEN, LOG_LEVEL
-from database.db import init_db, close_db
+from config import BOT_TOKEN, LOG_LEVEL, QUERY_BUDGET
+from database.db import init_db, close_db, request_scope
 from handlers.start import get_start_handlers
 from handlers.rates import get_rates_handlers
 from handlers.alerts import get_alert_conversation_handler, get_alerts_handlers
@@ -26,6 +26,10 @@ from handlers.smart_exchange import (
     get_smart_exchange_conversation_handler,
     get_smart_exchange_handlers
 )
+from services.cbu_fetcher import close_client as close_cbu_client
+from services.notifier import dispatcher
+from services.outbox import outbox_drainer
+from services.chart_renderer import chart_renderer
 from services.scheduler import (
     start_scheduler, stop_scheduler,
     set_notification_callback, run_initial_update
@@ -40,12 +44,43 @@ logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
-async def send_notification(user_id: int, message: str) -> None:
-    """Send notification"""
-    try:
-        await application.bot.send_message(chat_id=user_id, text=message, parse_mode="Markdown")
-    except Exception as e:
-        logger.error(f"Notification failed for {user_id}: {e}")
+def describe_update(update: object) -> str:
+    """Short name of an update for logs: callback data, command or update type"""
+    if isinstance(update, Update):
+        if update.callback_query:
+            return f"callback {update.callback_query.data}"
+        if update.message and update.message.text:
+            return f"message {update.message.text.split()[0][:32]}"
+        if update.inline_query:
+            return "inline query"
+    return type(update).__name__
+
+
+class RequestScopedApplication(Application):
+    """Handles every update inside one database session and counts its queries"""
+    
+    async def process_update(self, update: object) -> None:
+        async with request_scope() as scope:
+            await super().process_update(update)
+        if scope.queries > QUERY_BUDGET:
+            logger.warning(
+                f"{describe_update(update)} ran {scope.queries} queries "
+                f"(budget {QUERY_BUDGET})"
+            )
+        else:
+            logger.debug(f"{describe_update(update)} ran {scope.queries} queries")
+
+
+async def deliver_message(chat_id: int, text: str, parse_mode: str = "Markdown", reply_markup=None) -> None:
+    """Send one message (errors are handled by the dispatcher)"""
+    await application.bot.send_message(
+        chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup
+    )
+
+
+async def send_notification(user_id: int, message: str, job: str = "default") -> None:
+    """Queue notification for rate-limited delivery"""
+    await dispatcher.enqueue(user_id, message, job=job)
 
 
 async def post_init(app: Application) -> None:
@@ -56,6 +91,13 @@ async def post_init(app: Application) -> None:
     logger.info("Running initial rate update...")
     await run_initial_update()
     
+    logger.info("Starting notification dispatcher...")
+    dispatcher.start(deliver_message)
+    outbox_drainer.start()
+    
+    logger.info("Starting chart renderer...")
+    chart_renderer.start()
+    
     logger.info("Starting scheduler...")
     set_notification_callback(send_notification)
     start_scheduler()
@@ -67,6 +109,13 @@ async def post_shutdown(app: Application) -> None:
     """Shutdown"""
     logger.info("Stopping scheduler...")
     stop_scheduler()
+    await close_cbu_client()
+    
+    logger.info("Draining notifications...")
+    await outbox_drainer.stop()
+    await dispatcher.stop()
+    await outbox_drainer.close()
+    chart_renderer.stop()
     
     logger.info("Closing database...")
     await close_db()
@@ -103,6 +152,7 @@ def main() -> None:
     
     application = (
         Application.builder()
+        .application_class(RequestScopedApplication)
         .token(BOT_TOKEN)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
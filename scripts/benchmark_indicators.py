@@ -0,0 +1,162 @@
+"""
+Indicator Benchmark - NumPy indicator series vs the pure-Python helpers
+
+The baseline functions below are the pure-Python helpers analysis_service
+used before services/indicators.py. They only return the latest value, so
+they are timed twice: once for the latest value (what one /analysis call
+cost) and once per point for a whole series (what charting an indicator
+would cost). The NumPy versions always compute the whole series.
+
+Usage:
+    python scripts/benchmark_indicators.py
+    python scripts/benchmark_indicators.py --points 50000 --repeat 3
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services import indicators
+
+
+# ============ Pure-Python baseline ============
+
+def calculate_sma(prices, period):
+    if len(prices) < period:
+        return None
+    return sum(prices[-period:]) / period
+
+
+def calculate_ema(prices, period):
+    if len(prices) < period:
+        return None
+    multiplier = 2 / (period + 1)
+    ema = sum(prices[:period]) / period
+    for price in prices[period:]:
+        ema = (price - ema) * multiplier + ema
+    return ema
+
+
+def calculate_macd(prices):
+    if len(prices) < 35:
+        return None
+    ema_12, ema_26 = [], []
+    ema_12_val = ema_26_val = 0
+    for i, price in enumerate(prices):
+        if i < 12:
+            ema_12_val = sum(prices[:i + 1]) / (i + 1)
+        else:
+            ema_12_val = (price - ema_12_val) * 2 / 13 + ema_12_val
+        if i < 26:
+            ema_26_val = sum(prices[:i + 1]) / (i + 1)
+        else:
+            ema_26_val = (price - ema_26_val) * 2 / 27 + ema_26_val
+        if i >= 25:
+            ema_12.append(ema_12_val)
+            ema_26.append(ema_26_val)
+    macd_line = [a - b for a, b in zip(ema_12, ema_26)]
+    signal_line = []
+    signal_val = 0
+    for i, value in enumerate(macd_line):
+        if i < 9:
+            signal_val = sum(macd_line[:i + 1]) / (i + 1)
+        else:
+            signal_val = (value - signal_val) * 0.2 + signal_val
+        signal_line.append(signal_val)
+    return macd_line[-1], signal_line[-1]
+
+
+def calculate_rsi(prices, period=14):
+    if len(prices) < period + 1:
+        return None
+    gains, losses = [], []
+    for i in range(1, len(prices)):
+        change = prices[i] - prices[i - 1]
+        gains.append(max(change, 0))
+        losses.append(max(-change, 0))
+    avg_gain = sum(gains[-period:]) / period
+    avg_loss = sum(losses[-period:]) / period
+    if avg_loss == 0:
+        return 100
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+
+# ============ Benchmark ============
+
+def best_of(repeat: int, fn) -> float:
+    """Best wall time of `repeat` runs in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def random_walk(points: int) -> list[float]:
+    rnd = random.Random(42)
+    prices = [12500.0]
+    for _ in range(points - 1):
+        prices.append(prices[-1] + rnd.gauss(0, 8))
+    return prices
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=10_000)
+    parser.add_argument("--series-points", type=int, default=2_000,
+                        help="Length for the per-point baseline series (quadratic cost)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    prices = random_walk(args.points)
+    array = np.asarray(prices)
+    high, low = array + 5, array - 5
+
+    # Same definitions give the same numbers
+    assert abs(calculate_sma(prices, 30) - indicators.last(indicators.sma(array, 30))) < 1e-6
+    assert abs(calculate_ema(prices, 26) - indicators.last(indicators.ema(array, 26))) < 1e-6
+
+    print(f"Latest value, {args.points:,} points")
+    print(f"{'indicator':<16}{'python':>12}{'numpy':>12}{'speedup':>10}")
+    cases = [
+        ("SMA 30", lambda: calculate_sma(prices, 30), lambda: indicators.sma(array, 30)),
+        ("EMA 26", lambda: calculate_ema(prices, 26), lambda: indicators.ema(array, 26)),
+        ("MACD 12/26/9", lambda: calculate_macd(prices), lambda: indicators.macd(array)),
+        ("RSI 14", lambda: calculate_rsi(prices), lambda: indicators.rsi(array)),
+        ("Bollinger 20", None, lambda: indicators.bollinger(array)),
+        ("ATR 14", None, lambda: indicators.atr(high, low, array)),
+    ]
+    for name, python_fn, numpy_fn in cases:
+        fast = best_of(args.repeat, numpy_fn)
+        if python_fn is None:
+            print(f"{name:<16}{'-':>12}{fast:>10.2f}ms{'-':>10}")
+            continue
+        slow = best_of(args.repeat, python_fn)
+        print(f"{name:<16}{slow:>10.2f}ms{fast:>10.2f}ms{slow / fast:>9.1f}x")
+
+    n = min(args.series_points, args.points)
+    sub, sub_array = prices[:n], array[:n]
+    print(f"\nWhole series, {n:,} points (baseline called once per point)")
+    print(f"{'indicator':<16}{'python':>12}{'numpy':>12}{'speedup':>10}")
+    cases = [
+        ("SMA 30", lambda: [calculate_sma(sub[:i + 1], 30) for i in range(n)],
+         lambda: indicators.sma(sub_array, 30)),
+        ("EMA 26", lambda: [calculate_ema(sub[:i + 1], 26) for i in range(n)],
+         lambda: indicators.ema(sub_array, 26)),
+        ("RSI 14", lambda: [calculate_rsi(sub[:i + 1]) for i in range(n)],
+         lambda: indicators.rsi(sub_array)),
+    ]
+    for name, python_fn, numpy_fn in cases:
+        slow = best_of(1, python_fn)
+        fast = best_of(args.repeat, numpy_fn)
+        print(f"{name:<16}{slow:>10.2f}ms{fast:>10.2f}ms{slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
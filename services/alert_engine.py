@@ -0,0 +1,317 @@
+"""
+Alert Engine - Set-based evaluation of user price alerts
+
+Armed alerts live in an in-memory index of threshold books, one per
+(bank, currency, rate_type), each split into sorted "above" and "below"
+lists. Every book's price is resolved once per tick from the rate
+snapshot (the best_high/best_low pseudo-banks from its per-currency
+rankings), and only the
+thresholds crossed since the previous tick are visited. Trigger updates
+are written in one batch.
+"""
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, update
+
+from database.db import get_session
+from database.models import Alert
+from services.rate_snapshot import get_snapshot, RateSnapshot, buy_price, sell_price
+from config import BANKS
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-banks: best rate across all banks
+BEST_BANKS = ("best_high", "best_low")
+
+# Max ids per UPDATE ... WHERE id IN (...) statement
+UPDATE_BATCH_SIZE = 500
+
+
+def resolve_price(snapshot: RateSnapshot, bank_code: str, currency_code: str,
+                  rate_type: str) -> Optional[tuple[float, str]]:
+    """Current price and bank name an alert group is compared against"""
+    if bank_code in BEST_BANKS:
+        ranking = snapshot.rankings.get(currency_code)
+        if not ranking:
+            return None
+
+        if bank_code == "best_high":
+            # Highest buy rate
+            best = ranking.best_buy
+            if best is None:
+                return None
+            current = buy_price(best)
+        else:
+            # Lowest sell rate
+            best = ranking.best_sell
+            if best is None:
+                return None
+            current = sell_price(best)
+        return current, BANKS.get(best["bank_code"], {}).get("name_uz", best["bank_code"])
+
+    rate = snapshot.by_key.get((bank_code, currency_code))
+    if not rate:
+        return None
+
+    if rate_type == "buy":
+        current = rate.get("buy_rate") or rate.get("official_rate") or 0
+    else:
+        current = rate.get("sell_rate") or rate.get("official_rate") or 0
+    return current, BANKS.get(bank_code, {}).get("name_uz", bank_code)
+
+
+class AlertEntry:
+    """Fields of an armed alert the engine needs"""
+    __slots__ = ("id", "user_id", "bank_code", "currency_code", "threshold",
+                 "direction", "rate_type", "is_repeating")
+
+    def __init__(self, alert):
+        for name in self.__slots__:
+            setattr(self, name, getattr(alert, name))
+
+    @property
+    def book_key(self) -> tuple:
+        return (self.bank_code, self.currency_code, self.rate_type)
+
+    def holds_at(self, price: float) -> bool:
+        """Is the alert condition true at this price"""
+        if self.direction == "above":
+            return price >= self.threshold
+        return price <= self.threshold
+
+
+class ThresholdBook:
+    """Alerts of one (bank, currency, rate_type), sorted by threshold per direction"""
+
+    def __init__(self):
+        self.thresholds = {"above": [], "below": []}
+        self.entries = {"above": [], "below": []}
+
+    def __len__(self) -> int:
+        return len(self.entries["above"]) + len(self.entries["below"])
+
+    def add(self, entry: AlertEntry) -> None:
+        thresholds = self.thresholds[entry.direction]
+        entries = self.entries[entry.direction]
+        # Equal thresholds keep insertion order; remove() scans that run
+        i = bisect_right(thresholds, entry.threshold)
+        thresholds.insert(i, entry.threshold)
+        entries.insert(i, entry)
+
+    def remove(self, entry: AlertEntry) -> None:
+        thresholds = self.thresholds[entry.direction]
+        entries = self.entries[entry.direction]
+        i = bisect_left(thresholds, entry.threshold)
+        while i < len(entries) and thresholds[i] == entry.threshold:
+            if entries[i].id == entry.id:
+                del thresholds[i]
+                del entries[i]
+                return
+            i += 1
+
+    def crossed(self, old: Optional[float], new: float) -> list:
+        """
+        Alerts whose threshold was crossed moving from old to new
+
+        With no previous price every alert whose condition holds at the
+        new price is returned.
+        """
+        above_t, above = self.thresholds["above"], self.entries["above"]
+        below_t, below = self.thresholds["below"], self.entries["below"]
+
+        if old is None:
+            return above[:bisect_right(above_t, new)] + below[bisect_left(below_t, new):]
+        if new > old:
+            # threshold in (old, new]
+            return above[bisect_right(above_t, old):bisect_right(above_t, new)]
+        if new < old:
+            # threshold in [new, old)
+            return below[bisect_left(below_t, new):bisect_left(below_t, old)]
+        return []
+
+
+class AlertIndex:
+    """
+    In-memory sorted threshold index over all armed alerts
+
+    Each tick only looks at the thresholds between a book's previous and
+    current price, so its cost follows the number of triggered alerts
+    rather than the number of stored ones. Handlers keep the index in
+    sync through add() and remove().
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._books = {}
+        self._entries = {}
+        self._last_price = {}
+        # Alerts added while their condition already held
+        self._pending = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    async def load(self) -> None:
+        """(Re)build the index from the database"""
+        async with get_session() as session:
+            result = await session.execute(
+                select(
+                    Alert.id, Alert.user_id, Alert.bank_code, Alert.currency_code,
+                    Alert.threshold, Alert.direction, Alert.rate_type, Alert.is_repeating
+                ).where(
+                    Alert.is_active == True,
+                    Alert.is_triggered == False,
+                    Alert.is_paused == False
+                )
+            )
+            rows = result.all()
+
+        self._books = {}
+        self._entries = {}
+        self._last_price = {}
+        self._pending = set()
+        for row in rows:
+            self._insert(AlertEntry(row))
+        self.loaded = True
+        logger.info(f"Alert index loaded: {len(self._entries)} alerts in {len(self._books)} books")
+
+    def _insert(self, entry: AlertEntry) -> None:
+        self._entries[entry.id] = entry
+        self._books.setdefault(entry.book_key, ThresholdBook()).add(entry)
+
+    def add(self, alert) -> None:
+        """Index a new or resumed alert"""
+        if not self.loaded or not alert.is_active or alert.is_paused or alert.is_triggered:
+            return
+        self.remove(alert.id)
+
+        entry = AlertEntry(alert)
+        self._insert(entry)
+
+        # Already past its threshold: fire on the next tick, not the next crossing
+        last = self._last_price.get(entry.book_key)
+        if last is not None and entry.holds_at(last):
+            self._pending.add(entry.id)
+
+    def remove(self, alert_id: int) -> None:
+        """Drop a deleted, paused or triggered alert"""
+        entry = self._entries.pop(alert_id, None)
+        if entry is None:
+            return
+        self._pending.discard(alert_id)
+        book = self._books.get(entry.book_key)
+        if book is not None:
+            book.remove(entry)
+            if not len(book):
+                del self._books[entry.book_key]
+
+    def collect(self, snapshot: RateSnapshot) -> list[tuple]:
+        """Advance every book to the snapshot prices, returning (entry, price, bank_name)"""
+        fired = []
+        prices = {}
+
+        for key, book in self._books.items():
+            price = resolve_price(snapshot, *key)
+            if price is None:
+                continue
+            prices[key] = price
+            current, bank_name = price
+
+            for entry in book.crossed(self._last_price.get(key), current):
+                fired.append((entry, current, bank_name))
+            self._last_price[key] = current
+
+        fired_ids = {entry.id for entry, _, _ in fired}
+        for alert_id in self._pending:
+            entry = self._entries.get(alert_id)
+            if entry is None or alert_id in fired_ids or entry.book_key not in prices:
+                continue
+            current, bank_name = prices[entry.book_key]
+            if entry.holds_at(current):
+                fired.append((entry, current, bank_name))
+        self._pending = set()
+
+        return fired
+
+
+alert_index = AlertIndex()
+
+
+def format_alert_message(alert, current: float, bank_name: str) -> str:
+    """Alert notification text"""
+    rate_text = "Sotib olish" if alert.rate_type == "buy" else "Sotish"
+    dir_text = "oshdi" if alert.direction == "above" else "tushdi"
+
+    return (
+        f"🔔 **Alert!**\n\n"
+        f"💱 **{alert.currency_code}** {dir_text}!\n"
+        f"🏦 {bank_name}\n"
+        f"📊 {rate_text}: **{current:,.0f}** so'm\n"
+        f"🎯 Sizning chegarangiz: {alert.threshold:,.0f}"
+    )
+
+
+async def mark_triggered(session, triggered: list, now: datetime) -> None:
+    """Record triggers for a batch of alerts (repeating alerts stay armed)"""
+    once_ids = [a.id for a in triggered if not a.is_repeating]
+    repeat_ids = [a.id for a in triggered if a.is_repeating]
+
+    for i in range(0, len(once_ids), UPDATE_BATCH_SIZE):
+        await session.execute(
+            update(Alert)
+            .where(Alert.id.in_(once_ids[i:i + UPDATE_BATCH_SIZE]))
+            .values(is_triggered=True, last_triggered_at=now)
+        )
+    for i in range(0, len(repeat_ids), UPDATE_BATCH_SIZE):
+        await session.execute(
+            update(Alert)
+            .where(Alert.id.in_(repeat_ids[i:i + UPDATE_BATCH_SIZE]))
+            .values(last_triggered_at=now)
+        )
+
+
+async def evaluate_alerts(notify) -> int:
+    """
+    Check armed alerts against the latest rates
+
+    Args:
+        notify: async callback(user_id, message)
+
+    Returns:
+        Number of triggered alerts
+    """
+    snapshot = await get_snapshot()
+    if not len(snapshot):
+        return 0
+
+    if not alert_index.loaded:
+        await alert_index.load()
+
+    fired = alert_index.collect(snapshot)
+    if not fired:
+        return 0
+
+    triggered = []
+    for entry, current, bank_name in fired:
+        try:
+            await notify(entry.user_id, format_alert_message(entry, current, bank_name))
+        except Exception as e:
+            logger.error(f"Failed to send alert: {e}")
+        triggered.append(entry)
+
+        # One-shot alerts leave the index; repeating ones wait for the next crossing
+        if not entry.is_repeating:
+            alert_index.remove(entry.id)
+
+    async with get_session() as session:
+        await mark_triggered(session, triggered, datetime.utcnow())
+        await session.commit()
+
+    logger.info(f"Alerts: {len(triggered)} triggered, {len(alert_index)} armed")
+    return len(triggered)
@@ -4,108 +4,38 @@ Analysis Service - REAL DATA ONLY, NO FAKE
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
-from sqlalchemy import select
 
-from database.db import get_session
-from database.models import RateHistory
+import numpy as np
 
-logger = logging.getLogger(__name__)
+from services import indicators
+from services.history_store import DEFAULT_MAX_POINTS, bucket_start, get_history_many, select_tier
+from services.indicator_state import STATE_TIER, get_indicators
 
+logger = logging.getLogger(__name__)
 
-def calculate_sma(prices: list[float], period: int) -> Optional[float]:
-    """Simple Moving Average"""
-    if len(prices) < period:
-        return None
-    return sum(prices[-period:]) / period
+# Streaming samples needed before analysis stops reading history (MACD signal is defined)
+MIN_STATE_SAMPLES = 35
 
 
-def calculate_ema(prices: list[float], period: int) -> Optional[float]:
-    """Exponential Moving Average"""
-    if len(prices) < period:
-        return None
-    
-    multiplier = 2 / (period + 1)
-    ema = sum(prices[:period]) / period  # SMA as starting point
-    
-    for price in prices[period:]:
-        ema = (price - ema) * multiplier + ema
-    
-    return ema
-
-
-def calculate_macd(prices: list[float]) -> Optional[dict]:
+def summarize_macd(line: np.ndarray, signal: np.ndarray) -> Optional[dict]:
     """
-    MACD (Moving Average Convergence Divergence)
-    Standard parameters: EMA 12, EMA 26, Signal 9
+    Latest MACD values with trend and crossover
     
     Returns:
-        macd_line: EMA12 - EMA26
-        signal_line: EMA9 of MACD line
+        macd: EMA12 - EMA26
+        signal: EMA9 of MACD line
         histogram: MACD - Signal
         trend: bullish/bearish based on crossover
     """
-    if len(prices) < 35:  # Need enough data for EMA26 + Signal9
+    if len(line) < 2 or np.isnan(signal[-2]):
         return None
     
-    # Calculate EMAs
-    ema_12 = []
-    ema_26 = []
-    
-    # Initialize with SMA
-    ema_12_val = sum(prices[:12]) / 12
-    ema_26_val = sum(prices[:26]) / 26
-    
-    mult_12 = 2 / 13  # 2 / (12 + 1)
-    mult_26 = 2 / 27  # 2 / (26 + 1)
+    current_macd, current_signal = float(line[-1]), float(signal[-1])
+    prev_macd, prev_signal = float(line[-2]), float(signal[-2])
     
-    for i, price in enumerate(prices):
-        if i < 12:
-            ema_12_val = sum(prices[:i+1]) / (i + 1)
-        else:
-            ema_12_val = (price - ema_12_val) * mult_12 + ema_12_val
-        
-        if i < 26:
-            ema_26_val = sum(prices[:i+1]) / (i + 1)
-        else:
-            ema_26_val = (price - ema_26_val) * mult_26 + ema_26_val
-        
-        if i >= 25:  # Start collecting after enough data
-            ema_12.append(ema_12_val)
-            ema_26.append(ema_26_val)
-    
-    # Calculate MACD line
-    macd_line = [e12 - e26 for e12, e26 in zip(ema_12, ema_26)]
-    
-    if len(macd_line) < 9:
-        return None
-    
-    # Calculate Signal line (EMA9 of MACD)
-    signal_val = sum(macd_line[:9]) / 9
-    mult_9 = 2 / 10
-    
-    signal_line = []
-    for i, macd_val in enumerate(macd_line):
-        if i < 9:
-            signal_val = sum(macd_line[:i+1]) / (i + 1)
-        else:
-            signal_val = (macd_val - signal_val) * mult_9 + signal_val
-        signal_line.append(signal_val)
-    
-    # Current values
-    current_macd = macd_line[-1]
-    current_signal = signal_line[-1]
-    histogram = current_macd - current_signal
-    
-    # Trend detection
-    if current_macd > current_signal:
-        trend = "bullish"
-    else:
-        trend = "bearish"
+    trend = "bullish" if current_macd > current_signal else "bearish"
     
     # Crossover detection (signal strength)
-    prev_macd = macd_line[-2] if len(macd_line) >= 2 else current_macd
-    prev_signal = signal_line[-2] if len(signal_line) >= 2 else current_signal
-    
     crossover = None
     if prev_macd <= prev_signal and current_macd > current_signal:
         crossover = "bullish_crossover"
@@ -115,50 +45,14 @@ def calculate_macd(prices: list[float]) -> Optional[dict]:
     return {
         "macd": round(current_macd, 2),
         "signal": round(current_signal, 2),
-        "histogram": round(histogram, 2),
+        "histogram": round(current_macd - current_signal, 2),
         "trend": trend,
         "crossover": crossover
     }
 
 
-def calculate_rsi(prices: list[float], period: int = 14) -> Optional[float]:
-    """
-    Relative Strength Index (RSI)
-    RSI > 70 = overbought (sotish vaqti)
-    RSI < 30 = oversold (sotib olish vaqti)
-    """
-    if len(prices) < period + 1:
-        return None
-    
-    gains = []
-    losses = []
-    
-    for i in range(1, len(prices)):
-        change = prices[i] - prices[i-1]
-        if change >= 0:
-            gains.append(change)
-            losses.append(0)
-        else:
-            gains.append(0)
-            losses.append(abs(change))
-    
-    if len(gains) < period:
-        return None
-    
-    avg_gain = sum(gains[-period:]) / period
-    avg_loss = sum(losses[-period:]) / period
-    
-    if avg_loss == 0:
-        return 100
-    
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
-    
-    return rsi
-
-
-def predict_trend(prices: list[float]) -> dict:
-    """Trend prediction based on real indicators"""
+def predict_trend(prices: list[float], rsi: Optional[float] = None, sma_7: Optional[float] = None) -> dict:
+    """Trend prediction based on real indicators (computed here unless given)"""
     if len(prices) < 7:
         return {
             "prediction": "unknown",
@@ -166,8 +60,10 @@ def predict_trend(prices: list[float]) -> dict:
             "message": "⚠️ Ma'lumot yetarli emas"
         }
     
-    rsi = calculate_rsi(prices) if len(prices) >= 15 else None
-    sma_7 = calculate_sma(prices, 7)
+    if rsi is None:
+        rsi = indicators.last(indicators.rsi(prices))
+    if sma_7 is None:
+        sma_7 = indicators.last(indicators.sma(prices, 7))
     current_price = prices[-1]
     
     bullish_score = 0
@@ -227,61 +123,156 @@ def predict_trend(prices: list[float]) -> dict:
     }
 
 
+def analysis_from_state(currency_code: str, values: dict, window: int) -> dict:
+    """
+    Technical analysis from precomputed streaming indicator values
+
+    Args:
+        window: Hourly buckets in the analysed range, reported as data_points
+            like the length of the history the analysis stands in for
+    """
+    current = values["price"]
+    prev = values["prev_price"] if values["prev_price"] is not None else current
+    change = current - prev
+    change_pct = (change / prev * 100) if prev else 0
+    rsi = values["rsi"]
+    sma_7, sma_14, sma_30 = values["sma_7"], values["sma_14"], values["sma_30"]
+    
+    macd = None
+    if values["prev_macd"] is not None:
+        macd = summarize_macd(
+            np.array([values["prev_macd"], values["macd"]]),
+            np.array([values["prev_signal"], values["signal"]])
+        )
+    
+    bollinger = None
+    if values["bollinger"]:
+        middle, upper, lower = values["bollinger"]
+        bollinger = {"upper": round(upper), "middle": round(middle), "lower": round(lower)}
+    
+    return {
+        "currency": currency_code,
+        "has_data": True,
+        "current_price": current,
+        "change": change,
+        "change_pct": change_pct,
+        "rsi": round(rsi) if rsi else None,
+        "rsi_signal": "📈 Oshadi" if rsi and rsi < 30 else "📉 Tushadi" if rsi and rsi > 70 else "➖ Neytral",
+        "sma_7": round(sma_7) if sma_7 else None,
+        "sma_14": round(sma_14) if sma_14 else None,
+        "sma_30": round(sma_30) if sma_30 else None,
+        "macd": macd,
+        "bollinger": bollinger,
+        "atr": round(values["atr"], 2) if values["atr"] is not None else None,
+        "prediction": predict_trend(values["prices"], rsi, sma_7),
+        "data_points": min(values["samples"], window)
+    }
+
+
+def analysis_from_history(currency_code: str, history: list[dict]) -> dict:
+    """Technical analysis computed from a history series"""
+    if len(history) < 7:
+        return {
+            "currency": currency_code,
+            "has_data": False,
+            "message": "⚠️ Tarix ma'lumotlari hali to'planmagan.\nBot ishlagan vaqt davomida ma'lumotlar yig'iladi.",
+            "data_points": len(history)
+        }
+    
+    prices = indicators.as_series([h["close"] for h in history])
+    
+    # Whole indicator series in one pass each; the report uses the latest values
+    rsi = indicators.last(indicators.rsi(prices))
+    sma_7 = indicators.last(indicators.sma(prices, 7))
+    sma_14 = indicators.last(indicators.sma(prices, 14))
+    sma_30 = indicators.last(indicators.sma(prices, 30))
+    macd = summarize_macd(*indicators.macd(prices)[:2])
+    middle, upper, lower = indicators.bollinger(prices)
+    atr = indicators.last(indicators.atr(
+        [h["high"] for h in history], [h["low"] for h in history], prices
+    ))
+    
+    prediction = predict_trend(prices, rsi, sma_7)
+    
+    current = float(prices[-1])
+    prev = float(prices[-2]) if len(prices) >= 2 else current
+    change = current - prev
+    change_pct = (change / prev * 100) if prev else 0
+    
+    return {
+        "currency": currency_code,
+        "has_data": True,
+        "current_price": current,
+        "change": change,
+        "change_pct": change_pct,
+        "rsi": round(rsi) if rsi else None,
+        "rsi_signal": "📈 Oshadi" if rsi and rsi < 30 else "📉 Tushadi" if rsi and rsi > 70 else "➖ Neytral",
+        "sma_7": round(sma_7) if sma_7 else None,
+        "sma_14": round(sma_14) if sma_14 else None,
+        "sma_30": round(sma_30) if sma_30 else None,
+        "macd": macd,
+        "bollinger": {
+            "upper": round(indicators.last(upper)),
+            "middle": round(indicators.last(middle)),
+            "lower": round(indicators.last(lower)),
+        } if indicators.last(middle) is not None else None,
+        "atr": round(atr, 2) if atr is not None else None,
+        "prediction": prediction,
+        "data_points": len(prices)
+    }
+
+
 async def get_technical_analysis(currency_code: str, days: int = 30) -> dict:
-    """Get technical analysis - REAL DATA ONLY"""
+    """
+    Get technical analysis - REAL DATA ONLY
+    
+    See get_technical_analysis_many for when the streaming indicator state
+    is used instead of history.
+    """
+    analyses = await get_technical_analysis_many([currency_code], days)
+    return analyses[currency_code]
+
+
+async def get_technical_analysis_many(currency_codes: list[str], days: int = 30) -> dict:
+    """
+    Technical analysis of several currencies at once
+    
+    The streaming indicator state runs on hourly buckets, so it is only used
+    when the history for `days` would be read from the hourly tier too (the
+    default 30 days); indicators then have the same time scale either way.
+    Its averages start from the first bucket ever seen instead of the start
+    of the window, which only shifts EMA-based values until the seed has
+    decayed. Other windows, and currencies whose state is still warming up,
+    are computed from history loaded with one get_history_many call.
+    
+    Returns:
+        currency_code -> analysis (same shape as get_technical_analysis)
+    """
+    results = {}
     try:
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
+        use_state = select_tier(start_date, (end_date - start_date) / DEFAULT_MAX_POINTS, end_date) is STATE_TIER
+        window = (bucket_start(end_date, STATE_TIER) - bucket_start(start_date, STATE_TIER)) // STATE_TIER.step + 1
         
-        async with get_session() as session:
-            result = await session.execute(
-                select(RateHistory).where(
-                    RateHistory.currency_code == currency_code,
-                    RateHistory.bank_code == "cbu",
-                    RateHistory.recorded_at >= start_date
-                ).order_by(RateHistory.recorded_at)
-            )
-            history = result.scalars().all()
-        
-        if len(history) < 7:
-            return {
-                "currency": currency_code,
-                "has_data": False,
-                "message": "⚠️ Tarix ma'lumotlari hali to'planmagan.\nBot ishlagan vaqt davomida ma'lumotlar yig'iladi.",
-                "data_points": len(history)
-            }
-        
-        prices = [h.official_rate or h.buy_rate or 0 for h in history]
-        
-        rsi = calculate_rsi(prices)
-        sma_7 = calculate_sma(prices, 7)
-        sma_14 = calculate_sma(prices, 14) if len(prices) >= 14 else None
-        sma_30 = calculate_sma(prices, 30) if len(prices) >= 30 else None
-        macd = calculate_macd(prices)  # Real MACD calculation
-        
-        prediction = predict_trend(prices)
+        pending = []
+        for currency_code in currency_codes:
+            values = await get_indicators("cbu", currency_code) if use_state else None
+            if values and values["samples"] >= MIN_STATE_SAMPLES:
+                results[currency_code] = analysis_from_state(currency_code, values, window)
+            else:
+                pending.append(currency_code)
         
-        current = prices[-1]
-        prev = prices[-2] if len(prices) >= 2 else current
-        change = current - prev
-        change_pct = (change / prev * 100) if prev else 0
+        if pending:
+            histories = await get_history_many(pending, "cbu", start_date, end_date)
+            for currency_code in pending:
+                results[currency_code] = analysis_from_history(currency_code, histories[currency_code])
         
-        return {
-            "currency": currency_code,
-            "has_data": True,
-            "current_price": current,
-            "change": change,
-            "change_pct": change_pct,
-            "rsi": round(rsi) if rsi else None,
-            "rsi_signal": "📈 Oshadi" if rsi and rsi < 30 else "📉 Tushadi" if rsi and rsi > 70 else "➖ Neytral",
-            "sma_7": round(sma_7) if sma_7 else None,
-            "sma_14": round(sma_14) if sma_14 else None,
-            "sma_30": round(sma_30) if sma_30 else None,
-            "macd": macd,  # Now includes real MACD data
-            "prediction": prediction,
-            "data_points": len(prices)
-        }
+        return results
         
     except Exception as e:
         logger.error(f"Technical analysis error: {e}")
-        return {"has_data": False, "message": str(e)}
+        return {
+            currency_code: results.get(currency_code) or {"has_data": False, "message": str(e)}
+            for currency_code in currency_codes
+        }
@@ -5,6 +5,7 @@ Fetches official exchange rates from CBU API.
 API Documentation: https://cbu.uz/uz/arkhiv-kursov-valyut/
 """
 import httpx
+import hashlib
 import logging
 from typing import Optional
 from datetime import datetime
@@ -13,6 +14,34 @@ from config import CBU_API_URL
 
 logger = logging.getLogger(__name__)
 
+# Shared HTTP client (keeps the connection to cbu.uz alive between polls)
+_client: Optional[httpx.AsyncClient] = None
+
+# Conditional polling state
+_poll_state = {
+    "etag": None,
+    "last_modified": None,
+    "body_hash": None,
+    "fingerprint": None,
+    "rates": [],
+}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared CBU HTTP client"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=30.0)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared CBU HTTP client"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 async def fetch_cbu_rates() -> Optional[list[dict]]:
     """
@@ -37,14 +66,13 @@ async def fetch_cbu_rates() -> Optional[list[dict]]:
     }
     """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(CBU_API_URL)
-            response.raise_for_status()
-            data = response.json()
-            
-            logger.info(f"Successfully fetched {len(data)} rates from CBU")
-            return data
-            
+        response = await get_client().get(CBU_API_URL)
+        response.raise_for_status()
+        data = response.json()
+        
+        logger.info(f"Successfully fetched {len(data)} rates from CBU")
+        return data
+        
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error fetching CBU rates: {e}")
         return None
@@ -92,6 +120,75 @@ def parse_cbu_rates(raw_data: list[dict]) -> list[dict]:
     return rates
 
 
+def rates_fingerprint(rates: list[dict]) -> str:
+    """Hash of the published values (Date, rate, nominal, diff per currency)"""
+    canonical = "|".join(
+        f"{r['currency_code']}:{r['official_rate']}:{r['nominal']}:{r['diff']}:{r['date']}"
+        for r in sorted(rates, key=lambda r: r["currency_code"])
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+async def poll_cbu_rates() -> tuple[Optional[list[dict]], Optional[str]]:
+    """
+    Poll CBU for rates, detecting unchanged payloads cheaply
+    
+    Uses ETag/Last-Modified when the server offers them, otherwise a hash
+    of the response body. A changed body whose Date and rates are the
+    same as before keeps the previous fingerprint.
+    
+    Returns:
+        (parsed rates, fingerprint) - fingerprint only changes when the
+        published rates change. (None, None) on error.
+    """
+    state = _poll_state
+    headers = {}
+    if state["rates"]:
+        if state["etag"]:
+            headers["If-None-Match"] = state["etag"]
+        if state["last_modified"]:
+            headers["If-Modified-Since"] = state["last_modified"]
+    
+    try:
+        response = await get_client().get(CBU_API_URL, headers=headers)
+        
+        if response.status_code == 304:
+            logger.debug("CBU rates not modified (304)")
+            return state["rates"], state["fingerprint"]
+        
+        response.raise_for_status()
+        state["etag"] = response.headers.get("ETag")
+        state["last_modified"] = response.headers.get("Last-Modified")
+        
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        if body_hash == state["body_hash"] and state["rates"]:
+            logger.debug("CBU rates unchanged (same body)")
+            return state["rates"], state["fingerprint"]
+        
+        rates = parse_cbu_rates(response.json())
+        if not rates:
+            return None, None
+        
+        state["body_hash"] = body_hash
+        fingerprint = rates_fingerprint(rates)
+        if fingerprint == state["fingerprint"]:
+            logger.debug("CBU rates unchanged (same Date and values)")
+            return state["rates"], fingerprint
+        
+        state["fingerprint"] = fingerprint
+        state["rates"] = rates
+        logger.info(f"Fetched {len(rates)} new rates from CBU (Date: {rates[0]['date']})")
+        return rates, fingerprint
+    
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error polling CBU rates: {e}")
+    except httpx.RequestError as e:
+        logger.error(f"Request error polling CBU rates: {e}")
+    except Exception as e:
+        logger.error(f"Unexpected error polling CBU rates: {e}")
+    return None, None
+
+
 async def get_cbu_rates() -> list[dict]:
     """
     Get parsed CBU rates
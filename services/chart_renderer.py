@@ -0,0 +1,155 @@
+"""
+Chart Renderer - matplotlib in a pool of worker processes
+
+Drawing and savefig take hundreds of milliseconds of CPU, which would
+stall every other update if done on the event loop. Jobs are sent to
+pre-warmed worker processes (matplotlib imported, style applied, fonts
+cached) as plain float arrays and come back as PNG bytes. A queue depth
+limit and a timeout keep chart bursts from piling up.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import CHART_WORKERS, CHART_QUEUE_LIMIT, CHART_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+CHART_STYLE = "seaborn-v0_8-darkgrid"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ChartBusy(Exception):
+    """Too many charts queued or rendering took too long"""
+
+
+def to_timestamps(dates: list[datetime]) -> list[float]:
+    """Naive UTC datetimes as POSIX seconds (what workers receive)"""
+    return [(d - EPOCH).total_seconds() for d in dates]
+
+
+def _init_worker() -> None:
+    """Import matplotlib, apply the style and warm the font cache once per worker"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.style.use(CHART_STYLE)
+    render_rate_chart("warmup", [0.0, 86400.0], [1.0, 2.0], 1)
+
+
+def render_rate_chart(title: str, timestamps: list[float], rates: list[float], days: int) -> bytes:
+    """Draw a rate history chart and return PNG bytes (runs in a worker)"""
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
+    dates = [EPOCH + timedelta(seconds=ts) for ts in timestamps]
+
+    # Figure without pyplot: no global state shared between charts
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+
+    ax.plot(dates, rates, color='#2196F3', linewidth=2, marker='o', markersize=4)
+    ax.fill_between(dates, rates, alpha=0.3, color='#2196F3')
+
+    ax.set_title(title, fontsize=14, fontweight='bold')
+    ax.set_xlabel('Sana', fontsize=10)
+    ax.set_ylabel("So'm", fontsize=10)
+
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=max(1, days // 7)))
+    ax.tick_params(axis='x', labelrotation=45)
+
+    min_rate = min(rates)
+    max_rate = max(rates)
+    min_idx = rates.index(min_rate)
+    max_idx = rates.index(max_rate)
+
+    ax.annotate(f'Min: {min_rate:,.0f}', xy=(dates[min_idx], min_rate),
+                xytext=(5, -15), textcoords='offset points', fontsize=9,
+                color='red', fontweight='bold')
+    ax.annotate(f'Max: {max_rate:,.0f}', xy=(dates[max_idx], max_rate),
+                xytext=(5, 10), textcoords='offset points', fontsize=9,
+                color='green', fontweight='bold')
+
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=150, bbox_inches='tight')
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    """Process pool for chart rendering with bounded queue depth"""
+
+    def __init__(self, workers: int = CHART_WORKERS, queue_limit: int = CHART_QUEUE_LIMIT,
+                 timeout: float = CHART_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+        self._local_ready = False
+
+    @property
+    def running(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        if self._pool is not None:
+            return
+        # spawn: workers must not inherit the bot's event loop and connections
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        # Start the workers now instead of on the first chart
+        for _ in range(self.workers):
+            self._pool.submit(abs, 0)
+        logger.info(f"Chart renderer started with {self.workers} workers")
+
+    def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _job_done(self, _future) -> None:
+        self._in_flight -= 1
+
+    async def render(self, title: str, dates: list[datetime], rates: list[float], days: int) -> bytes:
+        """
+        Render a chart in the pool
+
+        Raises:
+            ChartBusy: queue is full or the chart timed out
+        """
+        args = (title, to_timestamps(dates), [float(r) for r in rates], days)
+
+        if self._pool is None:
+            # Pool not started (scripts): render in a thread
+            if not self._local_ready:
+                _init_worker()
+                self._local_ready = True
+            return await asyncio.to_thread(render_rate_chart, *args)
+
+        if self._in_flight >= self.queue_limit:
+            raise ChartBusy(f"{self._in_flight} charts queued")
+
+        # Depth counts jobs until the worker is done, even after a timeout
+        loop = asyncio.get_running_loop()
+        future = self._pool.submit(render_rate_chart, *args)
+        self._in_flight += 1
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._job_done, f))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise ChartBusy(f"Chart timed out after {self.timeout}s")
+
+
+chart_renderer = ChartRenderer()
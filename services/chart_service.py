@@ -1,56 +1,186 @@
 """
 Chart Service - With CBU Historical Data Fallback
+
+Rendered charts are cached by (currency, bank, days, data version), where
+the version is the last change of the rate, so a chart is redrawn only
+after the rate moves. The cache also keeps the Telegram file_id of the
+first upload, letting repeat requests resend without uploading the PNG.
+
+Requests are counted with a decaying score; after each history save the
+most requested charts are rendered ahead of the users asking for them.
 """
 import logging
-import io
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
-import httpx
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from sqlalchemy import select
+from sqlalchemy import select, func
 
 from database.db import get_session
 from database.models import RateHistory
+from services.history_store import get_history, DAY_OFFSET
+from services.history_backfill import ensure_cbu_history
+from services.chart_renderer import chart_renderer, ChartBusy
+from services.single_flight import single_flight
+from config import CHART_CACHE_BYTES, CHART_PRERENDER_TOP
 
 logger = logging.getLogger(__name__)
 
-plt.style.use('seaborn-v0_8-darkgrid')
+# Request counts lose half their weight after this many seconds
+CHART_STATS_HALF_LIFE = 6 * 3600
+
+# Scores below this are dropped from the statistics
+CHART_STATS_MIN_SCORE = 0.05
+
+
+@dataclass
+class CachedChart:
+    """A rendered chart and, once uploaded, its Telegram file_id"""
+    key: tuple
+    png: bytes
+    file_id: Optional[str] = None
+
+
+class ChartCache:
+    """LRU of rendered charts bounded by total PNG size"""
+
+    def __init__(self, max_bytes: int = CHART_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, CachedChart] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[CachedChart]:
+        chart = self._entries.get(key)
+        if chart is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return chart
+
+    def put(self, key: tuple, png: bytes) -> CachedChart:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old.png)
+
+        chart = CachedChart(key, png)
+        self._entries[key] = chart
+        self.size += len(png)
+
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.png)
+        return chart
+
+    def set_file_id(self, key: tuple, file_id: str) -> None:
+        chart = self._entries.get(key)
+        if chart is not None:
+            chart.file_id = file_id
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+chart_cache = ChartCache()
+
+
+# (currency, bank, days) -> (score, updated at monotonic time)
+_chart_stats: dict[tuple, tuple[float, float]] = {}
+
+
+def _decayed(score: float, since: float, now: float) -> float:
+    return score * 0.5 ** ((now - since) / CHART_STATS_HALF_LIFE)
+
+
+def record_chart_request(currency_code: str, bank_code: str, days: int) -> None:
+    """Count a user's chart request (recent requests weigh more)"""
+    key = (currency_code, bank_code, days)
+    now = time.monotonic()
+    score, since = _chart_stats.get(key, (0.0, now))
+    _chart_stats[key] = (_decayed(score, since, now) + 1, now)
+
+
+def popular_charts(limit: int = CHART_PRERENDER_TOP) -> list[tuple]:
+    """Most requested (currency, bank, days) combinations, highest score first"""
+    now = time.monotonic()
+    scores = {}
+    for key, (score, since) in list(_chart_stats.items()):
+        score = _decayed(score, since, now)
+        if score < CHART_STATS_MIN_SCORE:
+            del _chart_stats[key]
+            continue
+        scores[key] = score
+    return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+
+async def history_version(currency_code: str, bank_code: str) -> object:
+    """
+    Data version of a chart: time of the last change of the rate
+
+    History only stores a raw sample when the rate changes, so the newest
+    one is the last change; stable rates keep their version. Without raw
+    samples the chart comes from the daily CBU archive, which only changes
+    with the Tashkent date.
+    """
+    async with get_session() as session:
+        result = await session.execute(
+            select(func.max(RateHistory.recorded_at)).where(
+                RateHistory.currency_code == currency_code,
+                RateHistory.bank_code == bank_code
+            )
+        )
+        latest = result.scalar()
+    return latest or (datetime.utcnow() + DAY_OFFSET).date()
+
+
+async def get_chart(currency_code: str, bank_code: str = "cbu", days: int = 7) -> Optional[CachedChart]:
+    """
+    Rate chart from the cache, rendered on a miss
+
+    Raises:
+        ChartBusy: the chart pool is saturated
+    """
+    try:
+        key = (currency_code, bank_code, days, await history_version(currency_code, bank_code))
+    except Exception as e:
+        logger.error(f"Chart version lookup error: {e}")
+        key = None
+
+    if key is not None:
+        chart = chart_cache.get(key)
+        if chart is not None:
+            return chart
+
+    png = await generate_rate_chart(currency_code, bank_code, days)
+    if png is None:
+        return None
+    if key is None:
+        return CachedChart((currency_code, bank_code, days, None), png)
+    return chart_cache.put(key, png)
 
 
 async def fetch_cbu_history(currency_code: str, days: int = 7) -> list:
-    """Fetch historical rates from CBU archive API"""
+    """Daily CBU rates for the last `days` days (archive days are fetched once and stored)"""
     try:
-        rates = []
-        today = datetime.now()
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            for i in range(days):
-                date = today - timedelta(days=i)
-                date_str = date.strftime("%Y-%m-%d")
-                
-                url = f"https://cbu.uz/uz/arkhiv-kursov-valyut/json/{currency_code}/{date_str}/"
-                
-                try:
-                    response = await client.get(url)
-                    if response.status_code == 200:
-                        data = response.json()
-                        if data and len(data) > 0:
-                            rate_data = data[0]
-                            rates.append({
-                                "date": date,
-                                "rate": float(rate_data.get("Rate", 0)),
-                                "nominal": int(rate_data.get("Nominal", 1))
-                            })
-                except Exception as e:
-                    logger.debug(f"CBU fetch error for {date_str}: {e}")
-                    continue
-        
-        # Sort by date ascending
-        rates.sort(key=lambda x: x["date"])
-        logger.info(f"CBU history: fetched {len(rates)} records for {currency_code}")
+        await ensure_cbu_history(currency_code, days)
+        
+        end_date = datetime.utcnow()
+        history = await get_history(
+            currency_code, "cbu", end_date - timedelta(days=days), end_date,
+            resolution=timedelta(days=1)
+        )
+        rates = [
+            {"date": h["time"], "rate": h["close"]}
+            for h in history
+        ]
+        logger.info(f"CBU history: {len(rates)} records for {currency_code}")
         return rates
         
     except Exception as e:
@@ -58,34 +188,63 @@ async def fetch_cbu_history(currency_code: str, days: int = 7) -> list:
         return []
 
 
+async def prerender_popular_charts(limit: int = CHART_PRERENDER_TOP) -> int:
+    """
+    Render the most requested charts into the cache
+
+    Charts are rendered one at a time so users' own requests still find a
+    free worker; already cached charts cost one version lookup.
+
+    Returns:
+        Number of charts rendered
+    """
+    rendered = 0
+    for currency_code, bank_code, days in popular_charts(limit):
+        misses = chart_cache.misses
+        try:
+            # Same flight as a user asking for this chart right now
+            await single_flight.do(
+                ("chart", currency_code, bank_code, days), get_chart, currency_code, bank_code, days
+            )
+        except ChartBusy:
+            # Users are waiting for the pool: leave the rest to them
+            break
+        rendered += chart_cache.misses - misses
+    return rendered
+
+
 async def generate_rate_chart(
     currency_code: str,
     bank_code: str = "cbu",
     days: int = 7
 ) -> Optional[bytes]:
-    """Generate rate history chart - with CBU fallback"""
+    """
+    Generate rate history chart - with CBU fallback
+    
+    Raises:
+        ChartBusy: the chart pool is saturated
+    """
     try:
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
         
         # Try local history first
-        async with get_session() as session:
-            result = await session.execute(
-                select(RateHistory).where(
-                    RateHistory.currency_code == currency_code,
-                    RateHistory.bank_code == bank_code,
-                    RateHistory.recorded_at >= start_date
-                ).order_by(RateHistory.recorded_at)
+        history = await get_history(currency_code, bank_code, start_date, end_date)
+        
+        if bank_code == "cbu" and history and history[0]["time"] - start_date > timedelta(days=1):
+            # Local data starts late: daily points completed from the CBU archive
+            await ensure_cbu_history(currency_code, days)
+            history = await get_history(
+                currency_code, bank_code, start_date, end_date, resolution=timedelta(days=1)
             )
-            history = result.scalars().all()
         
         dates = []
         rates = []
         
         if len(history) >= 2:
             # Use local data
-            dates = [h.recorded_at for h in history]
-            rates = [h.official_rate or h.buy_rate or 0 for h in history]
+            dates = [h["time"] for h in history]
+            rates = [h["close"] for h in history]
             logger.info(f"Using local history: {len(history)} records")
         else:
             # Fallback: fetch from CBU archive
@@ -99,42 +258,13 @@ async def generate_rate_chart(
             dates = [h["date"] for h in cbu_history]
             rates = [h["rate"] for h in cbu_history]
         
-        # Create chart
-        fig, ax = plt.subplots(figsize=(10, 5))
-        
-        ax.plot(dates, rates, color='#2196F3', linewidth=2, marker='o', markersize=4)
-        ax.fill_between(dates, rates, alpha=0.3, color='#2196F3')
-        
-        ax.set_title(f'{currency_code} Kurs Tarixi ({days} kun)', fontsize=14, fontweight='bold')
-        ax.set_xlabel('Sana', fontsize=10)
-        ax.set_ylabel("So'm", fontsize=10)
-        
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
-        ax.xaxis.set_major_locator(mdates.DayLocator(interval=max(1, days // 7)))
-        plt.xticks(rotation=45)
-        
-        min_rate = min(rates)
-        max_rate = max(rates)
-        min_idx = rates.index(min_rate)
-        max_idx = rates.index(max_rate)
-        
-        ax.annotate(f'Min: {min_rate:,.0f}', xy=(dates[min_idx], min_rate),
-                    xytext=(5, -15), textcoords='offset points', fontsize=9,
-                    color='red', fontweight='bold')
-        ax.annotate(f'Max: {max_rate:,.0f}', xy=(dates[max_idx], max_rate),
-                    xytext=(5, 10), textcoords='offset points', fontsize=9,
-                    color='green', fontweight='bold')
-        
-        ax.grid(True, alpha=0.3)
-        plt.tight_layout()
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig)
-        
-        return buf.getvalue()
+        # Render in the chart process pool
+        return await chart_renderer.render(
+            f'{currency_code} Kurs Tarixi ({days} kun)', dates, rates, days
+        )
         
+    except ChartBusy:
+        raise
     except Exception as e:
         logger.error(f"Chart generation error: {e}")
         return None
@@ -147,20 +277,12 @@ async def generate_trend_analysis(currency_code: str, days: int = 7) -> dict:
         start_date = end_date - timedelta(days=days)
         
         # Try local history first
-        async with get_session() as session:
-            result = await session.execute(
-                select(RateHistory).where(
-                    RateHistory.currency_code == currency_code,
-                    RateHistory.bank_code == "cbu",
-                    RateHistory.recorded_at >= start_date
-                ).order_by(RateHistory.recorded_at)
-            )
-            history = result.scalars().all()
+        history = await get_history(currency_code, "cbu", start_date, end_date)
         
         rates = []
         
         if len(history) >= 2:
-            rates = [h.official_rate or h.buy_rate or 0 for h in history]
+            rates = [h["close"] for h in history]
         else:
             # Fallback: CBU archive
             cbu_history = await fetch_cbu_history(currency_code, days)
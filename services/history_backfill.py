@@ -0,0 +1,216 @@
+"""
+History Backfill - CBU archive days persisted into the daily history tier
+
+Past CBU rates never change, so every archive day is fetched until it is
+stored as a 1d bucket of bank "cbu". Requests go out with bounded
+concurrency over the shared CBU client. Charts call ensure_cbu_history()
+for the range they show; the admin /backfill command fills whole years.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, date, timedelta
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import select
+
+from database.db import get_session, bulk_upsert
+from database.models import RateHistoryAggregate
+from services.cbu_fetcher import get_client
+from services.history_store import DAILY, DAY_OFFSET
+from config import CBU_API_URL, POPULAR_CURRENCIES
+
+logger = logging.getLogger(__name__)
+
+# Archive requests in flight at once
+ARCHIVE_CONCURRENCY = 8
+
+# Days fetched and stored per step of a bulk backfill
+BACKFILL_CHUNK_DAYS = 30
+
+# (currency, day) pairs a successful archive response had no rate for are
+# not asked again for EMPTY_DAY_TTL seconds; at most EMPTY_DAYS_MAX are kept
+EMPTY_DAY_TTL = 24 * 3600
+EMPTY_DAYS_MAX = 50_000
+
+# (currency, day) -> monotonic expiry, oldest first
+_empty_days: dict[tuple, float] = {}
+
+
+def is_empty_day(currency: str, day: date) -> bool:
+    """Did the archive recently answer without a rate for this day"""
+    expires = _empty_days.get((currency, day))
+    if expires is None:
+        return False
+    if expires < time.monotonic():
+        del _empty_days[(currency, day)]
+        return False
+    return True
+
+
+def mark_empty_day(currency: str, day: date) -> None:
+    _empty_days.pop((currency, day), None)
+    _empty_days[(currency, day)] = time.monotonic() + EMPTY_DAY_TTL
+    while len(_empty_days) > EMPTY_DAYS_MAX:
+        del _empty_days[next(iter(_empty_days))]
+
+
+def day_bucket(day: date) -> datetime:
+    """1d bucket_start (naive UTC) of a Tashkent calendar day"""
+    return datetime(day.year, day.month, day.day) - DAY_OFFSET
+
+
+def past_days(days: int) -> list[date]:
+    """The last `days` completed Tashkent days, oldest first"""
+    today = (datetime.utcnow() + DAY_OFFSET).date()
+    return [today - timedelta(days=i) for i in range(days, 0, -1)]
+
+
+async def stored_days(currencies: list[str], start: date, end: date) -> set[tuple]:
+    """(currency, day) pairs already in the daily tier for cbu"""
+    A = RateHistoryAggregate
+    async with get_session() as session:
+        result = await session.execute(
+            select(A.currency_code, A.bucket_start).where(
+                A.bank_code == "cbu",
+                A.resolution == DAILY.name,
+                A.currency_code.in_(currencies),
+                A.bucket_start >= day_bucket(start),
+                A.bucket_start <= day_bucket(end)
+            )
+        )
+        return {(currency, (ts + DAY_OFFSET).date()) for currency, ts in result.all()}
+
+
+async def fetch_archive_day(day: date, currency: str = "all") -> Optional[list[dict]]:
+    """
+    Archive rates for one day: one currency, or every currency with "all"
+
+    Returns:
+        The archive rows, or None if the request failed
+    """
+    url = f"{CBU_API_URL}{currency}/{day.isoformat()}/"
+    try:
+        response = await get_client().get(url)
+        response.raise_for_status()
+        data = response.json() or []
+    except Exception as e:
+        logger.debug(f"CBU archive fetch error for {currency} {day}: {e}")
+        return None
+    return data
+
+
+def archive_rows(day: date, data: list[dict], currencies: set[str]) -> list[dict]:
+    """Daily bucket rows from an archive response"""
+    rows = []
+    for item in data:
+        currency = item.get("Ccy")
+        if currency not in currencies:
+            continue
+        try:
+            rate = float(item.get("Rate", 0))
+        except (TypeError, ValueError):
+            continue
+        if not rate:
+            continue
+        rows.append({
+            "bank_code": "cbu", "currency_code": currency,
+            "resolution": DAILY.name, "bucket_start": day_bucket(day),
+            "open": rate, "high": rate, "low": rate, "close": rate,
+            "buy_rate": None, "sell_rate": None, "official_rate": rate,
+            # No raw samples behind it: rollups do not treat it as rolled-up data
+            "samples": 0,
+        })
+    return rows
+
+
+async def fetch_and_store(requests: list[tuple[date, str]], currencies: set[str]) -> int:
+    """Fetch (day, currency-or-"all") archive requests concurrently and store them"""
+    semaphore = asyncio.Semaphore(ARCHIVE_CONCURRENCY)
+
+    async def fetch(day: date, currency: str) -> Optional[list[dict]]:
+        async with semaphore:
+            data = await fetch_archive_day(day, currency)
+        return None if data is None else archive_rows(day, data, currencies)
+
+    results = await asyncio.gather(*(fetch(day, currency) for day, currency in requests))
+
+    rows = []
+    for (day, requested), day_rows in zip(requests, results):
+        # Failed requests are retried next time; only real answers count as empty
+        if day_rows is None:
+            continue
+        rows.extend(day_rows)
+        found = {row["currency_code"] for row in day_rows}
+        for currency in (currencies if requested == "all" else {requested}):
+            if currency not in found:
+                mark_empty_day(currency, day)
+
+    if not rows:
+        return 0
+
+    # Archive values are final, but a day the bot recorded itself keeps its own OHLC
+    async with get_session() as session:
+        await bulk_upsert(
+            session, RateHistoryAggregate, rows,
+            ["currency_code", "bank_code", "resolution", "bucket_start"]
+        )
+        await session.commit()
+    return len(rows)
+
+
+async def ensure_cbu_history(currency_code: str, days: int) -> int:
+    """
+    Make sure the daily tier has CBU rates for the last `days` days
+
+    Returns:
+        Number of days fetched from the archive
+    """
+    wanted = past_days(days)
+    have = await stored_days([currency_code], wanted[0], wanted[-1])
+    missing = [
+        day for day in wanted
+        if (currency_code, day) not in have and not is_empty_day(currency_code, day)
+    ]
+    if not missing:
+        return 0
+
+    stored = await fetch_and_store([(day, currency_code) for day in missing], {currency_code})
+    logger.info(f"CBU archive: {stored}/{len(missing)} days stored for {currency_code}")
+    return stored
+
+
+async def backfill_years(
+    years: int,
+    currencies: list[str] = None,
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+) -> int:
+    """
+    Fill the daily tier with `years` of CBU archive data
+
+    One "all currencies" request per missing day, stored chunk by chunk so
+    an interrupted run keeps what it already fetched.
+
+    Args:
+        progress: async callback(days_done, days_total)
+
+    Returns:
+        Number of (currency, day) rows stored
+    """
+    currencies = currencies or POPULAR_CURRENCIES
+    wanted = past_days(years * 365)
+    stored = 0
+
+    for i in range(0, len(wanted), BACKFILL_CHUNK_DAYS):
+        chunk = wanted[i:i + BACKFILL_CHUNK_DAYS]
+        have = await stored_days(currencies, chunk[0], chunk[-1])
+        missing = [
+            day for day in chunk
+            if any((c, day) not in have and not is_empty_day(c, day) for c in currencies)
+        ]
+        if missing:
+            stored += await fetch_and_store([(day, "all") for day in missing], set(currencies))
+        if progress:
+            await progress(i + len(chunk), len(wanted))
+
+    logger.info(f"CBU archive backfill: {stored} rows stored for {years} years")
+    return stored
@@ -0,0 +1,576 @@
+"""
+History Store - Tiered rate history
+
+Raw samples live in rate_history for a short window. They are rolled up
+into hourly OHLC buckets, and hourly buckets into daily ones, stored in
+rate_history_agg. Every tier has its own retention, so daily data is kept
+for years while raw samples stay bounded. Range reads use the coarsest
+tier that still satisfies the requested resolution.
+
+A raw sample is only written when a rate changes, so a stable rate has no
+rows for hours or days. Rollups open a bucket at the previous close and
+range reads carry the last value forward over such gaps.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, insert, delete, func, and_
+
+from database.db import get_session, bulk_upsert
+from database.models import RateHistory, RateHistoryAggregate
+from config import HISTORY_RAW_DAYS, HISTORY_HOURLY_DAYS, HISTORY_DAILY_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Daily buckets follow the Tashkent day (UTC+5, no DST); timestamps are naive UTC
+DAY_OFFSET = timedelta(hours=5)
+
+# Points a range read aims for when no resolution is given
+DEFAULT_MAX_POINTS = 200
+
+# Source rows read per rollup pass
+ROLLUP_WINDOW = timedelta(days=7)
+
+# Rows per upsert statement
+UPSERT_BATCH_SIZE = 1000
+
+AGG_COLUMNS = ["open", "high", "low", "close", "buy_rate", "sell_rate", "official_rate", "samples"]
+
+
+@dataclass(frozen=True)
+class Tier:
+    """One storage tier: bucket size (zero for raw samples) and retention"""
+    name: str
+    step: timedelta
+    retention: timedelta
+
+
+RAW = Tier("raw", timedelta(0), timedelta(days=HISTORY_RAW_DAYS))
+HOURLY = Tier("1h", timedelta(hours=1), timedelta(days=HISTORY_HOURLY_DAYS))
+DAILY = Tier("1d", timedelta(days=1), timedelta(days=HISTORY_DAILY_DAYS))
+
+# Fine to coarse; each aggregate tier is rolled up from the one before it
+TIERS = (RAW, HOURLY, DAILY)
+
+
+# (bank, currency) -> ((buy, sell, official), recorded_at) of the last raw sample
+_last_recorded: dict[tuple, tuple] = {}
+_last_loaded = False
+
+
+def price_of(buy_rate: Optional[float], official_rate: Optional[float]) -> float:
+    """Price a history sample is charted at"""
+    return official_rate or buy_rate or 0
+
+
+def bucket_start(ts: datetime, tier: Tier) -> datetime:
+    """Start of the tier bucket containing ts"""
+    if tier is DAILY:
+        local = ts + DAY_OFFSET
+        return local.replace(hour=0, minute=0, second=0, microsecond=0) - DAY_OFFSET
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def select_tier(start: datetime, resolution: timedelta, now: datetime) -> Tier:
+    """Coarsest tier not coarser than `resolution` that still covers `start`"""
+    chosen = RAW
+    for tier in TIERS:
+        if tier.step <= resolution:
+            chosen = tier
+
+    # Older than the chosen tier keeps: fall back to coarser ones
+    age = now - start
+    for tier in TIERS[TIERS.index(chosen):]:
+        chosen = tier
+        if tier.retention >= age:
+            break
+    return chosen
+
+
+async def _load_last_recorded() -> None:
+    """Warm the last-sample cache with the newest raw sample of every rate"""
+    global _last_loaded
+    latest = select(
+        RateHistory.bank_code, RateHistory.currency_code,
+        func.max(RateHistory.recorded_at).label("recorded_at")
+    ).group_by(RateHistory.bank_code, RateHistory.currency_code).subquery()
+    async with get_session() as session:
+        result = await session.execute(
+            select(
+                RateHistory.bank_code, RateHistory.currency_code, RateHistory.recorded_at,
+                RateHistory.buy_rate, RateHistory.sell_rate, RateHistory.official_rate
+            ).join(latest, and_(
+                RateHistory.bank_code == latest.c.bank_code,
+                RateHistory.currency_code == latest.c.currency_code,
+                RateHistory.recorded_at == latest.c.recorded_at
+            )).order_by(RateHistory.id)
+        )
+        for bank, currency, ts, buy, sell, official in result.all():
+            _last_recorded[(bank, currency)] = ((buy, sell, official), ts)
+    _last_loaded = True
+
+
+async def record_snapshot(snapshot) -> list[dict]:
+    """
+    Append raw samples for every (bank, currency) in a rate snapshot
+
+    A rate is only written when it changed since its last sample, all in
+    one bulk insert.
+
+    Returns:
+        The sample rows written
+    """
+    if not _last_loaded:
+        await _load_last_recorded()
+
+    now = datetime.utcnow()
+    rows = []
+    for key, rate in snapshot.by_key.items():
+        values = (rate["buy_rate"], rate["sell_rate"], rate["official_rate"])
+        last = _last_recorded.get(key)
+        if last is not None and last[0] == values:
+            continue
+        rows.append({
+            "bank_code": key[0], "currency_code": key[1],
+            "buy_rate": values[0], "sell_rate": values[1], "official_rate": values[2],
+            "recorded_at": now,
+        })
+
+    if not rows:
+        return []
+
+    async with get_session() as session:
+        await session.execute(insert(RateHistory), rows)
+        await session.commit()
+
+    for row in rows:
+        _last_recorded[(row["bank_code"], row["currency_code"])] = (
+            (row["buy_rate"], row["sell_rate"], row["official_rate"]), now
+        )
+    return rows
+
+
+async def _source_rows(session, tier: Tier, start: datetime, end: datetime) -> list[tuple]:
+    """(bank, currency, time, open, high, low, close, buy, sell, official, samples) feeding a tier"""
+    if tier is HOURLY:
+        result = await session.execute(
+            select(
+                RateHistory.bank_code, RateHistory.currency_code, RateHistory.recorded_at,
+                RateHistory.buy_rate, RateHistory.sell_rate, RateHistory.official_rate
+            ).where(
+                RateHistory.recorded_at >= start,
+                RateHistory.recorded_at < end
+            ).order_by(RateHistory.recorded_at, RateHistory.id)
+        )
+        rows = []
+        for bank, currency, ts, buy, sell, official in result.all():
+            price = price_of(buy, official)
+            rows.append((bank, currency, ts, price, price, price, price, buy, sell, official, 1))
+        return rows
+
+    A = RateHistoryAggregate
+    result = await session.execute(
+        select(
+            A.bank_code, A.currency_code, A.bucket_start, A.open, A.high, A.low, A.close,
+            A.buy_rate, A.sell_rate, A.official_rate, A.samples
+        ).where(
+            A.resolution == HOURLY.name,
+            A.bucket_start >= start,
+            A.bucket_start < end
+        ).order_by(A.bucket_start)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+def _aggregate(rows: list[tuple], tier: Tier, previous: Optional[dict] = None) -> list[dict]:
+    """
+    Fold time-ordered source rows into OHLC buckets
+
+    Args:
+        previous: (bank, currency) -> close before the rows; a bucket opens
+            at it, since the rate held that value until the first change.
+            Updated in place with the last close of every rate.
+    """
+    if previous is None:
+        previous = {}
+    buckets = {}
+    for bank, currency, ts, open_, high, low, close, buy, sell, official, samples in rows:
+        key = (bank, currency, bucket_start(ts, tier))
+        bucket = buckets.get(key)
+        last = previous.get(key[:2])
+        previous[key[:2]] = close
+        if bucket is None:
+            if last is not None:
+                open_, high, low = last, max(high, last), min(low, last)
+            buckets[key] = {
+                "bank_code": bank, "currency_code": currency,
+                "resolution": tier.name, "bucket_start": key[2],
+                "open": open_, "high": high, "low": low, "close": close,
+                "buy_rate": buy, "sell_rate": sell, "official_rate": official,
+                "samples": samples,
+            }
+            continue
+        bucket["high"] = max(bucket["high"], high)
+        bucket["low"] = min(bucket["low"], low)
+        bucket["close"] = close
+        bucket["buy_rate"] = buy
+        bucket["sell_rate"] = sell
+        bucket["official_rate"] = official
+        bucket["samples"] += samples
+    return list(buckets.values())
+
+
+async def _rolled_until(session, tier: Tier) -> Optional[datetime]:
+    """
+    Newest bucket of a tier built by rollup (None before the first one)
+
+    Archive buckets (samples == 0) are written directly and can be newer
+    than source data not rolled up yet, so they do not count.
+    """
+    A = RateHistoryAggregate
+    result = await session.execute(
+        select(func.max(A.bucket_start)).where(A.resolution == tier.name, A.samples > 0)
+    )
+    return result.scalar()
+
+
+async def _closes_before(session, tier: Tier, before: datetime) -> dict:
+    """(bank, currency) -> close of the newest stored tier bucket before `before`"""
+    A = RateHistoryAggregate
+    latest = select(
+        A.bank_code, A.currency_code, func.max(A.bucket_start).label("bucket_start")
+    ).where(
+        A.resolution == tier.name, A.bucket_start < before
+    ).group_by(A.bank_code, A.currency_code).subquery()
+    result = await session.execute(
+        select(A.bank_code, A.currency_code, A.close).join(latest, and_(
+            A.bank_code == latest.c.bank_code,
+            A.currency_code == latest.c.currency_code,
+            A.bucket_start == latest.c.bucket_start
+        )).where(A.resolution == tier.name)
+    )
+    return {(bank, currency): close for bank, currency, close in result.all()}
+
+
+async def rollup(tier: Tier) -> int:
+    """
+    Recompute tier buckets from the last stored one onwards
+
+    The newest bucket is usually partial, so it is rebuilt on every run.
+
+    Returns:
+        Number of buckets written
+    """
+    A = RateHistoryAggregate
+    now = datetime.utcnow()
+    written = 0
+
+    async with get_session() as session:
+        start = await _rolled_until(session, tier)
+
+        if start is None:
+            # First run: start at the oldest source row
+            if tier is HOURLY:
+                result = await session.execute(select(func.min(RateHistory.recorded_at)))
+            else:
+                result = await session.execute(
+                    select(func.min(A.bucket_start)).where(A.resolution == HOURLY.name)
+                )
+            start = result.scalar()
+            if start is None:
+                return 0
+            start = bucket_start(start, tier)
+
+        previous = await _closes_before(session, tier, start)
+        while start <= now:
+            end = start + ROLLUP_WINDOW
+            buckets = _aggregate(await _source_rows(session, tier, start, end), tier, previous)
+            for i in range(0, len(buckets), UPSERT_BATCH_SIZE):
+                await bulk_upsert(
+                    session, A, buckets[i:i + UPSERT_BATCH_SIZE],
+                    ["currency_code", "bank_code", "resolution", "bucket_start"], AGG_COLUMNS
+                )
+            await session.commit()
+            written += len(buckets)
+            start = end
+
+    logger.debug(f"History rollup {tier.name}: {written} buckets")
+    return written
+
+
+async def rollup_all() -> None:
+    """Roll raw samples into hourly buckets and hourly into daily"""
+    await rollup(HOURLY)
+    await rollup(DAILY)
+
+
+async def apply_retention() -> dict:
+    """
+    Delete data past each tier's retention
+
+    Raw and hourly rows are only dropped once the next tier has absorbed
+    them, so a stalled rollup never loses data.
+
+    Returns:
+        Deleted row count per tier
+    """
+    A = RateHistoryAggregate
+    now = datetime.utcnow()
+    deleted = {}
+
+    async with get_session() as session:
+        for tier, next_tier in zip(TIERS, TIERS[1:] + (None,)):
+            cutoff = now - tier.retention
+            if next_tier is not None:
+                rolled_until = await _rolled_until(session, next_tier)
+                if rolled_until is None:
+                    continue
+                cutoff = min(cutoff, rolled_until)
+
+            if tier is RAW:
+                stmt = delete(RateHistory).where(RateHistory.recorded_at < cutoff)
+            else:
+                stmt = delete(A).where(A.resolution == tier.name, A.bucket_start < cutoff)
+            result = await session.execute(stmt)
+            deleted[tier.name] = result.rowcount
+        await session.commit()
+
+    return deleted
+
+
+async def get_history(
+    currency_code: str,
+    bank_code: str = "cbu",
+    start: datetime = None,
+    end: datetime = None,
+    resolution: timedelta = None,
+    max_points: int = DEFAULT_MAX_POINTS
+) -> list[dict]:
+    """
+    Rate history for a range, oldest first
+
+    Args:
+        start/end: Naive UTC range (end defaults to now)
+        resolution: Wanted spacing of points; defaults to range / max_points
+
+    Returns:
+        Points with time, open, high, low, close, buy_rate, sell_rate,
+        official_rate. Raw samples have open == high == low == close.
+        Buckets without a change repeat the previous close; raw reads start
+        and end with the value held at `start` and now.
+    """
+    history = await get_history_many([currency_code], bank_code, start, end, resolution, max_points)
+    return history[currency_code]
+
+
+async def get_history_many(
+    currency_codes: list[str],
+    bank_code: str = "cbu",
+    start: datetime = None,
+    end: datetime = None,
+    resolution: timedelta = None,
+    max_points: int = DEFAULT_MAX_POINTS
+) -> dict[str, list[dict]]:
+    """
+    Rate history of several currencies of one bank over the same range
+
+    Same as get_history, but every currency is read with one query per
+    tier involved (the chosen tier and the finer ones its tail comes from),
+    plus the lookup of the values held when the range starts.
+
+    Returns:
+        currency_code -> points, oldest first
+    """
+    if not currency_codes:
+        return {}
+    now = datetime.utcnow()
+    end = end or now
+    start = start or end - timedelta(days=7)
+    if resolution is None:
+        resolution = (end - start) / max_points
+    tier = select_tier(start, resolution, now)
+
+    first = start if tier is RAW else bucket_start(start, tier)
+    async with get_session() as session:
+        rows = await _tier_rows(session, tier, bank_code, {c: start for c in currency_codes}, end)
+        held = await _values_before(session, bank_code, currency_codes, first)
+
+    until = min(end, now)
+    history = {}
+    for currency, series in rows.items():
+        if tier is RAW:
+            history[currency] = _carry_raw(series, held.get(currency), start, until)
+        else:
+            history[currency] = _carry_buckets(series, held.get(currency), tier, first, until)
+    return history
+
+
+def _point(ts: datetime, open_: float, high: float, low: float, close: float,
+           buy: Optional[float], sell: Optional[float], official: Optional[float]) -> dict:
+    return {
+        "time": ts, "open": open_, "high": high, "low": low, "close": close,
+        "buy_rate": buy, "sell_rate": sell, "official_rate": official,
+    }
+
+
+def _carry_raw(series: list[tuple], held: Optional[tuple], start: datetime,
+               until: datetime) -> list[dict]:
+    """Raw points plus the value held at `start` and, after the last change, at `until`"""
+    points = [
+        _point(ts, open_, high, low, close, buy, sell, official)
+        for _, _, ts, open_, high, low, close, buy, sell, official, _ in series
+    ]
+    if held is not None and (not points or points[0]["time"] > start):
+        close, buy, sell, official = held
+        points.insert(0, _point(start, close, close, close, close, buy, sell, official))
+    if points and points[-1]["time"] < until:
+        last = points[-1]
+        points.append(_point(
+            until, last["close"], last["close"], last["close"], last["close"],
+            last["buy_rate"], last["sell_rate"], last["official_rate"]
+        ))
+    return points
+
+
+def _carry_buckets(series: list[tuple], held: Optional[tuple], tier: Tier,
+                   first: datetime, until: datetime) -> list[dict]:
+    """Every tier bucket from `first` up to `until`, flat where the rate did not change"""
+    by_start = {row[2]: row for row in series}
+    points = []
+    slot = first
+    while slot < until:
+        row = by_start.get(slot)
+        if row is not None:
+            _, _, ts, open_, high, low, close, buy, sell, official, _ = row
+            if held is not None:
+                open_, high, low = held[0], max(high, held[0]), min(low, held[0])
+            points.append(_point(ts, open_, high, low, close, buy, sell, official))
+            held = (close, buy, sell, official)
+        elif held is not None:
+            close, buy, sell, official = held
+            points.append(_point(slot, close, close, close, close, buy, sell, official))
+        slot += tier.step
+    return points
+
+
+async def _values_before(session, bank_code: str, currency_codes: list[str],
+                         before: datetime) -> dict[str, tuple]:
+    """
+    currency -> (price, buy, sell, official) a rate held at `before`
+
+    From the newest raw sample before it, or the newest aggregate bucket
+    ending by then once raw samples are past retention.
+    """
+    held = {}
+    latest = select(
+        RateHistory.currency_code, func.max(RateHistory.recorded_at).label("recorded_at")
+    ).where(
+        RateHistory.bank_code == bank_code,
+        RateHistory.currency_code.in_(currency_codes),
+        RateHistory.recorded_at < before
+    ).group_by(RateHistory.currency_code).subquery()
+    result = await session.execute(
+        select(
+            RateHistory.currency_code, RateHistory.buy_rate,
+            RateHistory.sell_rate, RateHistory.official_rate
+        ).join(latest, and_(
+            RateHistory.currency_code == latest.c.currency_code,
+            RateHistory.recorded_at == latest.c.recorded_at
+        )).where(RateHistory.bank_code == bank_code).order_by(RateHistory.id)
+    )
+    for currency, buy, sell, official in result.all():
+        held[currency] = (price_of(buy, official), buy, sell, official)
+
+    A = RateHistoryAggregate
+    for tier in TIERS[1:]:
+        missing = [c for c in currency_codes if c not in held]
+        if not missing:
+            break
+        latest = select(
+            A.currency_code, func.max(A.bucket_start).label("bucket_start")
+        ).where(
+            A.bank_code == bank_code,
+            A.currency_code.in_(missing),
+            A.resolution == tier.name,
+            A.bucket_start <= before - tier.step
+        ).group_by(A.currency_code).subquery()
+        result = await session.execute(
+            select(A.currency_code, A.close, A.buy_rate, A.sell_rate, A.official_rate).join(latest, and_(
+                A.currency_code == latest.c.currency_code,
+                A.bucket_start == latest.c.bucket_start
+            )).where(A.bank_code == bank_code, A.resolution == tier.name)
+        )
+        for currency, close, buy, sell, official in result.all():
+            held[currency] = (close, buy, sell, official)
+    return held
+
+
+async def _tier_rows(session, tier: Tier, bank_code: str, since: dict[str, datetime],
+                     end: datetime) -> dict[str, list[tuple]]:
+    """
+    Source-format rows of one bank's currencies in `tier`, from since[currency] to end
+
+    Stored buckets only reach the last rollup, so the newest rolled-up
+    bucket (usually partial) and everything after it are rebuilt from the
+    next finer tier. Archive buckets the finer tier has no data for are kept.
+    """
+    codes = list(since)
+    rows = {currency: [] for currency in codes}
+
+    if tier is RAW:
+        result = await session.execute(
+            select(
+                RateHistory.currency_code, RateHistory.recorded_at, RateHistory.buy_rate,
+                RateHistory.sell_rate, RateHistory.official_rate
+            ).where(
+                RateHistory.currency_code.in_(codes),
+                RateHistory.bank_code == bank_code,
+                RateHistory.recorded_at >= min(since.values()),
+                RateHistory.recorded_at < end
+            ).order_by(RateHistory.recorded_at, RateHistory.id)
+        )
+        for currency, ts, buy, sell, official in result.all():
+            if ts < since[currency]:
+                continue
+            price = price_of(buy, official)
+            rows[currency].append((bank_code, currency, ts, price, price, price, price, buy, sell, official, 1))
+        return rows
+
+    A = RateHistoryAggregate
+    starts = {currency: bucket_start(ts, tier) for currency, ts in since.items()}
+    result = await session.execute(
+        select(
+            A.bank_code, A.currency_code, A.bucket_start, A.open, A.high, A.low, A.close,
+            A.buy_rate, A.sell_rate, A.official_rate, A.samples
+        ).where(
+            A.currency_code.in_(codes),
+            A.bank_code == bank_code,
+            A.resolution == tier.name,
+            A.bucket_start >= min(starts.values()),
+            A.bucket_start < end
+        ).order_by(A.bucket_start)
+    )
+    for row in result.all():
+        if row.bucket_start >= starts[row.currency_code]:
+            rows[row.currency_code].append(tuple(row))
+
+    tail_from = {}
+    for currency, series in rows.items():
+        rolled = [row[2] for row in series if row[10] > 0]
+        tail_from[currency] = rolled[-1] if rolled else starts[currency]
+    finer = TIERS[TIERS.index(tier) - 1]
+    tail = await _tier_rows(session, finer, bank_code, tail_from, end)
+
+    for currency in codes:
+        rebuilt = _aggregate(tail[currency], tier)
+        if not rebuilt:
+            continue
+        merged = {row[2]: row for row in rows[currency]}
+        for b in rebuilt:
+            merged[b["bucket_start"]] = (
+                b["bank_code"], b["currency_code"], b["bucket_start"], b["open"], b["high"], b["low"],
+                b["close"], b["buy_rate"], b["sell_rate"], b["official_rate"], b["samples"]
+            )
+        rows[currency] = [merged[ts] for ts in sorted(merged)]
+    return rows
@@ -0,0 +1,321 @@
+"""
+Indicator State - Streaming indicators per (bank, currency)
+
+The state runs on hourly OHLC buckets, the resolution the history tier
+used by a default (30-day) analysis has. Raw samples update the open
+hour's high/low/close; when a sample falls into a later hour the open
+bucket is closed and EMA, MACD, Wilder RSI and ATR advance in O(1) from
+the previous state. History only stores changes, so the hours in between
+advance as flat buckets at the last close, as range reads return them. The state (plus a short window of recent closes for
+SMA and Bollinger bands) is kept in memory and persisted to
+indicator_state after every save, so analysis reads precomputed values
+instead of loading and replaying history.
+
+Warm-up matches services/indicators.py: while fewer than `period` values
+were seen, an average is the running mean, which makes the first full
+value the SMA seed the series functions start from.
+"""
+import asyncio
+import copy
+import json
+import logging
+import math
+import statistics
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+
+from database.db import get_session, bulk_upsert
+from database.models import IndicatorState, RateHistory, RateHistoryAggregate
+from services.history_store import HOURLY, bucket_start, price_of
+
+logger = logging.getLogger(__name__)
+
+# History tier the state is equivalent to
+STATE_TIER = HOURLY
+
+EMA_FAST = 12
+EMA_SLOW = 26
+SIGNAL = 9
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+BOLLINGER_PERIOD = 20
+BOLLINGER_WIDTH = 2.0
+
+# Recent prices kept for the SMAs (7, 14, 30) and Bollinger bands
+WINDOW = 30
+
+STATE_COLUMNS = [
+    "samples", "last_price", "prev_price", "ema_12", "ema_26", "macd_signal",
+    "prev_macd", "prev_signal", "avg_gain", "avg_loss", "avg_tr", "window",
+    "bucket_start", "bucket_high", "bucket_low", "bucket_close", "updated_at",
+]
+
+# (bank, currency) -> state dict with the indicator_state columns
+_states: dict[tuple, dict] = {}
+_loaded = False
+_lock = asyncio.Lock()
+
+
+def new_state() -> dict:
+    state = {name: None for name in STATE_COLUMNS}
+    state["samples"] = 0
+    state["window"] = []
+    return state
+
+
+def _step(value: Optional[float], x: float, count: int, period: int, alpha: float) -> float:
+    """One smoothing step: running mean during warm-up, then alpha"""
+    if value is None:
+        return x
+    weight = 1.0 / count if count <= period else alpha
+    return value + weight * (x - value)
+
+
+def advance(state: dict, close: float, high: float, low: float) -> None:
+    """Add one closed hourly bucket to a state"""
+    n = state["samples"] + 1
+    prev = state["last_price"]
+
+    if n - 1 >= EMA_SLOW:
+        # MACD and signal before this bucket, for crossovers
+        state["prev_macd"] = state["ema_12"] - state["ema_26"]
+        state["prev_signal"] = state["macd_signal"]
+
+    state["ema_12"] = _step(state["ema_12"], close, n, EMA_FAST, 2.0 / (EMA_FAST + 1))
+    state["ema_26"] = _step(state["ema_26"], close, n, EMA_SLOW, 2.0 / (EMA_SLOW + 1))
+    if n >= EMA_SLOW:
+        line = state["ema_12"] - state["ema_26"]
+        state["macd_signal"] = _step(state["macd_signal"], line, n - EMA_SLOW + 1, SIGNAL, 2.0 / (SIGNAL + 1))
+
+    if prev is not None:
+        change = close - prev
+        changes = n - 1
+        state["avg_gain"] = _step(state["avg_gain"], max(change, 0.0), changes, RSI_PERIOD, 1.0 / RSI_PERIOD)
+        state["avg_loss"] = _step(state["avg_loss"], max(-change, 0.0), changes, RSI_PERIOD, 1.0 / RSI_PERIOD)
+
+    tr = high - low
+    if prev is not None:
+        tr = max(tr, abs(high - prev), abs(low - prev))
+    state["avg_tr"] = _step(state["avg_tr"], tr, n, ATR_PERIOD, 1.0 / ATR_PERIOD)
+
+    window = state["window"]
+    window.append(close)
+    del window[:-WINDOW]
+
+    state["samples"] = n
+    state["prev_price"] = prev
+    state["last_price"] = close
+
+
+def open_bucket(state: dict, start: datetime, close: float, high: float, low: float) -> None:
+    """Start a bucket; it opens at the previous close, which the rate held until then"""
+    prev = state["last_price"]
+    if prev is not None:
+        high, low = max(high, prev), min(low, prev)
+    state["bucket_start"] = start
+    state["bucket_close"] = close
+    state["bucket_high"] = high
+    state["bucket_low"] = low
+
+
+def roll_to(state: dict, start: datetime) -> None:
+    """Close the open bucket and the unchanged hours after it, up to `start`"""
+    if state["bucket_start"] is None or start <= state["bucket_start"]:
+        return
+    close = state["bucket_close"]
+    advance(state, close, state["bucket_high"], state["bucket_low"])
+    hour = state["bucket_start"] + STATE_TIER.step
+    while hour < start:
+        advance(state, close, close, close)
+        hour += STATE_TIER.step
+    state["bucket_start"] = None
+
+
+def add_sample(state: dict, price: float, at: datetime) -> None:
+    """Add one raw price sample: update the open hour, closing the previous ones first"""
+    start = bucket_start(at, STATE_TIER)
+    roll_to(state, start)
+
+    if state["bucket_start"] is None:
+        open_bucket(state, start, price, price, price)
+    else:
+        state["bucket_close"] = price
+        state["bucket_high"] = max(state["bucket_high"], price)
+        state["bucket_low"] = min(state["bucket_low"], price)
+    state["updated_at"] = at
+
+
+def indicator_values(state: dict, now: datetime) -> dict:
+    """
+    Latest indicator values of a state, None where still warming up
+
+    Hours up to and including the current one count as closed buckets, the
+    current one with its close so far, as in the hourly history tier.
+    """
+    if state["bucket_start"] is not None:
+        state = copy.deepcopy(state)
+        roll_to(state, bucket_start(now, STATE_TIER) + STATE_TIER.step)
+    n = state["samples"]
+    window = state["window"]
+
+    def sma(period: int) -> Optional[float]:
+        return sum(window[-period:]) / period if len(window) >= period else None
+
+    rsi = None
+    if n - 1 >= RSI_PERIOD:
+        gain, loss = state["avg_gain"], state["avg_loss"]
+        if loss == 0:
+            rsi = 50.0 if gain == 0 else 100.0
+        else:
+            rsi = 100.0 - 100.0 / (1.0 + gain / loss)
+
+    macd = signal = None
+    if n >= EMA_SLOW + SIGNAL - 1:
+        macd = state["ema_12"] - state["ema_26"]
+        signal = state["macd_signal"]
+
+    bollinger = None
+    if len(window) >= BOLLINGER_PERIOD:
+        middle = sma(BOLLINGER_PERIOD)
+        std = statistics.pstdev(window[-BOLLINGER_PERIOD:])
+        bollinger = (middle, middle + BOLLINGER_WIDTH * std, middle - BOLLINGER_WIDTH * std)
+
+    prev_macd = prev_signal = None
+    if n >= EMA_SLOW + SIGNAL:
+        prev_macd, prev_signal = state["prev_macd"], state["prev_signal"]
+
+    return {
+        "samples": n,
+        "price": state["last_price"],
+        "prev_price": state["prev_price"],
+        "prices": list(window),
+        "sma_7": sma(7),
+        "sma_14": sma(14),
+        "sma_30": sma(30),
+        "rsi": rsi,
+        "macd": macd,
+        "signal": signal,
+        "prev_macd": prev_macd,
+        "prev_signal": prev_signal,
+        "bollinger": bollinger,
+        "atr": state["avg_tr"] if n >= ATR_PERIOD else None,
+        "updated_at": state["updated_at"],
+    }
+
+
+def _from_row(row: IndicatorState) -> dict:
+    state = {name: getattr(row, name) for name in STATE_COLUMNS}
+    state["window"] = json.loads(row.window) if row.window else []
+    return state
+
+
+def _to_row(key: tuple, state: dict) -> dict:
+    row = {"bank_code": key[0], "currency_code": key[1]}
+    row.update(state)
+    row["window"] = json.dumps(state["window"])
+    return row
+
+
+async def _load_states() -> None:
+    """Load persisted states; on the very first run build them from history"""
+    global _loaded
+    async with get_session() as session:
+        result = await session.execute(select(IndicatorState))
+        for row in result.scalars().all():
+            _states[(row.bank_code, row.currency_code)] = _from_row(row)
+
+        if not _states:
+            await _replay_history(session)
+            if _states:
+                await _persist(session, list(_states))
+                logger.info(f"Indicator state built from history for {len(_states)} rates")
+    _loaded = True
+
+
+async def _replay_history(session) -> None:
+    """
+    Build states from the hourly tier and the raw samples after it
+
+    The newest hourly bucket of a rate may be partial, so it becomes the
+    open bucket and raw samples from its start on are added to it again
+    (high, low and the latest close are unaffected by repeats).
+    """
+    A = RateHistoryAggregate
+    result = await session.execute(
+        select(A.bank_code, A.currency_code, A.bucket_start, A.high, A.low, A.close)
+        .where(A.resolution == STATE_TIER.name)
+        .order_by(A.bucket_start)
+    )
+    for bank, currency, start, high, low, close in result.all():
+        state = _states.setdefault((bank, currency), new_state())
+        roll_to(state, start)
+        open_bucket(state, start, close, high, low)
+        state["updated_at"] = start
+
+    raw_from = min((state["bucket_start"] for state in _states.values()), default=None)
+    query = select(
+        RateHistory.bank_code, RateHistory.currency_code, RateHistory.recorded_at,
+        RateHistory.buy_rate, RateHistory.official_rate
+    ).order_by(RateHistory.recorded_at, RateHistory.id)
+    if raw_from is not None:
+        query = query.where(RateHistory.recorded_at >= raw_from)
+    result = await session.execute(query)
+    for bank, currency, ts, buy, official in result.all():
+        state = _states.setdefault((bank, currency), new_state())
+        if state["bucket_start"] is not None and ts < state["bucket_start"]:
+            continue
+        price = price_of(buy, official)
+        if price and not math.isnan(price):
+            add_sample(state, price, ts)
+
+
+async def _persist(session, keys: list[tuple]) -> None:
+    rows = [_to_row(key, _states[key]) for key in keys]
+    await bulk_upsert(session, IndicatorState, rows, ["bank_code", "currency_code"], STATE_COLUMNS)
+    await session.commit()
+
+
+async def advance_indicators(samples: list[dict]) -> int:
+    """
+    Add freshly saved history rows to the state of every (bank, currency)
+
+    Samples not newer than a state's last one are skipped, so replaying
+    rows that were already applied is harmless.
+
+    Returns:
+        Number of states updated
+    """
+    async with _lock:
+        if not _loaded:
+            await _load_states()
+
+        changed = []
+        for sample in samples:
+            key = (sample["bank_code"], sample["currency_code"])
+            state = _states.setdefault(key, new_state())
+            at = sample["recorded_at"]
+            if state["updated_at"] is not None and at <= state["updated_at"]:
+                continue
+            price = price_of(sample["buy_rate"], sample["official_rate"])
+            if not price or math.isnan(price):
+                continue
+            add_sample(state, price, at)
+            changed.append(key)
+
+        if changed:
+            async with get_session() as session:
+                await _persist(session, changed)
+        return len(changed)
+
+
+async def get_indicators(bank_code: str, currency_code: str) -> Optional[dict]:
+    """Precomputed indicator values for a rate, None if it has no samples yet"""
+    if not _loaded:
+        async with _lock:
+            if not _loaded:
+                await _load_states()
+    state = _states.get((bank_code, currency_code))
+    if state is None or not state["samples"]:
+        return None
+    return indicator_values(state, datetime.utcnow())
@@ -0,0 +1,158 @@
+"""
+Indicators - Technical indicator series computed with NumPy
+
+Every function takes a whole price series and returns the indicator for
+every point in one pass, with NaN where there is not enough data yet.
+Exponential smoothing is evaluated block by block in closed form, so
+Python only loops once per few hundred points instead of once per point.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+# Largest growth of the closed-form EMA weights within one block (keeps
+# them far from float overflow while blocks stay long)
+_MAX_WEIGHT_EXP = 100 * math.log(10)
+
+# Upper bound on points per EMA block
+_MAX_BLOCK = 4096
+
+
+def as_series(values) -> np.ndarray:
+    """Prices as a float64 array"""
+    return np.asarray(values, dtype=np.float64)
+
+
+def last(series: np.ndarray) -> Optional[float]:
+    """Last value of a series, None while the indicator is undefined"""
+    if len(series) == 0 or np.isnan(series[-1]):
+        return None
+    return float(series[-1])
+
+
+def _smooth(values: np.ndarray, alpha: float, initial: float) -> np.ndarray:
+    """
+    y[i] = y[i-1] + alpha * (values[i] - y[i-1]), starting from y[-1] = initial
+
+    Inside a block y[j] = d^(j+1) * y0 + alpha * d^j * cumsum(values[k] / d^k)
+    with d = 1 - alpha; block length bounds d^-k.
+    """
+    out = np.empty(len(values))
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[:] = values
+        return out
+
+    block = min(_MAX_BLOCK, max(1, int(_MAX_WEIGHT_EXP / -math.log(decay))))
+    powers = decay ** np.arange(block + 1)
+    inverse = 1.0 / powers[:block]
+
+    prev = initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        n = len(chunk)
+        acc = np.cumsum(chunk * inverse[:n])
+        out[start:start + n] = powers[1:n + 1] * prev + alpha * powers[:n] * acc
+        prev = out[start + n - 1]
+    return out
+
+
+def _seeded_smooth(values: np.ndarray, period: int, alpha: float) -> np.ndarray:
+    """Smoothing seeded with the mean of the first `period` values (NaN before that)"""
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+    seed = values[:period].mean()
+    out[period - 1] = seed
+    out[period:] = _smooth(values[period:], alpha, seed)
+    return out
+
+
+def sma(prices, period: int) -> np.ndarray:
+    """Simple moving average"""
+    x = as_series(prices)
+    out = np.full(len(x), np.nan)
+    if len(x) < period:
+        return out
+    # Centered sums keep the rolling difference precise for large prices
+    csum = np.cumsum(np.concatenate(([0.0], x - x[0])))
+    out[period - 1:] = (csum[period:] - csum[:-period]) / period + x[0]
+    return out
+
+
+def ema(prices, period: int) -> np.ndarray:
+    """Exponential moving average seeded with the SMA of the first `period` prices"""
+    return _seeded_smooth(as_series(prices), period, 2.0 / (period + 1))
+
+
+def macd(prices, fast: int = 12, slow: int = 26, signal: int = 9) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    MACD line (EMA fast - EMA slow), signal line (EMA of the MACD line)
+    and histogram (MACD - signal)
+    """
+    x = as_series(prices)
+    line = ema(x, fast) - ema(x, slow)
+
+    signal_line = np.full(len(x), np.nan)
+    defined = line[slow - 1:]
+    if len(defined):
+        signal_line[slow - 1:] = ema(defined, signal)
+    return line, signal_line, line - signal_line
+
+
+def rsi(prices, period: int = 14) -> np.ndarray:
+    """
+    Wilder's Relative Strength Index
+
+    Average gain and loss are seeded with the mean of the first `period`
+    changes and smoothed with alpha = 1/period. No movement at all is 50.
+    """
+    x = as_series(prices)
+    out = np.full(len(x), np.nan)
+    if len(x) < period + 1:
+        return out
+
+    change = np.diff(x)
+    avg_gain = _seeded_smooth(np.clip(change, 0, None), period, 1.0 / period)
+    avg_loss = _seeded_smooth(np.clip(-change, 0, None), period, 1.0 / period)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    values = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), values)
+    out[1:] = np.where(np.isnan(avg_gain), np.nan, values)
+    return out
+
+
+def bollinger(prices, period: int = 20, width: float = 2.0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Bollinger bands: (middle SMA, upper, lower), `width` standard deviations apart"""
+    x = as_series(prices)
+    middle = sma(x, period)
+    if len(x) < period:
+        return middle, middle.copy(), middle.copy()
+
+    # Rolling variance from centered sums: E[(x-c)^2] - E[x-c]^2
+    centered = x - x.mean()
+    csum = np.cumsum(np.concatenate(([0.0], centered)))
+    csq = np.cumsum(np.concatenate(([0.0], centered * centered)))
+    mean = (csum[period:] - csum[:-period]) / period
+    var = (csq[period:] - csq[:-period]) / period - mean * mean
+
+    std = np.full(len(x), np.nan)
+    std[period - 1:] = np.sqrt(np.clip(var, 0, None))
+    return middle, middle + width * std, middle - width * std
+
+
+def true_range(high, low, close) -> np.ndarray:
+    """Largest of high-low and the gaps from the previous close"""
+    high, low, close = as_series(high), as_series(low), as_series(close)
+    tr = high - low
+    if len(close) > 1:
+        prev = close[:-1]
+        tr[1:] = np.maximum.reduce([tr[1:], np.abs(high[1:] - prev), np.abs(low[1:] - prev)])
+    return tr
+
+
+def atr(high, low, close, period: int = 14) -> np.ndarray:
+    """Wilder's Average True Range"""
+    return _seeded_smooth(true_range(high, low, close), period, 1.0 / period)
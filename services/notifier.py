@@ -0,0 +1,248 @@
+"""
+Notification Dispatcher - Rate-limited, concurrent Telegram delivery
+
+Scheduler jobs and handlers enqueue messages and return immediately.
+A bounded pool of workers delivers them under a global token bucket
+(Telegram allows ~30 messages/second per bot) and a per-chat interval,
+backs off on RetryAfter and keeps delivery stats per job.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Optional
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+from config import NOTIFY_WORKERS, NOTIFY_RATE, NOTIFY_CHAT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Attempts per message for transient errors (timeouts, network)
+MAX_ATTEMPTS = 3
+
+# Finished job stats kept for inspection
+MAX_JOB_STATS = 50
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class JobStats:
+    """Delivery counters for one notification job"""
+    job: str
+    queued: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def pending(self) -> int:
+        return self.queued - self.sent - self.failed
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+@dataclass
+class Message:
+    """Queued notification"""
+    chat_id: int
+    text: str
+    job: str
+    parse_mode: Optional[str] = "Markdown"
+    reply_markup: object = None
+    on_done: Optional[Callable[[bool, Optional[str]], None]] = None
+    attempts: int = 0
+
+
+class NotificationDispatcher:
+    """Worker pool delivering queued messages under Telegram rate limits"""
+
+    def __init__(self, workers: int = NOTIFY_WORKERS, rate: float = NOTIFY_RATE,
+                 chat_interval: float = NOTIFY_CHAT_INTERVAL):
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self._bucket = TokenBucket(rate)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._send = None
+        self._chat_next: dict[int, float] = {}
+        self._paused_until = 0.0
+        self._outstanding = 0
+        self._jobs: OrderedDict[str, JobStats] = OrderedDict()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, send) -> None:
+        """
+        Start the workers
+
+        Args:
+            send: async callable(chat_id, text, parse_mode, reply_markup)
+                  that raises telegram errors on failure
+        """
+        if self._tasks:
+            return
+        self._send = send
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Notification dispatcher started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Drain the queue for up to `timeout` seconds, then stop the workers"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while self._outstanding and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._outstanding:
+            logger.warning(f"Notification dispatcher stopped with {self._outstanding} undelivered messages")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def backlog(self) -> int:
+        """Messages queued or being retried"""
+        return self._outstanding
+
+    async def enqueue(self, chat_id: int, text: str, job: str = "default",
+                      parse_mode: Optional[str] = "Markdown", reply_markup=None,
+                      on_done: Callable[[bool, Optional[str]], None] = None) -> None:
+        """
+        Queue a message; returns without waiting for delivery
+
+        on_done(ok, error) is called once the message is delivered or given up on.
+        """
+        stats = self._jobs.get(job)
+        if stats is None or stats.finished_at is not None:
+            stats = JobStats(job)
+            self._jobs[job] = stats
+            self._jobs.move_to_end(job)
+            while len(self._jobs) > MAX_JOB_STATS:
+                self._jobs.popitem(last=False)
+        stats.queued += 1
+        self._outstanding += 1
+        self._queue.put_nowait(Message(chat_id, text, job, parse_mode, reply_markup, on_done))
+
+    def job_stats(self, job: str) -> Optional[JobStats]:
+        """Delivery stats of the latest run of a job"""
+        return self._jobs.get(job)
+
+    def _requeue(self, msg: Message, delay: float) -> None:
+        """Put a message back after `delay` seconds without holding a worker"""
+        if delay <= 0:
+            self._queue.put_nowait(msg)
+        else:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, msg)
+
+    def _finish(self, msg: Message, ok: bool, error: str = None) -> None:
+        self._outstanding -= 1
+        if msg.on_done is not None:
+            try:
+                msg.on_done(ok, error)
+            except Exception as e:
+                logger.error(f"Notification callback error: {e}")
+        stats = self._jobs.get(msg.job)
+        if stats is None:
+            return
+        if ok:
+            stats.sent += 1
+        else:
+            stats.failed += 1
+        if stats.pending == 0:
+            stats.finished_at = time.monotonic()
+            logger.info(
+                f"Notification job '{stats.job}': {stats.sent} sent, {stats.failed} failed, "
+                f"{stats.retried} retried in {stats.duration:.1f}s"
+            )
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            msg = await self._queue.get()
+            try:
+                await self._deliver(msg)
+            except Exception as e:
+                logger.error(f"Notification worker {number} error: {e}")
+                self._finish(msg, False, str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, msg: Message) -> None:
+        now = time.monotonic()
+
+        # Per-chat limit: come back later instead of blocking a worker
+        chat_wait = self._chat_next.get(msg.chat_id, 0) - now
+        if chat_wait > 0:
+            self._requeue(msg, chat_wait)
+            return
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        self._chat_next[msg.chat_id] = now + self.chat_interval
+
+        # Flood control from Telegram applies to the whole bot
+        if self._paused_until > now:
+            await asyncio.sleep(self._paused_until - now)
+
+        await self._bucket.acquire()
+        self._chat_next[msg.chat_id] = time.monotonic() + self.chat_interval
+        msg.attempts += 1
+
+        try:
+            await self._send(msg.chat_id, msg.text, msg.parse_mode, msg.reply_markup)
+            self._finish(msg, True)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            logger.warning(f"Telegram flood control: pausing {retry_after}s")
+            self._count_retry(msg)
+            msg.attempts -= 1  # Not the message's fault
+            self._requeue(msg, retry_after)
+        except (Forbidden, BadRequest) as e:
+            # Blocked the bot, chat not found, bad markup - retrying will not help
+            logger.info(f"Notification to {msg.chat_id} rejected: {e}")
+            self._finish(msg, False, str(e))
+        except (TimedOut, NetworkError) as e:
+            if msg.attempts < MAX_ATTEMPTS:
+                self._count_retry(msg)
+                self._requeue(msg, 2 ** msg.attempts)
+            else:
+                logger.error(f"Notification failed for {msg.chat_id}: {e}")
+                self._finish(msg, False, str(e))
+
+    def _count_retry(self, msg: Message) -> None:
+        stats = self._jobs.get(msg.job)
+        if stats is not None:
+            stats.retried += 1
+
+
+dispatcher = NotificationDispatcher()
@@ -0,0 +1,308 @@
+"""
+Notification Outbox - Durable delivery for bulk notification jobs
+
+Bulk jobs (weekly report, broadcast) write one row per recipient keyed by
+(job, period, user) and return. A drainer claims pending rows in batches,
+hands them to the dispatcher and records each outcome, so after a restart
+only the rows that were not delivered yet are sent, and re-running a job
+for the same period adds nothing.
+
+Claiming is a single UPDATE ... WHERE id IN (SELECT ... LIMIT n) RETURNING.
+On PostgreSQL the inner select uses FOR UPDATE SKIP LOCKED so several bot
+processes can drain the same table; SQLite serializes writers, which makes
+the same statement atomic there.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Collection, Optional
+from sqlalchemy import select, update, delete, func
+
+from database.db import get_session, bulk_upsert
+from database.models import NotificationOutbox
+from services.notifier import dispatcher as default_dispatcher
+from config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Rows claimed per batch (also the dispatcher backlog the drainer keeps)
+BATCH_SIZE = 200
+
+# Rows per INSERT statement when enqueueing
+INSERT_BATCH_SIZE = 1000
+
+# Claimed rows not resolved within the lease go back to pending (crashed process)
+CLAIM_LEASE = timedelta(minutes=5)
+
+# Claims per row before it is given up on
+MAX_CLAIMS = 3
+
+# Seconds between polls when the outbox is empty
+IDLE_INTERVAL = 5.0
+
+# Seconds between stale-claim sweeps (also renews the lease of rows still
+# waiting in this process's dispatcher, so keep it well under CLAIM_LEASE)
+RECLAIM_INTERVAL = 60.0
+
+# Delivery outcomes are written at most this many seconds after delivery
+FLUSH_INTERVAL = 1.0
+
+
+def make_key(job: str, period: str, user_id: int) -> str:
+    """Idempotency key of one notification"""
+    return f"{job}:{period}:{user_id}"
+
+
+async def enqueue_outbox(job: str, period: str, user_ids: list[int], message: str,
+                         parse_mode: Optional[str] = "Markdown") -> int:
+    """
+    Persist one notification per user; rows already queued for the
+    same (job, period, user) are left as they are
+
+    Returns:
+        Number of rows submitted
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            "idempotency_key": make_key(job, period, user_id),
+            "job": job,
+            "period": period,
+            "user_id": user_id,
+            "message": message,
+            "parse_mode": parse_mode,
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now,
+        }
+        for user_id in user_ids
+    ]
+
+    async with get_session() as session:
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            await bulk_upsert(session, NotificationOutbox, rows[i:i + INSERT_BATCH_SIZE], ["idempotency_key"])
+        await session.commit()
+
+    outbox_drainer.wake()
+    logger.info(f"Outbox: {len(rows)} '{job}' notifications queued for {period}")
+    return len(rows)
+
+
+async def claim_batch(limit: int = BATCH_SIZE) -> list:
+    """Mark up to `limit` due rows as sending and return them"""
+    now = datetime.utcnow()
+    due = (
+        select(NotificationOutbox.id)
+        .where(
+            NotificationOutbox.status == "pending",
+            NotificationOutbox.available_at <= now
+        )
+        .order_by(NotificationOutbox.id)
+        .limit(limit)
+    )
+    if "postgresql" in DATABASE_URL:
+        due = due.with_for_update(skip_locked=True)
+
+    async with get_session() as session:
+        result = await session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(due))
+            .values(
+                status="sending",
+                claimed_at=now,
+                attempts=NotificationOutbox.attempts + 1
+            )
+            .returning(
+                NotificationOutbox.id, NotificationOutbox.user_id, NotificationOutbox.job,
+                NotificationOutbox.message, NotificationOutbox.parse_mode
+            )
+            .execution_options(synchronize_session=False)
+        )
+        rows = result.all()
+        await session.commit()
+    return sorted(rows, key=lambda r: r.id)
+
+
+async def reclaim_stale(inflight: Collection[int] = ()) -> int:
+    """
+    Return rows claimed by a process that died to pending
+
+    Rows in `inflight` are still queued in this process (e.g. held back by
+    RetryAfter or per-chat spacing): their lease is renewed and they are
+    never reclaimed, so they are not queued a second time.
+    """
+    now = datetime.utcnow()
+    inflight = list(inflight)
+    expired = (
+        NotificationOutbox.status == "sending",
+        NotificationOutbox.claimed_at < now - CLAIM_LEASE,
+        NotificationOutbox.id.not_in(inflight)
+    )
+    async with get_session() as session:
+        if inflight:
+            await session.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(inflight), NotificationOutbox.status == "sending")
+                .values(claimed_at=now)
+            )
+        await session.execute(
+            update(NotificationOutbox)
+            .where(*expired, NotificationOutbox.attempts >= MAX_CLAIMS)
+            .values(status="failed", last_error="claim lease expired")
+        )
+        result = await session.execute(
+            update(NotificationOutbox)
+            .where(*expired)
+            .values(status="pending", available_at=now)
+        )
+        await session.commit()
+
+    if result.rowcount:
+        logger.warning(f"Outbox: {result.rowcount} stale claims returned to pending")
+    return result.rowcount
+
+
+async def outbox_progress(job: str, period: str) -> dict:
+    """Row counts by status for one job run"""
+    async with get_session() as session:
+        result = await session.execute(
+            select(NotificationOutbox.status, func.count(NotificationOutbox.id))
+            .where(NotificationOutbox.job == job, NotificationOutbox.period == period)
+            .group_by(NotificationOutbox.status)
+        )
+        return dict(result.all())
+
+
+async def cleanup_outbox(days: int = 30) -> int:
+    """Delete finished rows older than `days`"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    async with get_session() as session:
+        result = await session.execute(
+            delete(NotificationOutbox).where(
+                NotificationOutbox.status.in_(("sent", "failed")),
+                NotificationOutbox.created_at < cutoff
+            )
+        )
+        await session.commit()
+    return result.rowcount
+
+
+class OutboxDrainer:
+    """Feeds claimed outbox rows to the dispatcher and records outcomes in batches"""
+
+    def __init__(self, dispatcher=default_dispatcher, batch_size: int = BATCH_SIZE):
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._inflight: set[int] = set()
+        self._sent: list[int] = []
+        self._failed: list[tuple[int, Optional[str]]] = []
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Outbox drainer started")
+
+    def wake(self) -> None:
+        """Poll now instead of after the idle interval"""
+        self._wake.set()
+
+    async def stop(self) -> None:
+        """Stop claiming new rows (rows already handed out keep going)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def close(self) -> None:
+        """Record outcomes and release undelivered rows; call after the dispatcher stopped"""
+        await self.flush()
+
+        if self._inflight:
+            # Not delivered yet: hand back without spending a claim
+            async with get_session() as session:
+                await session.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.id.in_(list(self._inflight)))
+                    .values(status="pending", attempts=NotificationOutbox.attempts - 1)
+                )
+                await session.commit()
+            logger.info(f"Outbox: released {len(self._inflight)} undelivered rows")
+            self._inflight.clear()
+
+    def _done(self, row_id: int, ok: bool, error: Optional[str]) -> None:
+        self._inflight.discard(row_id)
+        if ok:
+            self._sent.append(row_id)
+        else:
+            self._failed.append((row_id, error))
+
+    async def flush(self) -> None:
+        """Write delivery outcomes collected since the last flush"""
+        sent, self._sent = self._sent, []
+        failed, self._failed = self._failed, []
+        if not sent and not failed:
+            return
+
+        now = datetime.utcnow()
+        async with get_session() as session:
+            for i in range(0, len(sent), INSERT_BATCH_SIZE):
+                await session.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.id.in_(sent[i:i + INSERT_BATCH_SIZE]))
+                    .values(status="sent", sent_at=now, last_error=None)
+                )
+            if failed:
+                await session.execute(
+                    update(NotificationOutbox),
+                    [
+                        {"id": row_id, "status": "failed", "last_error": (error or "")[:500]}
+                        for row_id, error in failed
+                    ]
+                )
+            await session.commit()
+
+    async def _run(self) -> None:
+        last_reclaim = 0.0
+        while True:
+            try:
+                await self.flush()
+
+                if time.monotonic() - last_reclaim > RECLAIM_INTERVAL:
+                    last_reclaim = time.monotonic()
+                    await reclaim_stale(self._inflight)
+
+                # Keep at most one batch waiting in the dispatcher
+                if self.dispatcher.backlog >= self.batch_size:
+                    await asyncio.sleep(0.5)
+                    continue
+
+                self._wake.clear()
+                rows = await claim_batch(self.batch_size)
+                for row in rows:
+                    self._inflight.add(row.id)
+                    await self.dispatcher.enqueue(
+                        row.user_id, row.message, job=row.job,
+                        parse_mode=row.parse_mode, on_done=partial(self._done, row.id)
+                    )
+
+                if not rows:
+                    # Deliveries still running: come back soon to record them
+                    pending = self._inflight or self._sent or self._failed
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), FLUSH_INTERVAL if pending else IDLE_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox drainer error: {e}")
+                await asyncio.sleep(IDLE_INTERVAL)
+
+
+outbox_drainer = OutboxDrainer()
@@ -5,29 +5,67 @@ Uses REAL bank rates when available from scraper.
 Falls back to CBU + spread estimation if scraper fails.
 """
 import logging
+import time
 from datetime import datetime
-from typing import Optional
-from sqlalchemy import select, delete
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, Mapping, Optional
+from sqlalchemy import delete, tuple_
 
-from database.db import get_session
+from database.db import get_session, bulk_upsert
 from database.models import Rate
-from services.cbu_fetcher import get_cbu_rates
+from services.rate_snapshot import get_snapshot, peek_snapshot, publish_snapshot, CurrencyRanking
+from services.cbu_fetcher import poll_cbu_rates
 from services.bank_scraper import get_all_bank_rates
-from config import BANKS, POPULAR_CURRENCIES
+from services.single_flight import single_flight
+from config import BANKS, POPULAR_CURRENCIES, RATE_WRITE_MODE, UPDATE_INTERVAL
 
 logger = logging.getLogger(__name__)
 
+# Fingerprint of the CBU payload behind the current snapshot
+_applied_fingerprint = None
 
-async def update_all_rates() -> bool:
-    """Fetch rates: REAL from banks when possible, fallback to CBU + spread"""
+# Monotonic time of the last successful poll (changed or not)
+_last_polled = 0.0
+
+# UTC time of the last successful poll, shown as the update time (rows are
+# only written when they change, so their fetched_at is the last change)
+_last_fetched_at: Optional[datetime] = None
+
+# Columns compared when deciding whether a rate row changed
+RATE_VALUE_FIELDS = ["currency_name", "buy_rate", "sell_rate", "official_rate", "nominal", "diff"]
+
+
+def diff_rates(previous, rows: list[dict]) -> list[dict]:
+    """Return rows that are new or differ from the previous snapshot"""
+    changed = []
+    for row in rows:
+        old = previous.by_key.get((row["bank_code"], row["currency_code"]))
+        if old is None or any(old[f] != row[f] for f in RATE_VALUE_FIELDS):
+            changed.append(row)
+    return changed
+
+
+async def update_all_rates(force: bool = False) -> bool:
+    """
+    Fetch rates: REAL from banks when possible, fallback to CBU + spread
+    
+    When CBU has not published anything new since the last successful
+    refresh, the refresh is skipped (unless force=True) and the current
+    snapshot stays in place.
+    """
+    global _applied_fingerprint, _last_polled, _last_fetched_at
     try:
-        # 1. Fetch CBU rates (always needed as base)
-        cbu_rates = await get_cbu_rates()
+        # 1. Poll CBU rates (always needed as base)
+        cbu_rates, fingerprint = await poll_cbu_rates()
         
         if not cbu_rates:
             logger.warning("No rates fetched from CBU")
             return False
+        _last_polled = time.monotonic()
+        
+        if not force and fingerprint == _applied_fingerprint and len(peek_snapshot()):
+            logger.debug("CBU rates unchanged, skipping refresh")
+            _last_fetched_at = datetime.utcnow()
+            return True
         
         # Create lookup for CBU rates by currency
         cbu_lookup = {r["currency_code"]: r for r in cbu_rates}
@@ -37,65 +75,92 @@ async def update_all_rates() -> bool:
         real_banks_count = len(real_bank_rates)
         logger.info(f"Fetched real rates from {real_banks_count} banks: {list(real_bank_rates.keys())}")
         
-        async with get_session() as session:
-            # Clear old rates
-            await session.execute(delete(Rate))
+        fetched_at = datetime.utcnow()
+        rows = []
+        
+        # 3. For each bank in config
+        for bank_code, bank_info in BANKS.items():
             
-            # 3. For each bank in config
-            for bank_code, bank_info in BANKS.items():
+            # For each currency from CBU
+            for rate_data in cbu_rates:
+                currency_code = rate_data["currency_code"]
+                official_rate = rate_data.get("official_rate", 0)
                 
-                # For each currency from CBU
-                for rate_data in cbu_rates:
-                    currency_code = rate_data["currency_code"]
-                    official_rate = rate_data.get("official_rate", 0)
-                    
-                    buy_rate = None
-                    sell_rate = None
-                    is_real = False
+                buy_rate = None
+                sell_rate = None
+                is_real = False
+                
+                if bank_info["type"] == "official":
+                    # CBU - official rate only
+                    pass
+                elif bank_code in real_bank_rates:
+                    # REAL bank rate available!
+                    bank_rates = real_bank_rates[bank_code]
+                    for br in bank_rates:
+                        if br["currency_code"] == currency_code:
+                            buy_rate = br.get("buy_rate")
+                            sell_rate = br.get("sell_rate")
+                            is_real = True
+                            break
                     
-                    if bank_info["type"] == "official":
-                        # CBU - official rate only
-                        pass
-                    elif bank_code in real_bank_rates:
-                        # REAL bank rate available!
-                        bank_rates = real_bank_rates[bank_code]
-                        for br in bank_rates:
-                            if br["currency_code"] == currency_code:
-                                buy_rate = br.get("buy_rate")
-                                sell_rate = br.get("sell_rate")
-                                is_real = True
-                                break
-                        
-                        # If currency not found in real rates, fallback to spread
-                        if buy_rate is None:
-                            buy_spread = bank_info.get("buy_spread", 0)
-                            sell_spread = bank_info.get("sell_spread", 0)
-                            buy_rate = round(official_rate * (1 + buy_spread / 100), 2)
-                            sell_rate = round(official_rate * (1 + sell_spread / 100), 2)
-                    else:
-                        # No real rates - use spread estimation
+                    # If currency not found in real rates, fallback to spread
+                    if buy_rate is None:
                         buy_spread = bank_info.get("buy_spread", 0)
                         sell_spread = bank_info.get("sell_spread", 0)
                         buy_rate = round(official_rate * (1 + buy_spread / 100), 2)
                         sell_rate = round(official_rate * (1 + sell_spread / 100), 2)
-                    
-                    rate = Rate(
-                        bank_code=bank_code,
-                        currency_code=currency_code,
-                        currency_name=rate_data.get("currency_name", ""),
-                        official_rate=official_rate if bank_info["type"] == "official" else None,
-                        buy_rate=buy_rate,
-                        sell_rate=sell_rate,
-                        nominal=rate_data.get("nominal", 1),
-                        diff=rate_data.get("diff") if bank_info["type"] == "official" else None,
-                        fetched_at=datetime.utcnow()
+                else:
+                    # No real rates - use spread estimation
+                    buy_spread = bank_info.get("buy_spread", 0)
+                    sell_spread = bank_info.get("sell_spread", 0)
+                    buy_rate = round(official_rate * (1 + buy_spread / 100), 2)
+                    sell_rate = round(official_rate * (1 + sell_spread / 100), 2)
+                
+                rows.append({
+                    "bank_code": bank_code,
+                    "currency_code": currency_code,
+                    "currency_name": rate_data.get("currency_name", ""),
+                    "official_rate": official_rate if bank_info["type"] == "official" else None,
+                    "buy_rate": buy_rate,
+                    "sell_rate": sell_rate,
+                    "nominal": rate_data.get("nominal", 1),
+                    "diff": rate_data.get("diff") if bank_info["type"] == "official" else None,
+                    "fetched_at": fetched_at
+                })
+        
+        # 4. Persist only what changed (the database is the cold-start source)
+        previous = await get_snapshot()
+        if RATE_WRITE_MODE == "full":
+            changed = rows
+        else:
+            changed = diff_rates(previous, rows)
+        
+        current_keys = {(r["bank_code"], r["currency_code"]) for r in rows}
+        stale_keys = [key for key in previous.by_key if key not in current_keys]
+        
+        if changed or stale_keys:
+            async with get_session() as session:
+                await bulk_upsert(
+                    session, Rate, changed,
+                    index_elements=["bank_code", "currency_code"],
+                    update_columns=RATE_VALUE_FIELDS + ["fetched_at"]
+                )
+                if stale_keys:
+                    await session.execute(
+                        delete(Rate).where(tuple_(Rate.bank_code, Rate.currency_code).in_(stale_keys))
                     )
-                    session.add(rate)
-            
-            await session.commit()
+                await session.commit()
+        
+        # 5. Swap the in-memory snapshot in one step
+        publish_snapshot(rows, fetched_at)
+        _applied_fingerprint = fingerprint
+        _last_fetched_at = fetched_at
         
         total_rates = len(cbu_rates) * len(BANKS)
-        logger.info(f"Updated {total_rates} rates ({real_banks_count} real, {len(BANKS) - real_banks_count - 1} estimated)")
+        logger.info(
+            f"Updated {total_rates} rates ({real_banks_count} real, {len(BANKS) - real_banks_count - 1} estimated), "
+            f"{len(changed)} written, {len(stale_keys)} removed"
+        )
         return True
         
     except Exception as e:
@@ -103,74 +168,74 @@ async def update_all_rates() -> bool:
         return False
 
 
-async def get_rate(bank_code: str, currency_code: str) -> Optional[dict]:
+async def refresh_rates_shared() -> bool:
+    """Run update_all_rates, or join the refresh already in flight"""
+    return await single_flight.do("update_rates", update_all_rates)
+
+
+async def request_refresh() -> bool:
+    """
+    Refresh asked for by a user
+    
+    Joins a refresh in flight (the scheduler's or another user's) and is a
+    no-op when the last poll is younger than the scheduler interval, so
+    user taps never add upstream requests.
+    """
+    if not single_flight.in_flight("update_rates") and time.monotonic() - _last_polled < UPDATE_INTERVAL:
+        return True
+    return await refresh_rates_shared()
+
+
+async def get_rate(bank_code: str, currency_code: str) -> Optional[Mapping]:
     """Get rate for specific bank and currency"""
-    async with get_session() as session:
-        result = await session.execute(
-            select(Rate).where(
-                Rate.bank_code == bank_code,
-                Rate.currency_code == currency_code
-            )
-        )
-        rate = result.scalar_one_or_none()
-        
-        if rate:
-            return {
-                "currency_code": rate.currency_code,
-                "currency_name": rate.currency_name,
-                "official_rate": rate.official_rate,
-                "buy_rate": rate.buy_rate,
-                "sell_rate": rate.sell_rate,
-                "nominal": rate.nominal,
-                "diff": rate.diff,
-                "fetched_at": rate.fetched_at
-            }
-        return None
-
-
-async def get_rates_by_bank(bank_code: str) -> list[dict]:
+    snapshot = await get_snapshot()
+    return snapshot.by_key.get((bank_code, currency_code))
+
+
+async def get_rates_by_bank(bank_code: str) -> list[Mapping]:
     """Get all rates for a specific bank"""
-    async with get_session() as session:
-        result = await session.execute(
-            select(Rate).where(Rate.bank_code == bank_code)
-        )
-        rates = result.scalars().all()
-        
-        return [
-            {
-                "currency_code": r.currency_code,
-                "currency_name": r.currency_name,
-                "buy_rate": r.buy_rate,
-                "sell_rate": r.sell_rate,
-                "official_rate": r.official_rate,
-                "nominal": r.nominal,
-                "diff": r.diff,
-                "fetched_at": r.fetched_at
-            }
-            for r in rates
-        ]
-
-
-async def get_rates_by_currency(currency_code: str) -> list[dict]:
+    snapshot = await get_snapshot()
+    return list(snapshot.by_bank.get(bank_code, ()))
+
+
+async def get_rates_for_banks(
+    bank_codes: Iterable[str], currency_codes: Optional[Iterable[str]] = None
+) -> dict[str, dict[str, Mapping]]:
+    """
+    Rates of several banks from one snapshot read
+    
+    Returns:
+        {bank_code: {currency_code: rate}} for every requested bank (empty
+        when it has no rates), limited to currency_codes if given
+    """
+    snapshot = await get_snapshot()
+    if currency_codes is None:
+        return {
+            bank: {rate["currency_code"]: rate for rate in snapshot.by_bank.get(bank, ())}
+            for bank in bank_codes
+        }
+    currency_codes = list(currency_codes)
+    result = {}
+    for bank in bank_codes:
+        rates = {}
+        for currency in currency_codes:
+            rate = snapshot.by_key.get((bank, currency))
+            if rate is not None:
+                rates[currency] = rate
+        result[bank] = rates
+    return result
+
+
+async def get_rates_by_currency(currency_code: str) -> list[Mapping]:
     """Get rates from all banks for a specific currency"""
-    async with get_session() as session:
-        result = await session.execute(
-            select(Rate).where(Rate.currency_code == currency_code)
-        )
-        rates = result.scalars().all()
-        
-        return [
-            {
-                "bank_code": r.bank_code,
-                "bank_name": BANKS.get(r.bank_code, {}).get("name_uz", r.bank_code),
-                "buy_rate": r.buy_rate,
-                "sell_rate": r.sell_rate,
-                "official_rate": r.official_rate,
-                "nominal": r.nominal,
-                "fetched_at": r.fetched_at
-            }
-            for r in rates
-        ]
+    snapshot = await get_snapshot()
+    return list(snapshot.by_currency.get(currency_code, ()))
+
+
+async def get_currency_ranking(currency_code: str) -> Optional[CurrencyRanking]:
+    """Banks ranked by price for a currency, None if no bank has it"""
+    snapshot = await get_snapshot()
+    return snapshot.rankings.get(currency_code)
 
 
 async def get_last_update_time() -> Optional[str]:
@@ -178,14 +243,13 @@ async def get_last_update_time() -> Optional[str]:
     from zoneinfo import ZoneInfo
     UZ_TZ = ZoneInfo("Asia/Tashkent")
     
-    async with get_session() as session:
-        result = await session.execute(
-            select(Rate.fetched_at).order_by(Rate.fetched_at.desc()).limit(1)
-        )
-        fetched_at = result.scalar_one_or_none()
-        
-        if fetched_at:
-            # Convert to Tashkent time
-            local_time = fetched_at.replace(tzinfo=ZoneInfo("UTC")).astimezone(UZ_TZ)
-            return local_time.strftime("%H:%M")
-        return None
+    snapshot = await get_snapshot()
+    fetched_at = snapshot.fetched_at
+    if _last_fetched_at and (not fetched_at or _last_fetched_at > fetched_at):
+        fetched_at = _last_fetched_at
+    
+    if fetched_at:
+        # Convert to Tashkent time
+        local_time = fetched_at.replace(tzinfo=ZoneInfo("UTC")).astimezone(UZ_TZ)
+        return local_time.strftime("%H:%M")
+    return None
@@ -0,0 +1,186 @@
+"""
+Rate Snapshot - Immutable in-process copy of the current rates
+
+update_all_rates builds a new snapshot after every refresh and swaps it
+in with a single assignment, so readers always see a complete set of
+rates. Reads are plain dictionary lookups; the database is only used to
+persist rates and to warm the snapshot on a cold start.
+
+Per-currency rankings (best buy/sell, bank order, spread stats) are built
+together with the snapshot, so best-rate screens, comparisons and alerts
+read them instead of sorting every bank's rates on each call.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Mapping, Optional
+from sqlalchemy import select
+
+from database.db import get_session
+from database.models import Rate
+from config import BANKS
+
+logger = logging.getLogger(__name__)
+
+# Fields copied from a Rate row into a snapshot entry
+RATE_FIELDS = (
+    "bank_code", "currency_code", "currency_name",
+    "buy_rate", "sell_rate", "official_rate",
+    "nominal", "diff", "fetched_at",
+)
+
+
+def buy_price(entry: Mapping) -> float:
+    """Price a bank buys the currency at (official rate for CBU)"""
+    return entry.get("buy_rate") or entry.get("official_rate") or 0
+
+
+def sell_price(entry: Mapping) -> float:
+    """Price a bank sells the currency at (official rate for CBU)"""
+    return entry.get("sell_rate") or entry.get("official_rate") or 0
+
+
+@dataclass(frozen=True)
+class CurrencyRanking:
+    """Banks of one currency ranked by price"""
+    currency_code: str
+    # Highest buy price first / lowest sell price first; banks without a price are left out
+    by_buy: tuple = ()
+    by_sell: tuple = ()
+    # Highest quoted buy_rate (commercial banks only; CBU has no buy_rate)
+    best_bank_buy: Optional[Mapping] = None
+    # sell_rate - buy_rate over banks quoting both
+    spread_min: Optional[float] = None
+    spread_max: Optional[float] = None
+    spread_avg: Optional[float] = None
+    narrowest: Optional[Mapping] = None
+
+    @property
+    def best_buy(self) -> Optional[Mapping]:
+        return self.by_buy[0] if self.by_buy else None
+
+    @property
+    def best_sell(self) -> Optional[Mapping]:
+        return self.by_sell[0] if self.by_sell else None
+
+
+def build_ranking(currency_code: str, entries: tuple) -> CurrencyRanking:
+    """Rank one currency's rates (sorts are stable: ties keep snapshot order)"""
+    by_buy = tuple(sorted((e for e in entries if buy_price(e)), key=buy_price, reverse=True))
+    by_sell = tuple(sorted((e for e in entries if sell_price(e)), key=sell_price))
+
+    best_bank_buy = max((e for e in entries if e.get("buy_rate")), key=lambda e: e["buy_rate"], default=None)
+
+    quoted = [e for e in entries if e.get("buy_rate") and e.get("sell_rate")]
+    if not quoted:
+        return CurrencyRanking(currency_code, by_buy, by_sell, best_bank_buy)
+
+    spreads = [e["sell_rate"] - e["buy_rate"] for e in quoted]
+    narrowest = quoted[spreads.index(min(spreads))]
+    return CurrencyRanking(
+        currency_code, by_buy, by_sell, best_bank_buy,
+        spread_min=min(spreads),
+        spread_max=max(spreads),
+        spread_avg=sum(spreads) / len(spreads),
+        narrowest=narrowest,
+    )
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """Read-only view of all current rates"""
+    version: int = 0
+    fetched_at: Optional[datetime] = None
+    by_key: Mapping[tuple, Mapping] = field(default_factory=dict)
+    by_bank: Mapping[str, tuple] = field(default_factory=dict)
+    by_currency: Mapping[str, tuple] = field(default_factory=dict)
+    rankings: Mapping[str, CurrencyRanking] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.by_key)
+
+
+def make_entry(row: dict) -> Mapping:
+    """Freeze a rate dict, adding the display bank name"""
+    entry = {name: row.get(name) for name in RATE_FIELDS}
+    entry["bank_name"] = BANKS.get(row["bank_code"], {}).get("name_uz", row["bank_code"])
+    return MappingProxyType(entry)
+
+
+def build_snapshot(rows: list[dict], version: int, fetched_at: Optional[datetime] = None) -> RateSnapshot:
+    """Index rate rows by (bank, currency), by bank and by currency"""
+    by_key = {}
+    by_bank = {}
+    by_currency = {}
+
+    for row in rows:
+        entry = make_entry(row)
+        by_key[(entry["bank_code"], entry["currency_code"])] = entry
+        by_bank.setdefault(entry["bank_code"], []).append(entry)
+        by_currency.setdefault(entry["currency_code"], []).append(entry)
+
+    if fetched_at is None:
+        fetched_at = max((e["fetched_at"] for e in by_key.values() if e["fetched_at"]), default=None)
+
+    by_currency = {k: tuple(v) for k, v in by_currency.items()}
+    return RateSnapshot(
+        version=version,
+        fetched_at=fetched_at,
+        by_key=MappingProxyType(by_key),
+        by_bank=MappingProxyType({k: tuple(v) for k, v in by_bank.items()}),
+        by_currency=MappingProxyType(by_currency),
+        rankings=MappingProxyType({k: build_ranking(k, v) for k, v in by_currency.items()}),
+    )
+
+
+_snapshot = RateSnapshot()
+_load_lock = asyncio.Lock()
+# The cold-start load ran; an empty rates table is not queried again on every read
+_load_attempted = False
+
+
+def publish_snapshot(rows: list[dict], fetched_at: Optional[datetime] = None) -> RateSnapshot:
+    """Build a snapshot from rows and make it the current one"""
+    global _snapshot
+    snapshot = build_snapshot(rows, _snapshot.version + 1, fetched_at)
+    _snapshot = snapshot
+    return snapshot
+
+
+def peek_snapshot() -> RateSnapshot:
+    """Current snapshot without cold-start loading (may be empty)"""
+    return _snapshot
+
+
+async def get_snapshot() -> RateSnapshot:
+    """Current snapshot, loaded from the database on a cold start"""
+    global _load_attempted
+    if _snapshot.version == 0 and not _load_attempted:
+        async with _load_lock:
+            if _snapshot.version == 0 and not _load_attempted:
+                await load_snapshot_from_db()
+                _load_attempted = True
+    return _snapshot
+
+
+async def load_snapshot_from_db() -> RateSnapshot:
+    """Warm the snapshot from the rates table"""
+    try:
+        async with get_session() as session:
+            result = await session.execute(select(Rate).order_by(Rate.id))
+            rows = [
+                {name: getattr(r, name) for name in RATE_FIELDS}
+                for r in result.scalars().all()
+            ]
+    except Exception as e:
+        logger.error(f"Rate snapshot load error: {e}")
+        return _snapshot
+
+    if not rows:
+        return _snapshot
+
+    snapshot = publish_snapshot(rows)
+    logger.info(f"Rate snapshot loaded from database: {len(snapshot)} rates")
+    return snapshot
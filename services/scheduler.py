@@ -1,18 +1,26 @@
 """
-Scheduler Service - Fixed with timezone, user-specific times, and RateHistory
+Scheduler Service - Fixed with timezone, user-specific times, and rate history
 """
 import logging
 from datetime import datetime, timedelta
+from functools import partial
 from zoneinfo import ZoneInfo
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import select
-
-from config import UPDATE_INTERVAL, POPULAR_CURRENCIES, BANKS
-from services.rate_manager import update_all_rates, get_rate, get_rates_by_currency
+from sqlalchemy import select, update
+
+from config import UPDATE_INTERVAL, POPULAR_CURRENCIES
+from services.rate_manager import refresh_rates_shared, get_rate, get_currency_ranking
+from services.rate_snapshot import peek_snapshot
+from services.alert_engine import evaluate_alerts, alert_index
+from services.outbox import enqueue_outbox, cleanup_outbox
+from services.history_store import record_snapshot, rollup_all, apply_retention
+from services.indicator_state import advance_indicators
+from services.chart_service import prerender_popular_charts
 from database.db import get_session
-from database.models import User, Alert, RateHistory, SmartExchange
+from database.models import User, SmartExchange
+from locales.helpers import t
 
 logger = logging.getLogger(__name__)
 
@@ -25,54 +33,88 @@ notification_callback = None
 # Store previous rates for big change detection
 previous_rates = {}
 
+# Snapshot version history, big changes and alerts were last run for
+_processed_version = 0
+
+# New history samples were saved since popular charts were last pre-rendered
+_charts_stale = False
+
 
 def set_notification_callback(callback):
-    """Set notification callback"""
+    """Set notification callback: async callback(user_id, message, job=...) that queues delivery"""
     global notification_callback
     notification_callback = callback
 
 
 async def update_rates_job():
     """Update rates (called every minute)"""
-    await update_all_rates()
+    global _processed_version
+    # Shared with user refreshes running at the same time
+    await refresh_rates_shared()
+    
+    # Nothing new since the last processed snapshot (including ones published
+    # by user refreshes between ticks) - rates, big changes and alerts are as
+    # before, except alerts created past their threshold since the last tick
+    version = peek_snapshot().version
+    if version == _processed_version:
+        if alert_index.has_pending:
+            await check_alerts()
+        return
+    
+    _processed_version = version
+    await save_rate_history()
     await check_big_changes()
     await check_alerts()
 
 
 async def save_rate_history():
-    """Save current CBU rates to history (called every 15 minutes)"""
+    """Record changed rates of every bank and currency and advance their indicators (on each new snapshot)"""
+    global _charts_stale
     try:
-        async with get_session() as session:
-            for currency in POPULAR_CURRENCIES[:5]:
-                rate = await get_rate("cbu", currency)
-                if rate:
-                    history = RateHistory(
-                        bank_code="cbu",
-                        currency_code=currency,
-                        official_rate=rate.get("official_rate"),
-                        buy_rate=rate.get("buy_rate"),
-                        sell_rate=rate.get("sell_rate")
-                    )
-                    session.add(history)
-            await session.commit()
-            logger.debug("Rate history saved")
+        saved = await record_snapshot(peek_snapshot())
+        if saved:
+            logger.debug(f"Rate history saved: {len(saved)} samples")
+            await advance_indicators(saved)
+            # New samples change chart versions: the prerender job warms popular charts
+            _charts_stale = True
     except Exception as e:
         logger.error(f"Save rate history error: {e}")
 
 
+async def prerender_charts():
+    """Render the most requested charts after new history is saved"""
+    global _charts_stale
+    if not _charts_stale:
+        return
+    _charts_stale = False
+    try:
+        rendered = await prerender_popular_charts()
+        if rendered:
+            logger.debug(f"Pre-rendered {rendered} charts")
+    except Exception as e:
+        logger.error(f"Chart pre-render error: {e}")
+
+
+async def rollup_history():
+    """Roll raw history into hourly and daily OHLC buckets (runs hourly)"""
+    try:
+        await rollup_all()
+    except Exception as e:
+        logger.error(f"History rollup error: {e}")
+
+
 async def cleanup_old_history():
-    """Delete rate history older than 30 days (runs daily)"""
+    """Apply per-tier history retention (runs daily)"""
     try:
-        cutoff_date = datetime.utcnow() - timedelta(days=30)
-        async with get_session() as session:
-            from sqlalchemy import delete
-            result = await session.execute(
-                delete(RateHistory).where(RateHistory.recorded_at < cutoff_date)
-            )
-            await session.commit()
-            deleted = result.rowcount
-            if deleted > 0:
-                logger.info(f"Cleaned up {deleted} old history records")
+        # Make sure everything due for deletion has been rolled up
+        await rollup_all()
+        deleted = await apply_retention()
+        if any(deleted.values()):
+            logger.info(f"History retention: deleted {deleted}")
+        
+        deleted = await cleanup_outbox()
+        if deleted > 0:
+            logger.info(f"Cleaned up {deleted} old outbox rows")
     except Exception as e:
         logger.error(f"History cleanup error: {e}")
 
@@ -115,15 +157,16 @@ async def notify_big_change(currency: str, prev: float, current: float, pct: flo
     
     async with get_session() as session:
         result = await session.execute(
-            select(User).where(User.big_change_notify == True, User.is_active == True)
+            select(User.id).where(User.big_change_notify == True, User.is_active == True)
         )
-        users = result.scalars().all()
-        
-        for user in users:
-            try:
-                await notification_callback(user.id, message)
-            except Exception as e:
-                logger.error(f"Failed to notify {user.id}: {e}")
+        user_ids = result.scalars().all()
+    
+    # Queued for the dispatcher - returns before delivery
+    for user_id in user_ids:
+        try:
+            await notification_callback(user_id, message, job="big_change")
+        except Exception as e:
+            logger.error(f"Failed to notify {user_id}: {e}")
 
 
 async def check_alerts():
@@ -131,84 +174,32 @@ async def check_alerts():
     if not notification_callback:
         return
     
-    async with get_session() as session:
-        result = await session.execute(
-            select(Alert).where(Alert.is_active == True, Alert.is_triggered == False)
-        )
-        alerts = result.scalars().all()
-        
-        for alert in alerts:
-            try:
-                await process_single_alert(alert, session)
-            except Exception as e:
-                logger.error(f"Alert check error: {e}")
+    try:
+        await evaluate_alerts(partial(notification_callback, job="alerts"))
+    except Exception as e:
+        logger.error(f"Alert check error: {e}")
 
 
-async def process_single_alert(alert, session):
-    """Process a single alert, including best rate mode"""
+def render_daily_digest(lang: str, time_label: str, rates: dict) -> str:
+    """Daily CBU digest text for one language"""
+    message = t("daily_digest_title", lang, time=time_label)
     
-    # Handle "best rate" alerts
-    if alert.bank_code in ("best_high", "best_low"):
-        rates = await get_rates_by_currency(alert.currency_code)
-        if not rates:
-            return
-        
-        if alert.bank_code == "best_high":
-            # Find highest buy rate
-            best = max(rates, key=lambda r: r.get("buy_rate") or r.get("official_rate") or 0)
-            current = best.get("buy_rate") or best.get("official_rate") or 0
-            bank_name = BANKS.get(best["bank_code"], {}).get("name_uz", best["bank_code"])
-        else:
-            # Find lowest sell rate
-            best = min(rates, key=lambda r: r.get("sell_rate") or r.get("official_rate") or float('inf'))
-            current = best.get("sell_rate") or best.get("official_rate") or 0
-            bank_name = BANKS.get(best["bank_code"], {}).get("name_uz", best["bank_code"])
-    else:
-        # Normal bank alert
-        rate = await get_rate(alert.bank_code, alert.currency_code)
-        if not rate:
-            return
-        
-        if alert.rate_type == "buy":
-            current = rate.get("buy_rate") or rate.get("official_rate") or 0
-        else:
-            current = rate.get("sell_rate") or rate.get("official_rate") or 0
-        
-        bank_name = BANKS.get(alert.bank_code, {}).get("name_uz", alert.bank_code)
-    
-    # Check trigger condition
-    triggered = False
-    if alert.direction == "above" and current >= alert.threshold:
-        triggered = True
-    elif alert.direction == "below" and current <= alert.threshold:
-        triggered = True
-    
-    if triggered:
-        rate_text = "Sotib olish" if alert.rate_type == "buy" else "Sotish"
-        dir_text = "oshdi" if alert.direction == "above" else "tushdi"
-        
-        message = (
-            f"🔔 **Alert!**\n\n"
-            f"💱 **{alert.currency_code}** {dir_text}!\n"
-            f"🏦 {bank_name}\n"
-            f"📊 {rate_text}: **{current:,.0f}** so'm\n"
-            f"🎯 Sizning chegarangiz: {alert.threshold:,.0f}"
-        )
-        
-        try:
-            await notification_callback(alert.user_id, message)
-        except Exception as e:
-            logger.error(f"Failed to send alert: {e}")
-        
-        # Update alert
-        alert.is_triggered = True
-        alert.last_triggered_at = datetime.utcnow()
-        
-        # If repeating, reset
-        if alert.is_repeating:
-            alert.is_triggered = False
-        
-        await session.commit()
+    for currency in POPULAR_CURRENCIES[:5]:
+        rate = rates.get(currency)
+        if rate:
+            official = rate.get("official_rate", 0)
+            diff = rate.get("diff", 0)
+            
+            if diff > 0:
+                change = f"📈+{diff:.0f}"
+            elif diff < 0:
+                change = f"📉{diff:.0f}"
+            else:
+                change = "➖"
+            
+            message += f"💱 **{currency}**: {official:,.0f} {change}\n"
+    
+    return message
 
 
 async def daily_notification_check():
@@ -218,63 +209,61 @@ async def daily_notification_check():
     
     now = datetime.now(UZ_TZ)
     current_time = now.strftime("%H:%M")
-    today = now.date()
+    # last_daily_sent is stored as naive Tashkent time
+    local_now = now.replace(tzinfo=None)
+    midnight = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
     
     # Also check previous minute to avoid missing due to scheduler offset
     prev_minute = (now - timedelta(minutes=1)).strftime("%H:%M")
     
     async with get_session() as session:
-        # Match current minute OR previous minute (2-minute window)
+        # Match current minute OR previous minute (2-minute window), not sent today
         result = await session.execute(
-            select(User).where(
+            select(User.id, User.language).where(
                 User.daily_notify == True,
+                User.daily_notify_time.in_((current_time, prev_minute)),
                 User.is_active == True,
-                (User.daily_notify_time == current_time) | (User.daily_notify_time == prev_minute)
+                (User.last_daily_sent == None) | (User.last_daily_sent < midnight)
             )
         )
-        users = result.scalars().all()
-        
-        for user in users:
-            # Check if already sent today
-            if user.last_daily_sent and user.last_daily_sent.date() == today:
-                continue
-            
-            # Build message
-            message = f"📅 **Bugungi kurslar** ({current_time})\n🏛️ Markaziy Bank\n\n"
-            
-            for currency in POPULAR_CURRENCIES[:5]:
-                rate = await get_rate("cbu", currency)
-                if rate:
-                    official = rate.get("official_rate", 0)
-                    diff = rate.get("diff", 0)
-                    
-                    if diff > 0:
-                        change = f"📈+{diff:.0f}"
-                    elif diff < 0:
-                        change = f"📉{diff:.0f}"
-                    else:
-                        change = "➖"
-                    
-                    message += f"💱 **{currency}**: {official:,.0f} {change}\n"
-            
-            try:
-                await notification_callback(user.id, message)
-                user.last_daily_sent = now
-                await session.commit()
-            except Exception as e:
-                logger.error(f"Daily notify failed for {user.id}: {e}")
+        users = result.all()
+    
+    if not users:
+        return
+    
+    # Same CBU rates for everyone: render once per language
+    rates = {currency: await get_rate("cbu", currency) for currency in POPULAR_CURRENCIES[:5]}
+    digests = {}
+    
+    queued = []
+    for user_id, lang in users:
+        if lang not in digests:
+            digests[lang] = render_daily_digest(lang, current_time, rates)
+        try:
+            await notification_callback(user_id, digests[lang], job="daily")
+            queued.append(user_id)
+        except Exception as e:
+            logger.error(f"Daily notify failed for {user_id}: {e}")
+    
+    async with get_session() as session:
+        for i in range(0, len(queued), 500):
+            await session.execute(
+                update(User)
+                .where(User.id.in_(queued[i:i + 500]))
+                .values(last_daily_sent=local_now)
+            )
+        await session.commit()
+    
+    logger.info(f"Daily digest queued for {len(queued)} users")
 
 
 async def weekly_report_job():
-    """Send weekly report on Monday at 10:00"""
-    if not notification_callback:
-        return
-    
+    """Queue weekly report on Monday at 10:00 (delivered through the outbox)"""
     async with get_session() as session:
         result = await session.execute(
-            select(User).where(User.weekly_report == True, User.is_active == True)
+            select(User.id).where(User.weekly_report == True, User.is_active == True)
         )
-        users = result.scalars().all()
+        user_ids = result.scalars().all()
     
     message = "📊 **Haftalik hisobot**\n🏛️ Markaziy Bank\n\n"
     
@@ -286,11 +275,9 @@ async def weekly_report_job():
     
     message += "\n_Yaxshi hafta tilayman!_ 🎯"
     
-    for user in users:
-        try:
-            await notification_callback(user.id, message)
-        except Exception as e:
-            logger.error(f"Weekly report failed for {user.id}: {e}")
+    # One run per ISO week: a restart or re-run only fills in missing users
+    period = datetime.now(UZ_TZ).strftime("%G-W%V")
+    await enqueue_outbox("weekly_report", period, user_ids, message)
 
 
 async def check_smart_exchanges():
@@ -321,21 +308,15 @@ async def check_smart_exchanges():
                     if (datetime.utcnow() - last_utc).total_seconds() < 300:
                         continue
                 
-                # Get current best buy rate for this currency
-                rates = await get_rates_by_currency(exchange.currency_code)
-                if not rates:
+                # Current best buy rate for this currency
+                ranking = await get_currency_ranking(exchange.currency_code)
+                if not ranking or ranking.best_bank_buy is None:
                     continue
                 
-                best_rate = 0
-                best_bank = ""
-                best_bank_code = ""
-                
-                for rate in rates:
-                    buy = rate.get("buy_rate") or 0
-                    if buy > best_rate:
-                        best_rate = buy
-                        best_bank = rate.get("bank_name", rate.get("bank_code", ""))
-                        best_bank_code = rate.get("bank_code", "")
+                best = ranking.best_bank_buy
+                best_rate = best["buy_rate"]
+                best_bank = best.get("bank_name", best["bank_code"])
+                best_bank_code = best["bank_code"]
                 
                 # Check if rate meets the target
                 target_rate = exchange.initial_best_rate + exchange.target_increase
@@ -369,7 +350,8 @@ async def check_smart_exchanges():
                         # For now, just send plain message
                         await notification_callback(
                             exchange.user_id, 
-                            message + f"\n\n[Qabul qilish uchun /start bosing]"
+                            message + f"\n\n[Qabul qilish uchun /start bosing]",
+                            job="smart_exchange"
                         )
                     except Exception as e:
                         logger.error(f"Smart exchange notification error: {e}")
@@ -384,7 +366,7 @@ async def check_smart_exchanges():
 
 async def run_initial_update():
     """Run initial update"""
-    await update_all_rates()
+    await refresh_rates_shared()
 
 
 def start_scheduler():
@@ -421,15 +403,23 @@ def start_scheduler():
         replace_existing=True
     )
     
-    # Rate history save every 15 minutes (not every minute to reduce DB size)
+    # Pre-render popular charts after history saves, outside the rate update job
+    scheduler.add_job(
+        prerender_charts,
+        IntervalTrigger(seconds=UPDATE_INTERVAL),
+        id="prerender_charts",
+        replace_existing=True
+    )
+    
+    # Hourly/daily OHLC rollup of rate history
     scheduler.add_job(
-        save_rate_history,
-        IntervalTrigger(minutes=15),
-        id="save_history",
+        rollup_history,
+        CronTrigger(minute=5, timezone=UZ_TZ),
+        id="rollup_history",
         replace_existing=True
     )
     
-    # Cleanup old history daily at 3:00 AM (30-day retention)
+    # Per-tier history retention daily at 3:00 AM
     scheduler.add_job(
         cleanup_old_history,
         CronTrigger(hour=3, minute=0, timezone=UZ_TZ),
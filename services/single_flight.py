@@ -0,0 +1,49 @@
+"""
+Single Flight - Concurrent identical requests share one computation
+
+The first caller for a key starts the work; callers arriving while it is
+in flight await the same result (or exception) instead of repeating it.
+Once the work finishes the key is free again, so nothing is cached beyond
+the flight itself. A caller that is cancelled (e.g. its update handler is
+dropped) does not cancel the work the others are waiting for.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key"""
+
+    def __init__(self):
+        self._flights: dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        # Mark the exception retrieved even if every caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) unless a call with the same key is in flight"""
+        future = self._flights.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._flights[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+            self.started += 1
+        else:
+            self.joined += 1
+            logger.debug(f"Joined in-flight call {key}")
+        return await asyncio.shield(future)
+
+
+single_flight = SingleFlight()
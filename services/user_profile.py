@@ -0,0 +1,121 @@
+"""
+User Profile Cache - Language, notification flags and favorite banks
+
+Nearly every tap needs the user's language, and several screens need the
+settings flags or favorite banks. Profiles are loaded once, kept for
+USER_CACHE_TTL seconds in a size-bounded LRU and dropped explicitly by
+every handler that changes them, so ordinary navigation runs no queries.
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import select
+
+from database.db import get_session
+from database.models import User, FavoriteBank
+from config import USER_CACHE_TTL, USER_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """Read-only copy of the user fields handlers look at"""
+    id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    language: str
+    is_active: bool
+    daily_notify: bool
+    daily_notify_time: Optional[str]
+    weekly_report: bool
+    big_change_notify: bool
+    favorites: tuple[str, ...] = ()
+
+
+def make_profile(user: User, favorites: list[str]) -> UserProfile:
+    return UserProfile(
+        id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        language=user.language or "uz",
+        is_active=user.is_active,
+        daily_notify=user.daily_notify,
+        daily_notify_time=user.daily_notify_time,
+        weekly_report=user.weekly_report,
+        big_change_notify=user.big_change_notify,
+        favorites=tuple(favorites),
+    )
+
+
+class ProfileCache:
+    """LRU of profiles with a TTL; unknown users are cached as None"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[Optional[UserProfile], float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, user_id: int) -> tuple[bool, Optional[UserProfile]]:
+        """(found, profile); found is False when missing or expired"""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, user_id: int, profile: Optional[UserProfile]) -> None:
+        self._entries[user_id] = (profile, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+profile_cache = ProfileCache()
+
+
+async def load_profile(session, user_id: int) -> Optional[UserProfile]:
+    """Read a profile from the database and cache it"""
+    result = await session.execute(select(User).where(User.id == user_id))
+    user = result.scalar_one_or_none()
+    if user is None:
+        profile_cache.put(user_id, None)
+        return None
+
+    result = await session.execute(
+        select(FavoriteBank.bank_code).where(FavoriteBank.user_id == user_id).order_by(FavoriteBank.id)
+    )
+    profile = make_profile(user, list(result.scalars().all()))
+    profile_cache.put(user_id, profile)
+    return profile
+
+
+async def get_profile(user_id: int) -> Optional[UserProfile]:
+    """Cached profile of a user, None if the user never started the bot"""
+    found, profile = profile_cache.lookup(user_id)
+    if found:
+        return profile
+    async with get_session() as session:
+        return await load_profile(session, user_id)
+
+
+def invalidate_profile(user_id: int) -> None:
+    """Drop a cached profile after changing the user or their favorites"""
+    profile_cache.invalidate(user_id)